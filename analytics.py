@@ -0,0 +1,1009 @@
+"""
+Product analytics pipeline shared by the API endpoints.
+"""
+from datetime import date, timedelta
+from collections import Counter
+from itertools import groupby
+
+from sqlalchemy import func, cast, Integer, LargeBinary, case, select, null, or_
+
+from models import get_db_model, get_tenant
+from rollup import rollup_is_fresh, query_rollup_aggregates, rollup_totals_ctes
+from export import STREAM_BATCH_SIZE
+from kpis import apply_kpis, TRAILING_WINDOWS, TRAILING_FIELDS, trailing_fields
+from instrumentation import stage
+from idsets import query_by_ids
+from catalog import get_catalog
+
+# Fields always returned, whatever fields= asks for
+IDENTITY_FIELDS = ("item_id", "item_name", "product_type")
+
+# Aggregate queries each optional field depends on. The sell-rate KPIs need
+# size_data because sold-out rows are measured up to their last sale.
+FIELD_QUERIES = {
+    "item_type": set(),
+    "day_since_launch": set(),
+    "current_stock": set(),
+    "sale_price": set(),
+    "total_quantity_sold": {"qty_sold"},
+    "total_stock_percentage_sold": {"qty_sold"},
+    "per_day_qty_average": {"qty_sold", "size_data"},
+    "projected_days_to_sell_out": {"qty_sold", "size_data"},
+    "total_views": {"views_atc"},
+    "total_atc": {"views_atc"},
+    "size_summary": {"size_data"},
+    **{field: {"trailing"} for field in TRAILING_FIELDS},
+}
+ALL_QUERIES = frozenset(("qty_sold", "views_atc", "size_data", "trailing"))
+
+
+def launch_window(today: date, launch_start_days: int, launch_end_days: int):
+    """
+    Converts a days-since-launch range into a (from, to) launch date range,
+    so the filter can use an index on the launch date column.
+    """
+    launch_from = today - timedelta(days=launch_end_days)
+    launch_to = today - timedelta(days=launch_start_days)
+    return launch_from, launch_to
+
+
+def trailing_cutoffs(today: date):
+    """
+    Returns {days: first date} of each trailing window ending today.
+    """
+    return {days: today - timedelta(days=days - 1) for days in TRAILING_WINDOWS}
+
+
+def trailing_sale_columns(Sale, today: date):
+    """
+    Conditional sums of quantity sold per trailing window, computed in the
+    same scan as the query they are added to.
+    """
+    return [
+        func.coalesce(func.sum(case((Sale.Date >= cutoff, Sale.Quantity), else_=0)), 0).label(trailing_fields(days)[0])
+        for days, cutoff in trailing_cutoffs(today).items()
+    ]
+
+
+def trailing_views_columns(ViewsAtc, today: date):
+    """
+    Conditional sums of views and ATC per trailing window.
+    """
+    columns = []
+    for days, cutoff in trailing_cutoffs(today).items():
+        _, views_field, atc_field, _ = trailing_fields(days)
+        columns += [
+            func.coalesce(func.sum(case((ViewsAtc.Date >= cutoff, ViewsAtc.Items_Viewed), else_=0)), 0).label(views_field),
+            func.coalesce(func.sum(case((ViewsAtc.Date >= cutoff, ViewsAtc.Items_Addedtocart), else_=0)), 0).label(atc_field),
+        ]
+    return columns
+
+
+def trailing_values(trailing_map, qty_ids, view_ids):
+    """
+    Returns the trailing window fields of one product: quantities summed
+    over qty_ids, views and ATC over view_ids. The per-day velocities are
+    left to apply_kpis, and every field is None when trailing_map is None.
+    """
+    values = dict.fromkeys(TRAILING_FIELDS)
+    if trailing_map is None:
+        return values
+    for days in TRAILING_WINDOWS:
+        qty_field, views_field, atc_field, _ = trailing_fields(days)
+        for field, ids in ((qty_field, qty_ids), (views_field, view_ids), (atc_field, view_ids)):
+            values[field] = sum(trailing_map[item_id][field] for item_id in ids if item_id in trailing_map)
+    return values
+
+
+def parse_fields(fields: str):
+    """
+    Parses a comma-separated fields= value into a sorted tuple of field
+    names, or None for all fields. Raises ValueError for unknown fields.
+    """
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - set(FIELD_QUERIES) - set(IDENTITY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted(names))
+
+
+def required_queries(fields):
+    """
+    Returns the aggregate queries needed to build fields (None means all).
+    """
+    if fields is None:
+        return ALL_QUERIES
+    queries = set()
+    for name in fields:
+        queries |= FIELD_QUERIES.get(name, set())
+    return frozenset(queries)
+
+
+def select_fields(results, fields):
+    """
+    Drops the fields of each result that were not asked for.
+    """
+    if fields is None:
+        return results
+    keep = set(fields) | set(IDENTITY_FIELDS)
+    return [{key: value for key, value in result.items() if key in keep} for result in results]
+
+
+def fetch_products_by_name(session, db_name: str, launch_start_days: int, launch_end_days: int, fields=None):
+    """
+    Per (item_name, product_type) product metrics. The grouping, sums, modal
+    sale price and size counts are computed by the database, which returns
+    one row per group, or one per variant when the size breakdown is needed.
+    """
+    today = date.today()
+    queries = required_queries(fields)
+
+    with stage("rollup_check"):
+        use_rollup = bool(queries) and rollup_is_fresh(session, db_name)
+    stmt, group_column = grouped_products_query(
+        db_name, today, launch_start_days, launch_end_days, queries, use_rollup
+    )
+
+    with stage("groups") as timing:
+        rows = session.execute(stmt).all()
+        timing.rows = len(rows)
+
+    with stage("build") as timing:
+        results = build_sql_grouped_results(today, rows, group_column, with_sizes="size_data" in queries)
+        results = select_fields(results, fields)
+        timing.rows = len(results)
+    return today, results
+
+
+def grouped_products_query(db_name: str, today: date, launch_start_days: int, launch_end_days: int,
+                           queries=ALL_QUERIES, use_rollup: bool = False):
+    """
+    Builds the /products/by_name statement. Rows carry the lifetime and
+    trailing window totals of their (Item_Name, category) group, its modal
+    sale price (ties go to the price seen first) and size counts, ordered by
+    each group's lowest Item_Id.
+    There is one row per group, or one per variant with its size-level
+    columns when size_data is in queries. Per-item totals come from
+    item_rollup when use_rollup is set. Returns (statement, group_column).
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+
+    group_column = tenant.group_column
+    size_column = tenant.size_column if tenant.has_size else null()
+    launch_from, launch_to = launch_window(today, launch_start_days, launch_end_days)
+    group_partition = tenant.group_keys
+    price_partition = (*tenant.group_keys, cast(Item.Sale_Price, Integer))
+
+    window_items = (
+        select(
+            Item.Item_Id,
+            Item.Item_Name,
+            Item.Item_Type,
+            group_column.label(group_column.key),
+            Item.launch_date.label("launch_date"),
+            cast(Item.Current_Stock, Integer).label("current_stock"),
+            cast(Item.Sale_Price, Integer).label("sale_price"),
+            size_column.label("size"),
+            # A group is identified by its lowest Item_Id, which also orders the groups
+            func.min(Item.Item_Id).over(partition_by=group_partition).label("group_id"),
+            # How often the item's price occurs in its group, and where it first occurs
+            func.count().over(partition_by=price_partition).label("price_count"),
+            func.min(Item.Item_Id).over(partition_by=price_partition).label("price_first_id"),
+        )
+        .where(Item.launch_date.between(launch_from, launch_to))
+        .cte("window_items")
+    )
+    window_ids = select(window_items.c.Item_Id)
+
+    with_sales = "qty_sold" in queries or "size_data" in queries
+    with_views = "views_atc" in queries
+    with_trailing = "trailing" in queries
+    trailing_sale_fields = [trailing_fields(days)[0] for days in TRAILING_WINDOWS]
+    trailing_views_fields = [field for days in TRAILING_WINDOWS for field in trailing_fields(days)[1:3]]
+    if use_rollup:
+        sale_totals, views_totals = rollup_totals_ctes(window_ids)
+        # The rollup has no dates, so trailing windows read the recent raw rows
+        earliest = min(trailing_cutoffs(today).values(), default=today)
+        trailing_sale = (
+            select(Sale.Item_Id, *trailing_sale_columns(Sale, today))
+            .where(Sale.Item_Id.in_(window_ids), Sale.Date >= earliest)
+            .group_by(Sale.Item_Id)
+            .cte("trailing_sale")
+        )
+        trailing_views = (
+            select(ViewsAtc.Item_Id, *trailing_views_columns(ViewsAtc, today))
+            .where(ViewsAtc.Item_Id.in_(window_ids), ViewsAtc.Date >= earliest)
+            .group_by(ViewsAtc.Item_Id)
+            .cte("trailing_views")
+        )
+    else:
+        sale_totals = (
+            select(
+                Sale.Item_Id,
+                func.sum(Sale.Quantity).label("qty_sold"),
+                func.count(Sale.Date).label("sale_count"),
+                func.min(Sale.Date).label("first_sale"),
+                func.max(Sale.Date).label("last_sale"),
+                *(trailing_sale_columns(Sale, today) if with_trailing else []),
+            )
+            .where(Sale.Item_Id.in_(window_ids))
+            .group_by(Sale.Item_Id)
+            .cte("sale_totals")
+        )
+        views_totals = (
+            select(
+                ViewsAtc.Item_Id,
+                func.sum(ViewsAtc.Items_Viewed).label("views"),
+                func.sum(ViewsAtc.Items_Addedtocart).label("atc"),
+                *(trailing_views_columns(ViewsAtc, today) if with_trailing else []),
+            )
+            .where(ViewsAtc.Item_Id.in_(window_ids))
+            .group_by(ViewsAtc.Item_Id)
+            .cte("views_totals")
+        )
+        # Trailing windows are summed in the same scan as the lifetime totals
+        trailing_sale, trailing_views = sale_totals, views_totals
+
+    variant_columns = [
+        window_items.c.group_id,
+        window_items.c.Item_Id,
+        window_items.c.Item_Name,
+        window_items.c.Item_Type,
+        window_items.c[group_column.key],
+        window_items.c.launch_date,
+        window_items.c.size,
+        window_items.c.current_stock,
+        func.first_value(window_items.c.sale_price).over(
+            partition_by=window_items.c.group_id,
+            order_by=(window_items.c.price_count.desc(), window_items.c.price_first_id),
+        ).label("sale_price"),
+    ]
+    if with_sales:
+        variant_columns += [
+            func.coalesce(sale_totals.c.qty_sold, 0).label("qty_sold"),
+            func.coalesce(
+                case(
+                    (sale_totals.c.sale_count > 1,
+                     (func.datediff(sale_totals.c.last_sale, sale_totals.c.first_sale) /
+                      (sale_totals.c.sale_count - 1))
+                    ),
+                    else_=0
+                ), 0
+            ).label("avg_days_between_sales"),
+            func.coalesce(func.datediff(func.current_date(), sale_totals.c.last_sale), 0).label("days_since_last_sold"),
+        ]
+    else:
+        variant_columns += [null().label("qty_sold"), null().label("avg_days_between_sales"),
+                            null().label("days_since_last_sold")]
+    if with_views:
+        variant_columns += [func.coalesce(views_totals.c.views, 0).label("views"),
+                            func.coalesce(views_totals.c.atc, 0).label("atc")]
+    else:
+        variant_columns += [null().label("views"), null().label("atc")]
+    for totals, fields in ((trailing_sale, trailing_sale_fields), (trailing_views, trailing_views_fields)):
+        variant_columns += [
+            func.coalesce(totals.c[field], 0).label(field) if with_trailing else null().label(field)
+            for field in fields
+        ]
+
+    joins = []
+    if with_sales:
+        joins.append(sale_totals)
+    if with_views:
+        joins.append(views_totals)
+    if with_trailing:
+        joins += [totals for totals in (trailing_sale, trailing_views) if totals not in joins]
+    variants = select(*variant_columns).select_from(window_items)
+    for totals in joins:
+        variants = variants.outerjoin(totals, totals.c.Item_Id == window_items.c.Item_Id)
+    variants = variants.cte("variants")
+    trailing_sums = trailing_sale_fields + trailing_views_fields
+
+    c = variants.c
+    in_stock = case((c.current_stock > 0, 1), else_=0)
+    if "size_data" in queries:
+        # Group totals as window aggregates alongside each variant's own columns
+        group = {"partition_by": c.group_id}
+        stmt = select(
+            c.group_id,
+            c.Item_Id,
+            c.Item_Name,
+            c.Item_Type,
+            c[group_column.key],
+            c.launch_date,
+            c.sale_price,
+            c.size,
+            c.current_stock.label("variant_stock"),
+            c.qty_sold,
+            c.avg_days_between_sales,
+            c.days_since_last_sold,
+            cast(func.sum(c.current_stock).over(**group), Integer).label("current_stock"),
+            func.sum(c.qty_sold).over(**group).label("total_quantity_sold"),
+            func.sum(c.views).over(**group).label("total_views"),
+            func.sum(c.atc).over(**group).label("total_atc"),
+            func.sum(in_stock).over(**group).label("variants_in_stock"),
+            func.min(c.days_since_last_sold).over(**group).label("last_sale_days"),
+            *[func.sum(c[field]).over(**group).label(field) for field in trailing_sums],
+        ).order_by(c.group_id, c.Item_Id)
+    else:
+        def first_variant(column):
+            return func.max(case((c.Item_Id == c.group_id, column))).label(column.key)
+
+        stmt = (
+            select(
+                c.group_id,
+                first_variant(c.Item_Name),
+                first_variant(c.Item_Type),
+                first_variant(c[group_column.key]),
+                first_variant(c.launch_date),
+                func.max(c.sale_price).label("sale_price"),
+                cast(func.sum(c.current_stock), Integer).label("current_stock"),
+                func.sum(c.qty_sold).label("total_quantity_sold"),
+                func.sum(c.views).label("total_views"),
+                func.sum(c.atc).label("total_atc"),
+                func.sum(in_stock).label("variants_in_stock"),
+                func.min(c.days_since_last_sold).label("last_sale_days"),
+                *[func.sum(c[field]).label(field) for field in trailing_sums],
+            )
+            .group_by(c.group_id)
+            .order_by(c.group_id)
+        )
+    return stmt, group_column
+
+
+def build_sql_grouped_results(today, rows, group_column, with_sizes: bool = True):
+    """
+    Builds the build_grouped_results output from the rows of
+    grouped_products_query; with_sizes says whether they are variant rows.
+    """
+    group_key = group_column.key
+    results = []
+    launch_dates = []
+    last_sale_days = []
+    for _, group_rows in groupby(rows, key=lambda row: row.group_id):
+        group_rows = list(group_rows)
+        # The first row is the group's lowest Item_Id
+        row = group_rows[0]
+        sizewise_list = [
+            {
+                "size": variant.size,
+                "item_id": variant.Item_Id,
+                "variant_stock": variant.variant_stock,
+                "variant_quantity_sold": variant.qty_sold,
+                "average_days_between_sales": round(variant.avg_days_between_sales or 0, 2),
+                "days_since_last_sold": variant.days_since_last_sold
+            }
+            for variant in group_rows
+        ] if with_sizes else []
+
+        launch_dates.append(row.launch_date)
+        last_sale_days.append(row.last_sale_days if with_sizes else None)
+
+        # KPI fields are filled in below, in one batch
+        results.append({
+            "item_name": row.Item_Name,
+            "item_type": row.Item_Type,
+            "product_type": getattr(row, group_key),
+            "day_since_launch": None,
+            "current_stock": row.current_stock,
+            "sale_price": row.sale_price,
+            "total_quantity_sold": row.total_quantity_sold or 0,
+            "total_views": row.total_views or 0,
+            "total_atc": row.total_atc or 0,
+            "total_stock_percentage_sold": None,
+            "projected_days_to_sell_out": None,
+            "per_day_qty_average": None,
+            **{field: getattr(row, field, None) for field in TRAILING_FIELDS},
+            "size_summary": {
+                "size": f"'{row.variants_in_stock if with_sizes else 0}/{len(sizewise_list)}",
+                "sizewise": sizewise_list
+            }
+        })
+
+    apply_kpis(today, results, launch_dates, last_sale_days)
+    return results
+
+
+def build_grouped_results(today, items_query, group_column, qty_sold_map, views_atc_map, size_data_map,
+                          trailing_map=None):
+    """
+    Builds the per (item_name, product_type) product metrics from the item
+    rows and the sale, views/ATC, size-level and trailing window lookups.
+    """
+    # Group by item_name + product_type
+    group_key = group_column.key
+    grouped_map = {}
+    for item in items_query:
+        item_name = item.Item_Name
+        product_type = getattr(item, group_key, None)
+        key = (item_name, product_type)
+        if key not in grouped_map:
+            grouped_map[key] = {
+                "item_type": item.Item_Type,
+                "launch_date": item.launch_date,
+                "variants": []
+            }
+        grouped_map[key]["variants"].append({
+            "item_id": item.Item_Id,
+            "size": getattr(item, "Size", None),
+            "current_stock": item.current_stock,
+            "sale_price": item.sale_price,
+            "qty_sold": qty_sold_map.get(item.Item_Id, 0),
+            "size_data": size_data_map.get(item.Item_Id, [])
+        })
+
+    # Build results
+    results = []
+    launch_dates = []
+    last_sale_days = []
+    for key, group in grouped_map.items():
+        item_name, product_type = key
+        item_type = group["item_type"]
+        launch_date = group["launch_date"]
+        variants = group["variants"]
+
+        variant_ids = [v["item_id"] for v in variants]
+        total_current_stock = sum(v["current_stock"] for v in variants)
+        sale_price_counter = Counter([v["sale_price"] for v in variants])
+        sale_price = sale_price_counter.most_common(1)[0][0]
+        total_quantity_sold = sum(v["qty_sold"] for v in variants)
+        views_data = views_atc_map.get((item_name, product_type), {"total_views": 0, "total_atc": 0})
+        total_views = views_data["total_views"]
+        total_atc = views_data["total_atc"]
+
+        # Size summary
+        all_size_data = []
+        for v in variants:
+            all_size_data.extend(v["size_data"])
+        total_variants = len(all_size_data)
+        variants_in_stock = sum(1 for sd in all_size_data if sd[1] > 0)
+        sizewise_list = [
+            {
+                "size": sd[0],
+                "item_id": v["item_id"],
+                "variant_stock": sd[1],
+                "variant_quantity_sold": sd[2],
+                "average_days_between_sales": round(sd[3] or 0, 2),
+                "days_since_last_sold": sd[4]
+            }
+            for v in variants for sd in v["size_data"]
+        ]
+
+        launch_dates.append(launch_date)
+        last_sale_days.append(
+            min([sv["days_since_last_sold"] for sv in sizewise_list if sv["days_since_last_sold"] is not None], default=None)
+        )
+
+        # KPI fields are filled in below, in one batch
+        results.append({
+            "item_name": item_name,
+            "item_type": item_type,
+            "product_type": product_type,
+            "day_since_launch": None,
+            "current_stock": total_current_stock,
+            "sale_price": sale_price,
+            "total_quantity_sold": total_quantity_sold,
+            "total_views": total_views,
+            "total_atc": total_atc,
+            "total_stock_percentage_sold": None,
+            "projected_days_to_sell_out": None,
+            "per_day_qty_average": None,
+            **trailing_values(trailing_map, variant_ids, variant_ids),
+            "size_summary": {
+                "size": f"'{variants_in_stock}/{total_variants}",
+                "sizewise": sizewise_list
+            }
+        })
+
+    apply_kpis(today, results, launch_dates, last_sale_days)
+    return results
+
+
+def query_window_items(session, db_name: str, today: date, launch_start_days: int, launch_end_days: int,
+                       with_size: bool = False, after_id: int = None, limit: int = None, item_names=None):
+    """
+    Returns the items launched within the window, optionally with their size.
+    after_id and limit return one keyset page ordered by Item_Id; item_names
+    restricts the items to those names. Plain window queries are answered
+    from the in-memory catalog snapshot when it is enabled.
+    """
+    tenant = get_tenant(db_name)
+    Item = tenant.Item
+
+    group_column = tenant.group_column
+    launch_from, launch_to = launch_window(today, launch_start_days, launch_end_days)
+
+    if after_id is None and limit is None and item_names is None:
+        catalog = get_catalog(session, db_name)
+        if catalog is not None:
+            return catalog.window(launch_from, launch_to)
+
+    columns = [
+        Item.Item_Id,
+        Item.Item_Name,
+        Item.Item_Type,
+        group_column,
+        Item.launch_date,
+        cast(Item.Current_Stock, Integer).label("current_stock"),
+        cast(Item.Sale_Price, Integer).label("sale_price"),
+    ]
+    if with_size:
+        columns.append(tenant.size_column)
+
+    query = session.query(*columns).filter(Item.launch_date.between(launch_from, launch_to))
+    if item_names is not None:
+        names = [name for name in item_names if name is not None]
+        if len(names) < len(item_names):
+            query = query.filter(or_(Item.Item_Name.in_(names), Item.Item_Name.is_(None)))
+        else:
+            query = query.filter(Item.Item_Name.in_(names))
+    if after_id is not None:
+        query = query.filter(Item.Item_Id > after_id)
+    if limit is not None:
+        query = query.order_by(Item.Item_Id).limit(limit)
+    return query.all()
+
+
+def window_item_ids(db_name: str, today: date, launch_start_days: int, launch_end_days: int):
+    """
+    Returns a select of the Item_Ids query_window_items returns for the window.
+    """
+    Item = get_tenant(db_name).Item
+    launch_from, launch_to = launch_window(today, launch_start_days, launch_end_days)
+    return select(Item.Item_Id).where(Item.launch_date.between(launch_from, launch_to))
+
+
+def query_qty_sold(session, db_name: str, item_ids):
+    """
+    Returns {Item_Id: total quantity sold} for item_ids.
+    """
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+
+    return {
+        row.Item_Id: row.total_qty
+        for row in session.query(
+            Sale.Item_Id,
+            func.coalesce(func.sum(Sale.Quantity), 0).label("total_qty")
+        )
+        .filter(Sale.Item_Id.in_(item_ids))
+        .group_by(Sale.Item_Id)
+        .all()
+    }
+
+
+def query_views_atc(session, db_name: str, item_ids):
+    """
+    Returns {(Item_Name, category): {"total_views", "total_atc"}} for item_ids.
+    """
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+
+    tenant = get_tenant(db_name)
+    group_column = tenant.group_column
+
+    views_atc_map = {}
+    views_rows = (
+        session.query(
+            Item.Item_Name,
+            group_column.label("category"),
+            func.coalesce(func.sum(ViewsAtc.Items_Viewed), 0).label("total_views"),
+            func.coalesce(func.sum(ViewsAtc.Items_Addedtocart), 0).label("total_atc")
+        )
+        .join(ViewsAtc, ViewsAtc.Item_Id == Item.Item_Id)
+        .filter(Item.Item_Id.in_(item_ids))
+        .group_by(Item.Item_Name, group_column, *tenant.group_keys)
+        .all()
+    )
+    for row in views_rows:
+        views_atc_map[(row.Item_Name, row.category)] = {
+            "total_views": row.total_views,
+            "total_atc": row.total_atc
+        }
+    return views_atc_map
+
+
+def query_size_data(session, db_name: str, item_ids):
+    """
+    Returns {Item_Id: [(size, stock, qty sold, avg days between sales,
+    days since last sold)]} for item_ids.
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+
+    size_data_map = {}
+    size_rows = (
+        session.query(
+            Item.Item_Id,
+            tenant.size_column,
+            cast(Item.Current_Stock, Integer),
+            func.coalesce(func.sum(Sale.Quantity), 0).label("qty_sold"),
+            # avg days between sales
+            func.coalesce(
+                case(
+                    (func.count(Sale.Date) > 1,
+                     (func.datediff(func.max(Sale.Date), func.min(Sale.Date)) /
+                      (func.count(Sale.Date) - 1))
+                    ),
+                    else_=0
+                ), 0
+            ).label("avg_days_between_sales"),
+            func.coalesce(func.datediff(func.current_date(), func.max(Sale.Date)), 0).label("days_since_last_sold")
+        )
+        .outerjoin(Sale, Sale.Item_Id == Item.Item_Id)
+        .filter(Item.Item_Id.in_(item_ids))
+        .group_by(Item.Item_Id, tenant.size_column if tenant.has_size else Item.Item_Id, Item.Current_Stock)
+        .all()
+    )
+    for row in size_rows:
+        item_id = row[0]
+        if item_id not in size_data_map:
+            size_data_map[item_id] = []
+        size_data_map[item_id].append(row[1:])
+    return size_data_map
+
+
+def query_trailing_totals(session, db_name: str, item_ids, today: date):
+    """
+    Returns {Item_Id: {qty_sold_<n>d, views_<n>d, atc_<n>d}} for item_ids.
+    Every window is summed in one scan each of sale and viewsatc, limited
+    to the longest window.
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+
+    trailing_map = {}
+    if not TRAILING_WINDOWS:
+        return trailing_map
+    earliest = min(trailing_cutoffs(today).values())
+    empty = {field: 0 for days in TRAILING_WINDOWS for field in trailing_fields(days)[:3]}
+
+    sale_rows = (
+        session.query(Sale.Item_Id, *trailing_sale_columns(Sale, today))
+        .filter(Sale.Item_Id.in_(item_ids), Sale.Date >= earliest)
+        .group_by(Sale.Item_Id)
+        .all()
+    )
+    views_rows = (
+        session.query(Item.Item_Id, *trailing_views_columns(ViewsAtc, today))
+        .join(ViewsAtc, ViewsAtc.Item_Id == Item.Item_Id)
+        .filter(Item.Item_Id.in_(item_ids), ViewsAtc.Date >= earliest)
+        .group_by(Item.Item_Id)
+        .all()
+    )
+    for row in sale_rows + views_rows:
+        values = row._asdict()
+        item_id = values.pop("Item_Id")
+        trailing_map.setdefault(item_id, dict(empty)).update(values)
+    return trailing_map
+
+
+def load_trailing_totals(session, db_name: str, item_ids, today: date, queries=ALL_QUERIES, source=None):
+    """
+    query_trailing_totals over item_ids, passed as load_item_aggregates
+    does. Returns None when "trailing" is not in queries.
+    """
+    if "trailing" not in queries:
+        return None
+    with stage("trailing") as timing:
+        trailing_map = query_by_ids(session, query_trailing_totals, db_name, item_ids, today,
+                                    source=source, id_type=get_tenant(db_name).Item.Item_Id.type)
+        timing.rows = len(trailing_map)
+    return trailing_map
+
+
+def query_item_aggregates(session, db_name: str, item_ids, queries=ALL_QUERIES):
+    """
+    Aggregates sale and viewsatc for item_ids. Returns the per-item quantity
+    sold, views/ATC per (Item_Name, category) and size-level rows per item.
+    Maps not named in queries are returned empty without being queried.
+    """
+    qty_sold_map, views_atc_map, size_data_map = {}, {}, {}
+    if "qty_sold" in queries:
+        with stage("sale") as timing:
+            qty_sold_map = query_qty_sold(session, db_name, item_ids)
+            timing.rows = len(qty_sold_map)
+    if "views_atc" in queries:
+        with stage("views") as timing:
+            views_atc_map = query_views_atc(session, db_name, item_ids)
+            timing.rows = len(views_atc_map)
+    if "size_data" in queries:
+        with stage("size") as timing:
+            size_data_map = query_size_data(session, db_name, item_ids)
+            timing.rows = sum(len(rows) for rows in size_data_map.values())
+    return qty_sold_map, views_atc_map, size_data_map
+
+
+def load_item_aggregates(session, db_name: str, item_ids, queries=ALL_QUERIES, source=None):
+    """
+    Same as query_item_aggregates, read from the rollup tables when they are
+    up to date with sale and viewsatc. Large id sets are passed according
+    to idsets.choose_strategy; source, a select of exactly item_ids, allows
+    a server-side semi-join instead.
+    """
+    if not queries:
+        return {}, {}, {}
+    with stage("rollup_check"):
+        use_rollup = rollup_is_fresh(session, db_name)
+    id_type = get_tenant(db_name).Item.Item_Id.type
+    if use_rollup:
+        with stage("rollup"):
+            return query_by_ids(session, query_rollup_aggregates, db_name, item_ids, queries,
+                                source=source, id_type=id_type)
+    return query_by_ids(session, query_item_aggregates, db_name, item_ids, queries, source=source, id_type=id_type)
+
+
+def fetch_products(session, db_name: str, launch_start_days: int, launch_end_days: int, fields=None):
+    today = date.today()
+
+    group_column = get_tenant(db_name).group_column
+
+    with stage("items") as timing:
+        grouped_items = query_window_items(session, db_name, today, launch_start_days, launch_end_days)
+        timing.rows = len(grouped_items)
+
+    item_ids = [item.Item_Id for item in grouped_items]
+    queries = required_queries(fields)
+    source = window_item_ids(db_name, today, launch_start_days, launch_end_days)
+    qty_sold_map, views_atc_map, size_data_map = load_item_aggregates(session, db_name, item_ids, queries, source=source)
+    trailing_map = load_trailing_totals(session, db_name, item_ids, today, queries, source=source)
+
+    with stage("build") as timing:
+        results = build_product_results(today, grouped_items, group_column, qty_sold_map, views_atc_map, size_data_map,
+                                        trailing_map)
+        results = select_fields(results, fields)
+        timing.rows = len(results)
+    return today, results
+
+
+def fused_products_query(db_name: str, today: date, launch_start_days: int, launch_end_days: int, ordered: bool = False):
+    """
+    Builds the single-statement products query: the window items, sale totals
+    and views/ATC totals (lifetime and per trailing window) are CTEs joined on
+    Item_Id, so sale and viewsatc are each scanned once. With ordered=True
+    rows come back grouped by (Item_Name, category), compared as bytes so
+    each exact pair is contiguous whatever the collation. Returns
+    (statement, group_column).
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+
+    group_column = tenant.group_column
+    size_column = tenant.size_column if tenant.has_size else null()
+    launch_from, launch_to = launch_window(today, launch_start_days, launch_end_days)
+
+    window_items = (
+        select(
+            Item.Item_Id,
+            Item.Item_Name,
+            Item.Item_Type,
+            group_column.label(group_column.key),
+            Item.launch_date.label("launch_date"),
+            cast(Item.Current_Stock, Integer).label("current_stock"),
+            cast(Item.Sale_Price, Integer).label("sale_price"),
+            size_column.label("size"),
+        )
+        .where(Item.launch_date.between(launch_from, launch_to))
+        .cte("window_items")
+    )
+
+    sale_totals = (
+        select(
+            Sale.Item_Id,
+            func.sum(Sale.Quantity).label("qty_sold"),
+            func.count(Sale.Date).label("sale_count"),
+            func.min(Sale.Date).label("first_sale"),
+            func.max(Sale.Date).label("last_sale"),
+            *trailing_sale_columns(Sale, today),
+        )
+        .where(Sale.Item_Id.in_(select(window_items.c.Item_Id)))
+        .group_by(Sale.Item_Id)
+        .cte("sale_totals")
+    )
+
+    views_totals = (
+        select(
+            ViewsAtc.Item_Id,
+            func.sum(ViewsAtc.Items_Viewed).label("views"),
+            func.sum(ViewsAtc.Items_Addedtocart).label("atc"),
+            *trailing_views_columns(ViewsAtc, today),
+        )
+        .where(ViewsAtc.Item_Id.in_(select(window_items.c.Item_Id)))
+        .group_by(ViewsAtc.Item_Id)
+        .cte("views_totals")
+    )
+
+    trailing_columns = [
+        (sale_totals if field.startswith("qty_sold_") else views_totals, field)
+        for days in TRAILING_WINDOWS for field in trailing_fields(days)[:3]
+    ]
+    stmt = (
+        select(
+            window_items,
+            func.coalesce(sale_totals.c.qty_sold, 0).label("qty_sold"),
+            func.coalesce(
+                case(
+                    (sale_totals.c.sale_count > 1,
+                     (func.datediff(sale_totals.c.last_sale, sale_totals.c.first_sale) /
+                      (sale_totals.c.sale_count - 1))
+                    ),
+                    else_=0
+                ), 0
+            ).label("avg_days_between_sales"),
+            func.coalesce(func.datediff(func.current_date(), sale_totals.c.last_sale), 0).label("days_since_last_sold"),
+            views_totals.c.views,
+            views_totals.c.atc,
+            *[func.coalesce(totals.c[field], 0).label(field) for totals, field in trailing_columns],
+        )
+        .select_from(window_items)
+        .outerjoin(sale_totals, sale_totals.c.Item_Id == window_items.c.Item_Id)
+        .outerjoin(views_totals, views_totals.c.Item_Id == window_items.c.Item_Id)
+    )
+    if ordered:
+        stmt = stmt.order_by(
+            cast(window_items.c.Item_Name, LargeBinary),
+            cast(window_items.c[group_column.key], LargeBinary),
+            window_items.c.Item_Id,
+        )
+    return stmt, group_column
+
+
+def fused_aggregate_maps(rows, group_column):
+    """
+    Splits fused query rows into the qty sold, views/ATC, size-level and
+    trailing window lookups used by build_product_results.
+    """
+    qty_sold_map = {}
+    views_atc_map = {}
+    size_data_map = {}
+    trailing_map = {}
+    trailing_columns = [field for days in TRAILING_WINDOWS for field in trailing_fields(days)[:3]]
+    for row in rows:
+        trailing_map[row.Item_Id] = {field: getattr(row, field) for field in trailing_columns}
+        qty_sold_map[row.Item_Id] = row.qty_sold
+        size_data_map[row.Item_Id] = [
+            (row.size, row.current_stock, row.qty_sold, row.avg_days_between_sales, row.days_since_last_sold)
+        ]
+        key = (row.Item_Name, getattr(row, group_column.key))
+        totals = views_atc_map.setdefault(key, {"total_views": 0, "total_atc": 0})
+        totals["total_views"] += row.views or 0
+        totals["total_atc"] += row.atc or 0
+    return qty_sold_map, views_atc_map, size_data_map, trailing_map
+
+
+def fetch_products_fused(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    Same output as fetch_products, computed in a single round trip.
+    """
+    today = date.today()
+
+    stmt, group_column = fused_products_query(db_name, today, launch_start_days, launch_end_days)
+    with stage("fused") as timing:
+        rows = session.execute(stmt).all()
+        timing.rows = len(rows)
+
+    with stage("build") as timing:
+        results = build_product_results(today, rows, group_column, *fused_aggregate_maps(rows, group_column))
+        timing.rows = len(results)
+    return today, results
+
+
+def stream_products(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    Streaming variant of fetch_products. The fused query is read through a
+    server-side cursor ordered by the bytes of (Item_Name, category), and
+    each group's products are built as soon as its last row arrives, so only
+    one group is held in memory at a time. Returns (today, iterator of
+    product dicts).
+    """
+    today = date.today()
+
+    stmt, group_column = fused_products_query(db_name, today, launch_start_days, launch_end_days, ordered=True)
+    rows = session.execute(stmt.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE))
+
+    def group_key(row):
+        return row.Item_Name, getattr(row, group_column.key)
+
+    def generate():
+        # Whole groups are batched so the KPIs are computed for many rows at once
+        batch = []
+        for _, group_rows in groupby(rows, key=group_key):
+            batch.extend(group_rows)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield from build_product_results(today, batch, group_column, *fused_aggregate_maps(batch, group_column))
+                batch = []
+        if batch:
+            yield from build_product_results(today, batch, group_column, *fused_aggregate_maps(batch, group_column))
+
+    return today, generate()
+
+
+def build_product_results(today, grouped_items, group_column, qty_sold_map, views_atc_map, size_data_map,
+                          trailing_map=None, page_items=None):
+    """
+    Builds the per-item product metrics from the item rows and the
+    sale, views/ATC, size-level and trailing window lookups. If page_items
+    is given, only those items are returned; grouped_items must then hold
+    every item of their (item_name, product_type) groups.
+    """
+    group_key = group_column.key
+    variants_map = {}
+    for item in grouped_items:
+        item_name = item.Item_Name
+        product_type = getattr(item, group_key, None)
+        key = (item_name, product_type)
+        if key not in variants_map:
+            variants_map[key] = []
+        variants_map[key].append(item.Item_Id)
+
+    results = []
+    launch_dates = []
+    last_sale_days = []
+    for item in (grouped_items if page_items is None else page_items):
+        item_id = item.Item_Id
+        item_name = item.Item_Name
+        item_type = item.Item_Type
+        product_type = getattr(item, group_key, None)
+        launch_date = item.launch_date
+        total_current_stock = item.current_stock
+        sale_price = item.sale_price
+
+        # Total sold
+        total_quantity_sold = qty_sold_map.get(item_id, 0)
+
+        # Total views & ATC
+        views_data = views_atc_map.get((item_name, product_type), {"total_views":0,"total_atc":0})
+        total_views = views_data["total_views"]
+        total_atc = views_data["total_atc"]
+
+        # Size-level
+        all_variant_ids = variants_map.get((item_name, product_type), [])
+        all_size_data = []
+        for vid in all_variant_ids:
+            all_size_data.extend(size_data_map.get(vid, []))
+        total_variants = len(all_size_data)
+        variants_in_stock = sum(1 for sd in all_size_data if sd[1] > 0)
+
+        # For this item_id, show only its own sizewise_list
+        size_data = size_data_map.get(item_id, [])
+        sizewise_list = [
+            {
+                "size": sd[0],
+                "variant_stock": sd[1],
+                "variant_quantity_sold": sd[2],
+                "average_days_between_sales": round(sd[3] or 0, 2),
+                "days_since_last_sold": sd[4]
+            }
+            for sd in size_data
+        ]
+
+        launch_dates.append(launch_date)
+        last_sale_days.append(
+            min([v["days_since_last_sold"] for v in sizewise_list if v["days_since_last_sold"] is not None], default=None)
+        )
+
+        # KPI fields are filled in below, in one batch
+        results.append({
+            "item_id": item_id,
+            "item_name": item_name,
+            "item_type": item_type,
+            "product_type": product_type,
+            "day_since_launch": None,
+            "current_stock": total_current_stock,
+            "sale_price": sale_price,
+            "total_quantity_sold": total_quantity_sold,
+            "total_views": total_views,
+            "total_atc": total_atc,
+            "total_stock_percentage_sold": None,
+            "projected_days_to_sell_out": None,
+            "per_day_qty_average": None,
+            **trailing_values(trailing_map, [item_id], all_variant_ids),
+            "size_summary": {
+                "size": f"'{variants_in_stock}/{total_variants}",
+                "sizewise": sizewise_list
+            }
+        })
+
+    apply_kpis(today, results, launch_dates, last_sale_days)
+    return results
@@ -0,0 +1,124 @@
+"""
+Async variants of the analytics pipeline on the asyncio engine.
+
+Independent sub-queries each run on their own AsyncSession, and therefore on
+their own pooled connection, so they execute concurrently.
+"""
+import asyncio
+from datetime import date
+
+from db import get_async_read_session
+from models import get_tenant
+from rollup import rollup_is_fresh, query_rollup_aggregates
+from export import STREAM_BATCH_SIZE
+from idsets import query_by_ids
+from analytics import (
+    query_window_items,
+    query_qty_sold,
+    query_views_atc,
+    query_size_data,
+    query_trailing_totals,
+    fused_products_query,
+    fused_aggregate_maps,
+    build_product_results,
+    build_grouped_results,
+)
+
+
+async def run_query(db_name: str, fn, *args):
+    """
+    Runs fn(session, *args), written against a sync Session, on a new
+    AsyncSession for db_name.
+    """
+    async with get_async_read_session(db_name) as session:
+        return await session.run_sync(fn, *args)
+
+
+async def load_item_aggregates_async(db_name: str, item_ids, use_rollup: bool):
+    """
+    Async load_item_aggregates. The three raw aggregations run concurrently,
+    each passing item_ids by the strategy idsets picks for their number.
+    """
+    if use_rollup:
+        return await run_query(db_name, query_by_ids, query_rollup_aggregates, db_name, item_ids, None)
+    return await asyncio.gather(
+        run_query(db_name, query_by_ids, query_qty_sold, db_name, item_ids),
+        run_query(db_name, query_by_ids, query_views_atc, db_name, item_ids),
+        run_query(db_name, query_by_ids, query_size_data, db_name, item_ids),
+    )
+
+
+async def _window_items_and_rollup(db_name: str, today: date, launch_start_days: int, launch_end_days: int,
+                                   with_size: bool = False):
+    return await asyncio.gather(
+        run_query(db_name, query_window_items, db_name, today, launch_start_days, launch_end_days, with_size),
+        run_query(db_name, rollup_is_fresh, db_name),
+    )
+
+
+async def fetch_products_async(db_name: str, launch_start_days: int, launch_end_days: int):
+    today = date.today()
+    group_column = get_tenant(db_name).group_column
+
+    grouped_items, use_rollup = await _window_items_and_rollup(db_name, today, launch_start_days, launch_end_days)
+
+    item_ids = [item.Item_Id for item in grouped_items]
+    (qty_sold_map, views_atc_map, size_data_map), trailing_map = await asyncio.gather(
+        load_item_aggregates_async(db_name, item_ids, use_rollup),
+        run_query(db_name, query_by_ids, query_trailing_totals, db_name, item_ids, today),
+    )
+
+    results = build_product_results(today, grouped_items, group_column, qty_sold_map, views_atc_map, size_data_map,
+                                    trailing_map)
+    return today, results
+
+
+async def fetch_products_by_name_async(db_name: str, launch_start_days: int, launch_end_days: int):
+    today = date.today()
+    group_column = get_tenant(db_name).group_column
+
+    items_query, use_rollup = await _window_items_and_rollup(
+        db_name, today, launch_start_days, launch_end_days, with_size=True
+    )
+
+    all_item_ids = [item.Item_Id for item in items_query]
+    (qty_sold_map, views_atc_map, size_data_map), trailing_map = await asyncio.gather(
+        load_item_aggregates_async(db_name, all_item_ids, use_rollup),
+        run_query(db_name, query_by_ids, query_trailing_totals, db_name, all_item_ids, today),
+    )
+
+    results = build_grouped_results(today, items_query, group_column, qty_sold_map, views_atc_map, size_data_map,
+                                    trailing_map)
+    return today, results
+
+
+async def stream_products_async(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    Async stream_products: reads the ordered fused query with AsyncSession.stream
+    and yields product dicts group by group. Returns (today, async iterator).
+    """
+    today = date.today()
+
+    stmt, group_column = fused_products_query(db_name, today, launch_start_days, launch_end_days, ordered=True)
+    rows = await session.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+    def group_key(row):
+        return row.Item_Name, getattr(row, group_column.key)
+
+    async def generate():
+        # Whole groups are batched; a batch is only cut where the group changes
+        batch = []
+        current_key = None
+        async for row in rows:
+            key = group_key(row)
+            if key != current_key and len(batch) >= STREAM_BATCH_SIZE:
+                for product in build_product_results(today, batch, group_column, *fused_aggregate_maps(batch, group_column)):
+                    yield product
+                batch = []
+            batch.append(row)
+            current_key = key
+        if batch:
+            for product in build_product_results(today, batch, group_column, *fused_aggregate_maps(batch, group_column)):
+                yield product
+
+    return today, generate()
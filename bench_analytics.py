@@ -0,0 +1,309 @@
+"""
+Benchmark suite for the analytics pipelines on synthetic tenant databases.
+
+Times fetch_products, the products_by_name pipeline and the CSV export end to
+end and per stage, and saves the results as JSON in benchmark_results/ so runs
+on different commits can be compared.
+
+By default the databases are SQLite files in bench_data/, generated by
+datagen.py on first use (and regenerated when the scale changes). Use --url
+to run against a local MySQL instead; its tables are dropped and regenerated
+only with --generate.
+
+Usage:
+    python bench_analytics.py
+    python bench_analytics.py --styles 5000 --sizes 6 --days 365 --repeats 5 zing
+    python bench_analytics.py --compare benchmark_results/20250101-120000_abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import datagen
+from models import DB_NAMES
+
+DEFAULT_RESULTS_DIR = "benchmark_results"
+
+
+@contextmanager
+def timed(stages: dict, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def bench_products(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    fetch_products followed by JSON encoding, as /products runs it.
+    """
+    from datetime import date
+    from analytics import (
+        fetch_products, query_window_items, query_qty_sold, query_views_atc, query_size_data,
+        build_product_results,
+    )
+    from models import get_tenant
+    from serialize import dumps_default
+
+    stages = {}
+    today = date.today()
+    group_column = get_tenant(db_name).group_column
+
+    with timed(stages, "window_items"):
+        items = query_window_items(session, db_name, today, launch_start_days, launch_end_days)
+    item_ids = [item.Item_Id for item in items]
+    with timed(stages, "qty_sold"):
+        qty_sold_map = query_qty_sold(session, db_name, item_ids)
+    with timed(stages, "views_atc"):
+        views_atc_map = query_views_atc(session, db_name, item_ids)
+    with timed(stages, "size_data"):
+        size_data_map = query_size_data(session, db_name, item_ids)
+    with timed(stages, "build"):
+        results = build_product_results(today, items, group_column, qty_sold_map, views_atc_map, size_data_map)
+    with timed(stages, "encode_json"):
+        dumps_default({"products": results})
+
+    start = time.perf_counter()
+    today, results = fetch_products(session, db_name, launch_start_days, launch_end_days)
+    dumps_default({"products": results})
+    return time.perf_counter() - start, stages, len(results)
+
+
+def bench_products_by_name(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    fetch_products_by_name followed by JSON encoding, as /products/by_name runs it.
+    """
+    from datetime import date
+    from analytics import fetch_products_by_name, grouped_products_query, build_sql_grouped_results, ALL_QUERIES
+    from serialize import dumps_default
+
+    stages = {}
+    today = date.today()
+    stmt, group_column = grouped_products_query(db_name, today, launch_start_days, launch_end_days, ALL_QUERIES)
+
+    with timed(stages, "groups"):
+        rows = session.execute(stmt).all()
+    with timed(stages, "build"):
+        results = build_sql_grouped_results(today, rows, group_column)
+    with timed(stages, "encode_json"):
+        dumps_default({"products": results})
+
+    start = time.perf_counter()
+    today, results = fetch_products_by_name(session, db_name, launch_start_days, launch_end_days)
+    dumps_default({"products": results})
+    return time.perf_counter() - start, stages, len(results)
+
+
+def bench_products_csv(session, db_name: str, launch_start_days: int, launch_end_days: int):
+    """
+    The streamed /products/csv export.
+    """
+    from analytics import stream_products
+    from export import iter_csv_chunks
+
+    stages = {}
+    with timed(stages, "query_and_build"):
+        today, results = stream_products(session, db_name, launch_start_days, launch_end_days)
+        results = list(results)
+    with timed(stages, "encode_csv"):
+        for _ in iter_csv_chunks(results):
+            pass
+
+    start = time.perf_counter()
+    today, results = stream_products(session, db_name, launch_start_days, launch_end_days)
+    size = sum(len(chunk) for chunk in iter_csv_chunks(results))
+    return time.perf_counter() - start, stages, size
+
+
+BENCHMARKS = {
+    "products": bench_products,
+    "products_by_name": bench_products_by_name,
+    "products_csv": bench_products_csv,
+}
+
+
+def summarize(samples):
+    values = [s * 1000 for s in samples]
+    return {
+        "min_ms": round(min(values), 2),
+        "median_ms": round(statistics.median(values), 2),
+        "mean_ms": round(statistics.mean(values), 2),
+        "max_ms": round(max(values), 2),
+    }
+
+
+def run_benchmarks(db_names, launch_start_days: int, launch_end_days: int, repeats: int, warmup: int):
+    from db import get_session
+
+    results = {}
+    for db_name in db_names:
+        results[db_name] = {}
+        for name, bench in BENCHMARKS.items():
+            totals = []
+            stage_samples = {}
+            size = None
+            for run in range(warmup + repeats):
+                with get_session(db_name) as session:
+                    total, stages, size = bench(session, db_name, launch_start_days, launch_end_days)
+                if run < warmup:
+                    continue
+                totals.append(total)
+                for stage, elapsed in stages.items():
+                    stage_samples.setdefault(stage, []).append(elapsed)
+            results[db_name][name] = {
+                "end_to_end": summarize(totals),
+                "stages_median_ms": {
+                    stage: round(statistics.median(samples) * 1000, 2) for stage, samples in stage_samples.items()
+                },
+                "output_size": size,
+            }
+            print(f"{db_name:<12} {name:<18} {results[db_name][name]['end_to_end']['median_ms']:>10.1f} ms  "
+                  + "  ".join(f"{stage}={ms:.1f}" for stage, ms in results[db_name][name]["stages_median_ms"].items()))
+    return results
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    Prints the change in median end-to-end time per tenant and benchmark.
+    Returns the number of regressions slower than threshold percent.
+    """
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    regressions = 0
+    for db_name, benches in current["results"].items():
+        for name, result in benches.items():
+            before = baseline["results"].get(db_name, {}).get(name)
+            if before is None:
+                continue
+            old = before["end_to_end"]["median_ms"]
+            new = result["end_to_end"]["median_ms"]
+            change = (new - old) / old * 100 if old else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{db_name:<12} {name:<18} {old:>10.1f} -> {new:>10.1f} ms  {change:+6.1f}%{flag}")
+    if baseline["meta"].get("params") != current["meta"].get("params"):
+        print("Note: the baseline was run with different parameters")
+    return regressions
+
+
+def ensure_data(args, db_names):
+    """
+    Generates the benchmark databases if they are missing or were generated
+    with other parameters.
+    """
+    params = {"styles": args.styles, "sizes": args.sizes, "days": args.days, "seed": args.seed}
+    if args.url is not None:
+        if not args.generate:
+            return
+        targets = db_names
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        manifest_path = os.path.join(args.dir, "manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        targets = [
+            db_name for db_name in db_names
+            if args.generate or manifest.get(db_name) != params
+            or not os.path.exists(os.path.join(args.dir, f"{db_name}.db"))
+        ]
+
+    url = args.url or datagen.sqlite_url(args.dir)
+    for db_name in targets:
+        start = time.perf_counter()
+        counts = datagen.generate_tenant(url.format(db_name=db_name), db_name, args.styles, args.sizes, args.days,
+                                         seed=args.seed)
+        print(f"Generated {db_name}: {counts[0]} items, {counts[1]} sale, {counts[2]} viewsatc rows "
+              f"in {time.perf_counter() - start:.1f}s")
+        if args.url is None:
+            manifest[db_name] = params
+
+    if args.url is None and targets:
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analytics pipelines on synthetic data")
+    datagen.add_arguments(parser)
+    parser.add_argument("--generate", action="store_true", help="Regenerate the databases")
+    parser.add_argument("--no-indexes", action="store_true", help="Do not create the indexes from indexes.py")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--launch-start-days", type=int, default=0)
+    parser.add_argument("--launch-end-days", type=int, default=90)
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR)
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    parser.add_argument("db_names", nargs="*", default=list(DB_NAMES))
+    args = parser.parse_args()
+
+    ensure_data(args, args.db_names)
+
+    # db reads DB_URL on import, so it must be set before the pipeline is loaded
+    os.environ["DB_URL"] = args.url or datagen.sqlite_url(args.dir)
+    os.environ["ROLLUP_ENABLED"] = "false"
+    import sqlalchemy
+    from indexes import ensure_indexes
+
+    if not args.no_indexes:
+        for db_name in args.db_names:
+            ensure_indexes(db_name)
+
+    results = run_benchmarks(args.db_names, args.launch_start_days, args.launch_end_days, args.repeats, args.warmup)
+
+    commit, dirty = git_revision()
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": timestamp,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "dialect": os.environ["DB_URL"].split(":", 1)[0],
+            "params": {
+                "indexes": not args.no_indexes,
+                "styles": args.styles, "sizes": args.sizes, "days": args.days, "seed": args.seed,
+                "launch_start_days": args.launch_start_days, "launch_end_days": args.launch_end_days,
+                "repeats": args.repeats,
+            },
+        },
+        "results": results,
+    }
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{timestamp}_{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmarks response encoding: FastAPI's default jsonable_encoder + json
+against orjson, and the bytes on the wire with gzip / brotli.
+
+Usage:
+    python bench_serialize.py               # 20000 products, 4 sizes each
+    python bench_serialize.py 50000 6 5     # products, sizes per product, repeats
+"""
+import random
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+
+from export import iter_csv_chunks
+from kpis import TRAILING_FIELDS
+from serialize import dumps_default, dumps_fast, compress, _brotli
+
+
+def make_products(n_products: int, sizes: int, seed: int = 1):
+    """
+    Product dicts shaped like the /products results, with the Decimal values
+    MySQL aggregates return.
+    """
+    rnd = random.Random(seed)
+    today = date.today()
+    products = []
+    for i in range(n_products):
+        sizewise = [
+            {
+                "size": size,
+                "variant_stock": rnd.randint(0, 40),
+                "variant_quantity_sold": Decimal(rnd.randint(0, 300)),
+                "average_days_between_sales": round(Decimal(rnd.randint(0, 4000)) / 100, 2),
+                "days_since_last_sold": rnd.randint(0, 120)
+            }
+            for size in ["XS", "S", "M", "L", "XL", "XXL"][:sizes]
+        ]
+        products.append({
+            "item_id": i + 1,
+            "item_name": f"Style {i // 4}",
+            "item_type": "Apparel",
+            "product_type": rnd.choice(["Dresses", "Tops", "Sets"]),
+            "day_since_launch": rnd.randint(0, 365),
+            "current_stock": rnd.randint(0, 200),
+            "sale_price": rnd.choice([499, 599, 799]),
+            "total_quantity_sold": Decimal(rnd.randint(0, 1000)),
+            "total_views": Decimal(rnd.randint(0, 50000)),
+            "total_atc": Decimal(rnd.randint(0, 3000)),
+            "total_stock_percentage_sold": round(rnd.random() * 100, 2),
+            "projected_days_to_sell_out": round(rnd.random() * 400, 2),
+            "per_day_qty_average": round(rnd.random() * 10, 2),
+            **{
+                field: round(rnd.random() * 10, 2) if field.startswith("per_day_") else Decimal(rnd.randint(0, 500))
+                for field in TRAILING_FIELDS
+            },
+            "size_summary": {"size": f"'{rnd.randint(0, sizes)}/{sizes}", "sizewise": sizewise}
+        })
+    return {
+        "status": "Success",
+        "database": "bench",
+        "launch_start_days": 0,
+        "launch_end_days": 365,
+        "today": str(today),
+        "products": products
+    }
+
+
+def best_of(repeats: int, fn, *args):
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(n_products: int = 20000, sizes: int = 4, repeats: int = 3):
+    payload = make_products(n_products, sizes)
+    encodings = ["gzip"] + (["br"] if _brotli() is not None else [])
+
+    print(f"{n_products} products x {sizes} sizes, best of {repeats}")
+    print(f"{'encoder':<22}{'encode ms':>12}{'bytes':>14}" + "".join(f"{e + ' bytes':>14}{e + ' ms':>10}" for e in encodings))
+
+    rows = [
+        ("jsonable_encoder+json", dumps_default, payload),
+        ("orjson", dumps_fast, payload),
+        ("csv", lambda p: "".join(iter_csv_chunks(p["products"])).encode("utf-8"), payload),
+    ]
+    for name, encode, data in rows:
+        elapsed, body = best_of(repeats, encode, data)
+        line = f"{name:<22}{elapsed * 1000:>12.1f}{len(body):>14,}"
+        for encoding in encodings:
+            compress_elapsed, compressed = best_of(repeats, compress, body, encoding)
+            line += f"{len(compressed):>14,}{compress_elapsed * 1000:>10.1f}"
+        print(line)
+
+    if dumps_fast(payload) != dumps_default(payload):
+        print("WARNING: orjson output differs from the default encoder")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,318 @@
+"""
+Bounded LRU/TTL cache for the product analytics results.
+
+Entries are keyed on the pipeline and its parameters and are only served while
+the tenant's data watermark (MAX(Updated_At) of items, sale and viewsatc) and
+today's date are unchanged.
+
+Concurrent misses for the same entry are coalesced: the first request
+computes the result and identical requests arriving meanwhile wait for it
+instead of running the same queries.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date
+
+from sqlalchemy import func, select
+
+from models import get_db_model
+from catalog import sync_catalog, sync_catalog_async
+from rollup import data_watermark
+from instrumentation import Counter, METRICS, stage, tenant_label
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "900"))
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+coalesced_count = Counter(
+    "analytics_coalesced_requests_total", "Requests served by an identical in-flight computation", ("fetch", "db_name")
+)
+METRICS.append(coalesced_count)
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, watermark, today: date):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_watermark, entry_today, stored_at, value = entry
+            if (entry_watermark != watermark or entry_today != today
+                    or time.monotonic() - stored_at > self.ttl_seconds):
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, watermark, today: date, value):
+        with self._lock:
+            self._entries[key] = (watermark, today, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, db_name: str = None):
+        with self._lock:
+            if db_name is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[1] == db_name]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class FlightAbandoned(Exception):
+    """
+    The computation a request was waiting on was cancelled before it
+    finished; the waiting request computes the result itself.
+    """
+
+
+class SingleFlight:
+    """
+    In-flight computations by key. Each is a concurrent.futures.Future, so
+    threadpool handlers wait on it directly and async handlers await it
+    without blocking the event loop.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def begin(self, key, join: bool = True):
+        """
+        Returns (future, leader). The leader must call finish; with
+        join=False a new computation is always started.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if join and future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            # A running future cannot be cancelled by a waiter giving up
+            future.set_running_or_notify_cancel()
+            self._flights.setdefault(key, future)
+            self.started += 1
+            return future, True
+
+    def finish(self, key, future, value=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": COALESCE_ENABLED,
+                "in_flight": len(self._flights),
+                "computations": self.started,
+                "coalesced": self.coalesced,
+            }
+
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+in_flight = SingleFlight()
+
+
+def get_data_watermark(session, db_name: str):
+    """
+    Returns (items, sale, viewsatc) MAX(Updated_At) for db_name in one query.
+    """
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+    with stage("watermark"):
+        return tuple(session.execute(
+            select(
+                select(func.max(Item.Updated_At)).scalar_subquery(),
+                select(func.max(Sale.Updated_At)).scalar_subquery(),
+                select(func.max(ViewsAtc.Updated_At)).scalar_subquery(),
+            )
+        ).one())
+
+
+def cache_key(fetch, db_name: str, launch_start_days: int, launch_end_days: int, params):
+    # Parameters left at None are omitted so e.g. fields=None shares the default entry
+    params = tuple(sorted((name, value) for name, value in params.items() if value is not None))
+    return (fetch.__name__, db_name, launch_start_days, launch_end_days, params)
+
+
+def make_etag(watermark, today: date, fetch, db_name: str, launch_start_days: int, launch_end_days: int, **params):
+    """
+    Returns the ETag of a response: a digest of the request parameters, the
+    data watermark and today's date, so it changes exactly when the cached
+    entry would be invalidated. The tag is weak since the gzip, br and
+    identity bodies of a response share it.
+    """
+    key = cache_key(fetch, db_name, launch_start_days, launch_end_days, params)
+    digest = hashlib.sha1(repr((key, watermark, today)).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _opaque_tag(tag: str):
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: str, etag: str):
+    """
+    True if an If-None-Match header value matches etag (weak comparison).
+    """
+    if not if_none_match:
+        return False
+    tags = [_opaque_tag(tag.strip()) for tag in if_none_match.split(",")]
+    return "*" in tags or _opaque_tag(etag) in tags
+
+
+def lookup_cached(session, fetch, db_name: str, launch_start_days: int, launch_end_days: int, watermark=None,
+                  **params):
+    """
+    Returns the cached (today, results) for fetch, or None if there is no
+    current entry. watermark may be passed if it was already read.
+    """
+    key = cache_key(fetch, db_name, launch_start_days, launch_end_days, params)
+    if watermark is None:
+        watermark = get_data_watermark(session, db_name)
+    return response_cache.get(key, watermark, date.today())
+
+
+async def lookup_cached_async(session, fetch, db_name: str, launch_start_days: int, launch_end_days: int, **params):
+    """
+    lookup_cached for an AsyncSession.
+    """
+    return await session.run_sync(lookup_cached, fetch, db_name, launch_start_days, launch_end_days, **params)
+
+
+def cached_fetch(session, fetch, db_name: str, launch_start_days: int, launch_end_days: int, use_cache: bool = True,
+                 watermark=None, **params):
+    """
+    Calls fetch(session, db_name, launch_start_days, launch_end_days, **params)
+    through the response cache. With use_cache=False the cache is not read,
+    but the fresh result still replaces the cached one. watermark may be
+    passed if it was already read. A miss that finds the same computation
+    already running waits for its result (unless use_cache=False).
+    """
+    key = cache_key(fetch, db_name, launch_start_days, launch_end_days, params)
+    if watermark is None:
+        watermark = get_data_watermark(session, db_name)
+    if use_cache:
+        cached = response_cache.get(key, watermark, date.today())
+        if cached is not None:
+            return cached
+    if not COALESCE_ENABLED:
+        return _compute(session, fetch, key, watermark, db_name, launch_start_days, launch_end_days, params)
+
+    flight_key = (key, watermark, date.today())
+    while True:
+        future, leader = in_flight.begin(flight_key, join=use_cache)
+        if leader:
+            break
+        coalesced_count.inc((fetch.__name__, tenant_label(db_name)))
+        # The connection is not needed while waiting; give it back to the pool
+        session.rollback()
+        try:
+            return future.result()
+        except FlightAbandoned:
+            continue
+
+    try:
+        value = _compute(session, fetch, key, watermark, db_name, launch_start_days, launch_end_days, params)
+    except BaseException as e:
+        in_flight.finish(flight_key, future, error=e if isinstance(e, Exception) else FlightAbandoned())
+        raise
+    in_flight.finish(flight_key, future, value)
+    return value
+
+
+def _compute(session, fetch, key, watermark, db_name: str, launch_start_days: int, launch_end_days: int, params):
+    sync_catalog(session, db_name, watermark[0])
+    with data_watermark(watermark):
+        today, results = fetch(session, db_name, launch_start_days, launch_end_days, **params)
+    response_cache.put(key, watermark, today, (today, results))
+    return today, results
+
+
+async def cached_fetch_async(session, fetch, fetch_async, db_name: str, launch_start_days: int, launch_end_days: int,
+                             use_cache: bool = True, **params):
+    """
+    Async counterpart of cached_fetch. fetch_async(db_name, launch_start_days,
+    launch_end_days, **params) computes the result; entries, and in-flight
+    computations, are shared with the sync fetch it mirrors. session is an
+    AsyncSession used for the watermark query.
+    """
+    key = cache_key(fetch, db_name, launch_start_days, launch_end_days, params)
+    watermark = await session.run_sync(get_data_watermark, db_name)
+    if use_cache:
+        cached = response_cache.get(key, watermark, date.today())
+        if cached is not None:
+            return cached
+    if not COALESCE_ENABLED:
+        return await _compute_async(session, fetch_async, key, watermark, db_name, launch_start_days, launch_end_days, params)
+
+    flight_key = (key, watermark, date.today())
+    while True:
+        future, leader = in_flight.begin(flight_key, join=use_cache)
+        if leader:
+            break
+        coalesced_count.inc((fetch.__name__, tenant_label(db_name)))
+        await session.rollback()
+        try:
+            return await asyncio.wrap_future(future)
+        except FlightAbandoned:
+            continue
+
+    try:
+        value = await _compute_async(session, fetch_async, key, watermark, db_name, launch_start_days, launch_end_days, params)
+    except BaseException as e:
+        # A cancelled request hands the computation over to whoever waits on it
+        in_flight.finish(flight_key, future, error=e if isinstance(e, Exception) else FlightAbandoned())
+        raise
+    in_flight.finish(flight_key, future, value)
+    return value
+
+
+async def _compute_async(session, fetch_async, key, watermark, db_name: str, launch_start_days: int, launch_end_days: int,
+                         params):
+    await sync_catalog_async(db_name, watermark[0])
+    with data_watermark(watermark):
+        today, results = await fetch_async(db_name, launch_start_days, launch_end_days, **params)
+    response_cache.put(key, watermark, today, (today, results))
+    return today, results
@@ -0,0 +1,335 @@
+"""
+In-process snapshot of each tenant's item catalog.
+
+The items columns the analytics read (id, name, type, category, launch date,
+stock, price, size) are held per tenant in arrays sorted by launch date, so a
+launch window is two binary searches instead of an items query. Snapshots
+are loaded on startup (or first use) and kept current with delta queries on
+items.Updated_At, by a background refresher and whenever a request's data
+watermark shows newer items. A delta re-reads the items updated from
+CATALOG_LOOKBACK_SECONDS before the watermark on, since a transaction can
+commit rows stamped before the previous delta ran. Deletions, and inserts
+committed later than that, are picked up by a full reload when the row count
+no longer matches; items without an Updated_At cannot be tracked, so while
+there are any every refresh is a full reload.
+
+A refresh holds the snapshot's update lock while it queries items. Inside
+AsyncSession.run_sync those queries give control back to the event loop, so
+code on the loop never waits for that lock: it falls back to the items query
+when the lock is busy, and the async path brings snapshots up to date on a
+worker thread.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from starlette.concurrency import run_in_threadpool
+
+from db import get_read_session
+from instrumentation import Counter, METRICS, stage
+from models import get_tenant
+
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "10"))
+CATALOG_MAX_STALENESS_SECONDS = float(os.getenv("CATALOG_MAX_STALENESS_SECONDS", "60"))
+CATALOG_LOOKBACK_SECONDS = int(os.getenv("CATALOG_LOOKBACK_SECONDS", "300"))
+
+catalog_refresh_count = Counter(
+    "analytics_catalog_refreshes_total", "Catalog snapshot loads and delta refreshes", ("db_name", "kind")
+)
+METRICS.append(catalog_refresh_count)
+
+logger = logging.getLogger(__name__)
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_refresher = None
+_refresher_stop = threading.Event()
+
+
+class CatalogSnapshot:
+    """
+    One tenant's items, held column by column in arrays sorted by launch
+    date (undated items last). window returns namedtuples with the
+    attributes of analytics.query_window_items rows (Size included when the
+    tenant has sizes).
+    """
+
+    def __init__(self, db_name: str):
+        tenant = get_tenant(db_name)
+        Item = tenant.Item
+        self.db_name = db_name
+        self.columns = [
+            Item.Item_Id,
+            Item.Item_Name,
+            Item.Item_Type,
+            tenant.group_column,
+            Item.launch_date,
+            cast(Item.Current_Stock, Integer).label("current_stock"),
+            cast(Item.Sale_Price, Integer).label("sale_price"),
+        ]
+        if tenant.has_size:
+            self.columns.append(tenant.size_column)
+        self.Row = namedtuple(f"{db_name}_item", [column.key for column in self.columns])
+        self.has_size = tenant.has_size
+
+        self.watermark = None
+        self.checked_at = None
+        # Held while loading or refreshing, so concurrent callers wait for one
+        # refresh instead of each running their own
+        self.update_lock = threading.Lock()
+        self._index([])
+
+    def _index(self, rows):
+        launch_dates = np.array([row.launch_date for row in rows], dtype="datetime64[D]")
+        # NaT sorts last, so the dated items form a prefix
+        order = np.argsort(launch_dates, kind="stable")
+        fields = list(zip(*rows)) or [()] * len(self.Row._fields)
+        item_ids = np.array(fields[0], dtype=np.int64)[order]
+        values = [item_ids, *(np.array(field, dtype=object)[order] for field in fields[1:])]
+        values[self.Row._fields.index("launch_date")] = launch_dates[order]
+        dated = int(np.count_nonzero(~np.isnat(launch_dates)))
+        id_order = np.argsort(item_ids, kind="stable")
+        # Swapped in one assignment so readers never see a half-built index
+        self._data = (launch_dates[order][:dated], item_ids, item_ids[id_order], id_order, values)
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def _rows(self, positions):
+        values = self._data[4]
+        return [self.Row(*row) for row in zip(*(column[positions].tolist() for column in values))]
+
+    def _rows_by_id(self, item_ids):
+        _, _, sorted_ids, id_order, _ = self._data
+        if not len(sorted_ids):
+            return {}
+        wanted = np.array(item_ids, dtype=np.int64)
+        found = np.searchsorted(sorted_ids, wanted)
+        found = found[(found < len(sorted_ids)) & (sorted_ids[np.minimum(found, len(sorted_ids) - 1)] == wanted)]
+        return {row.Item_Id: row for row in self._rows(id_order[found])}
+
+    def _query(self, session, updated_since=None):
+        Item = get_tenant(self.db_name).Item
+        stmt = select(*self.columns, Item.Updated_At)
+        if updated_since is not None:
+            stmt = stmt.where(Item.Updated_At >= updated_since)
+        rows = session.execute(stmt).all()
+        watermark = max((row.Updated_At for row in rows if row.Updated_At is not None), default=None)
+        return [self.Row(*row[:-1]) for row in rows], watermark
+
+    def load(self, session):
+        """
+        Replaces the snapshot with the whole items table.
+        """
+        rows, watermark = self._query(session)
+        self._index(rows)
+        self.watermark = watermark
+        self.checked_at = time.monotonic()
+        catalog_refresh_count.inc((self.db_name, "full"))
+
+    def refresh(self, session):
+        """
+        Applies the items updated since CATALOG_LOOKBACK_SECONDS before the
+        snapshot watermark; rows read again unchanged are skipped. Reloads
+        everything if the table's row count no longer matches, i.e. items
+        were deleted, or some items have no Updated_At, so their changes
+        cannot be tracked.
+        """
+        if self.checked_at is None or self.watermark is None:
+            return self.load(session)
+        Item = get_tenant(self.db_name).Item
+        count, stamped = session.execute(select(func.count(), func.count(Item.Updated_At))).one()
+        if count != len(self) or stamped != count:
+            return self.load(session)
+        rows, watermark = self._query(session, self.watermark - timedelta(seconds=CATALOG_LOOKBACK_SECONDS))
+        current = self._rows_by_id([row.Item_Id for row in rows])
+        changed = {row.Item_Id: row for row in rows if current.get(row.Item_Id) != row}
+        if changed:
+            _, item_ids, _, _, _ = self._data
+            kept = np.flatnonzero(~np.isin(item_ids, np.array(list(changed), dtype=np.int64)))
+            self._index(self._rows(kept) + list(changed.values()))
+        if watermark is not None and watermark > self.watermark:
+            self.watermark = watermark
+        self.checked_at = time.monotonic()
+        catalog_refresh_count.inc((self.db_name, "delta"))
+
+    def refresh_if(self, session, needed, blocking: bool = True):
+        """
+        Refreshes the snapshot if needed() still holds once the update lock
+        is taken; callers that waited on another thread's refresh skip
+        theirs. With blocking=False returns False, without refreshing, if
+        the lock is held by another refresh.
+        """
+        if not self.update_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if needed():
+                self.refresh(session)
+        finally:
+            self.update_lock.release()
+        return True
+
+    def window(self, launch_from, launch_to):
+        """
+        Returns the rows launched between launch_from and launch_to
+        inclusive, ordered by Item_Id.
+        """
+        launch_dates, item_ids, _, _, _ = self._data
+        start = np.searchsorted(launch_dates, np.datetime64(launch_from, "D"), side="left")
+        end = np.searchsorted(launch_dates, np.datetime64(launch_to, "D"), side="right")
+        return self._rows(start + np.argsort(item_ids[start:end], kind="stable"))
+
+
+def _on_event_loop():
+    """
+    True when called on a thread running an asyncio event loop, e.g. inside
+    AsyncSession.run_sync.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def get_catalog(session, db_name: str):
+    """
+    Returns db_name's CatalogSnapshot, loading it on first use and bringing
+    it up to date if the refresher has not checked it for
+    CATALOG_MAX_STALENESS_SECONDS. None when CATALOG_ENABLED is off, or when
+    called on the event loop while another caller is loading or refreshing
+    the snapshot; the items table is read instead.
+    """
+    if not CATALOG_ENABLED:
+        return None
+    snapshot = _snapshots.get(db_name)
+    if snapshot is None:
+        with _snapshots_lock:
+            snapshot = _snapshots.get(db_name)
+            if snapshot is None:
+                snapshot = _snapshots[db_name] = CatalogSnapshot(db_name)
+    blocking = not _on_event_loop()
+    if snapshot.checked_at is None:
+        with stage("catalog_load"):
+            if not snapshot.refresh_if(session, lambda: snapshot.checked_at is None, blocking):
+                return None
+    elif time.monotonic() - snapshot.checked_at > CATALOG_MAX_STALENESS_SECONDS:
+        with stage("catalog_refresh"):
+            if not snapshot.refresh_if(
+                session, lambda: time.monotonic() - snapshot.checked_at > CATALOG_MAX_STALENESS_SECONDS, blocking
+            ):
+                return None
+    return snapshot
+
+
+def sync_catalog(session, db_name: str, items_watermark):
+    """
+    Refreshes a loaded snapshot that is behind items_watermark, the items
+    MAX(Updated_At) a request has just read, so results are never built
+    from items older than the watermark they are cached under.
+    """
+    snapshot = _snapshots.get(db_name)
+    if snapshot is None or snapshot.checked_at is None or items_watermark is None:
+        return
+
+    def behind():
+        return snapshot.watermark is None or snapshot.watermark < items_watermark
+
+    if behind():
+        with stage("catalog_refresh"):
+            snapshot.refresh_if(session, behind)
+
+
+def _sync_catalog_on_read_session(db_name: str, items_watermark):
+    with get_read_session(db_name) as session:
+        sync_catalog(session, db_name, items_watermark)
+
+
+async def sync_catalog_async(db_name: str, items_watermark):
+    """
+    sync_catalog for the async path. A snapshot that is behind is refreshed
+    on a worker thread with a sync read session, since the refresh may wait
+    for the update lock.
+    """
+    snapshot = _snapshots.get(db_name)
+    if snapshot is None or snapshot.checked_at is None or items_watermark is None:
+        return
+    if snapshot.watermark is None or snapshot.watermark < items_watermark:
+        await run_in_threadpool(_sync_catalog_on_read_session, db_name, items_watermark)
+
+
+def refresh_catalogs():
+    """
+    Delta-refreshes every loaded snapshot.
+    """
+    for db_name, snapshot in list(_snapshots.items()):
+        try:
+            with get_read_session(db_name) as session:
+                snapshot.refresh_if(session, lambda: True)
+        except Exception:
+            logger.exception("Catalog refresh failed on %s", db_name)
+
+
+def preload_catalogs(db_names):
+    """
+    Loads the snapshots of db_names, skipping databases that fail.
+    """
+    for db_name in db_names:
+        try:
+            with get_read_session(db_name) as session:
+                get_catalog(session, db_name)
+        except Exception:
+            logger.exception("Catalog load failed on %s", db_name)
+
+
+def _refresh_loop(db_names):
+    preload_catalogs(db_names)
+    while not _refresher_stop.wait(CATALOG_REFRESH_SECONDS):
+        refresh_catalogs()
+
+
+def start_catalog_refresher(db_names):
+    """
+    Loads the snapshots of db_names and refreshes them every
+    CATALOG_REFRESH_SECONDS on a daemon thread.
+    """
+    global _refresher
+    if not CATALOG_ENABLED or _refresher is not None:
+        return
+    _refresher_stop.clear()
+    _refresher = threading.Thread(target=_refresh_loop, args=(list(db_names),), name="catalog-refresher", daemon=True)
+    _refresher.start()
+
+
+def stop_catalog_refresher():
+    global _refresher
+    if _refresher is None:
+        return
+    _refresher_stop.set()
+    _refresher.join(timeout=5)
+    _refresher = None
+
+
+def catalog_stats():
+    now = time.monotonic()
+    return {
+        db_name: {
+            "items": len(snapshot),
+            "watermark": snapshot.watermark,
+            "checked_seconds_ago": round(now - snapshot.checked_at, 1),
+        }
+        for db_name, snapshot in list(_snapshots.items())
+        if snapshot.checked_at is not None
+    }
+
+
+def clear_catalogs():
+    with _snapshots_lock:
+        _snapshots.clear()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+from datetime import date, timedelta
+
+import pytest
+
+# db reads DB_URL on import, so point it at the test databases first
+DATA_DIR = tempfile.mkdtemp(prefix="analytics-test-")
+os.environ["DB_URL"] = f"sqlite:///{DATA_DIR}/{{db_name}}.db"
+os.environ.setdefault("WARM_ENABLED", "false")
+
+import datagen  # noqa: E402
+from models import DB_NAMES  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def databases():
+    """
+    Generates a small SQLite database for every tenant.
+    """
+    for db_name in DB_NAMES:
+        datagen.generate_tenant(os.environ["DB_URL"].format(db_name=db_name), db_name, styles=40, sizes=3, days=60)
+    yield DB_NAMES
+    import db
+    db.dispose_engines()
+
+
+@pytest.fixture
+def client(databases):
+    from fastapi.testclient import TestClient
+
+    import main
+    return TestClient(main.app)
+
+
+# Names and product types equal under a case-, accent- or pad-insensitive
+# collation, but distinct products
+NAME_VARIANTS = ["Cafe", "cafe", "café", "cafe ", "CAFE", "Café", None, ""]
+TYPE_VARIANTS = ["Tops", "tops", "Tops "]
+
+
+@pytest.fixture
+def name_variants(databases):
+    """
+    Adds items named like NAME_VARIANTS, with sales and views, to
+    prathiksham for the duration of a test. Yields the db_name.
+    """
+    from sqlalchemy import delete
+
+    import catalog
+    from cache import response_cache
+    from db import get_engine
+    from models import get_tenant
+
+    db_name = "prathiksham"
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+    yesterday = date.today() - timedelta(days=1)
+    items, sales, views = [], [], []
+    item_id = 900000
+    for name in NAME_VARIANTS:
+        for product_type in TYPE_VARIANTS:
+            for size in ["S", "M"]:
+                item_id += 1
+                item = {"Item_Id": item_id, "Item_Name": name, "Item_Type": "Apparel", "Sale_Price": 499,
+                        "Current_Stock": item_id % 4, "launch_date": yesterday, tenant.group_column.key: product_type}
+                if tenant.has_size:
+                    item["Size"] = size
+                items.append(item)
+                sales.append({"Date": yesterday, "Item_Id": item_id, "Quantity": item_id % 3 + 1})
+                views.append({"Date": yesterday, "Item_Id": item_id, "Items_Viewed": 10, "Items_Addedtocart": 1})
+
+    engine = get_engine(db_name)
+    with engine.begin() as connection:
+        datagen._insert_batches(connection, Item, items)
+        datagen._insert_batches(connection, Sale, sales)
+        datagen._insert_batches(connection, ViewsAtc, views)
+    # Loaded snapshots are only brought up to date by cached_fetch
+    catalog.clear_catalogs()
+    yield db_name
+    with engine.begin() as connection:
+        for model in (Sale, ViewsAtc, Item):
+            connection.execute(delete(model.__table__).where(model.__table__.c[model.Item_Id.key] > 900000))
+    # Deleting rows can move the watermark back to one results were cached under
+    response_cache.clear(db_name)
+    catalog.clear_catalogs()
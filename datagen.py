@@ -0,0 +1,137 @@
+"""
+Synthetic items / sale / viewsatc data for the tenant schemas in models/,
+used by the benchmark suite.
+
+Each style gets one item per size, launched within the history window; every
+item has a sale and a views/ATC row on a random share of the days since its
+launch.
+
+Usage:
+    python datagen.py                                   # SQLite files in bench_data/
+    python datagen.py --styles 5000 --sizes 6 --days 365 zing
+    python datagen.py --url "mysql+pymysql://root:pw@127.0.0.1:3307/{db_name}"
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from models import DB_NAMES, get_tenant
+
+DEFAULT_DATA_DIR = "bench_data"
+SIZES = ["XS", "S", "M", "L", "XL", "XXL", "3XL", "4XL"]
+CATEGORIES = ["Dresses", "Tops", "Co-ords", "Kurtas", "Nightwear", "Bottoms"]
+INSERT_BATCH_SIZE = 5000
+
+
+def sqlite_url(data_dir: str = DEFAULT_DATA_DIR):
+    return f"sqlite:///{os.path.abspath(data_dir)}/{{db_name}}.db"
+
+
+def _coerce(column, value):
+    # Some tenants store numbers in VARCHAR columns
+    if value is not None and column.type.python_type is str:
+        return str(value)
+    return value
+
+
+def _insert_batches(connection, model, rows):
+    # Rows are keyed by mapped attribute; the table may name columns differently
+    columns = {attr.key: attr.columns[0] for attr in model.__mapper__.column_attrs}
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = [
+            {columns[key].key: _coerce(columns[key], value) for key, value in row.items()}
+            for row in rows[start:start + INSERT_BATCH_SIZE]
+        ]
+        connection.execute(insert(model.__table__), batch)
+
+
+def generate_tenant(url: str, db_name: str, styles: int, sizes: int, days: int,
+                    sale_rate: float = 0.2, view_rate: float = 0.4, seed: int = 1):
+    """
+    Recreates the tables of db_name at url and fills them with synthetic
+    data. Returns the number of (items, sale, viewsatc) rows written.
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+    rnd = random.Random(f"{seed}:{db_name}")
+    today = date.today()
+
+    engine = create_engine(url)
+    Item.metadata.drop_all(engine)
+    Item.metadata.create_all(engine)
+
+    group_attr = tenant.group_column.key
+    items, sales, views = [], [], []
+    item_id = 0
+    for style in range(styles):
+        launch = today - timedelta(days=rnd.randint(0, days - 1))
+        price = rnd.choice([499, 599, 799, 999, 1299])
+        category = rnd.choice(CATEGORIES)
+        popularity = rnd.random()
+        for size in SIZES[:sizes]:
+            item_id += 1
+            item = {
+                "Item_Id": item_id,
+                "Item_Name": f"Style {style:06d}",
+                "Item_Type": "Apparel",
+                "Sale_Price": price,
+                "Current_Stock": rnd.choice([0, 0, 1, 2, 5, 10, 25, 50]),
+                "launch_date": launch,
+                group_attr: category,
+            }
+            if tenant.has_size:
+                item["Size"] = size
+            items.append(item)
+
+            for offset in range((today - launch).days + 1):
+                day = launch + timedelta(days=offset)
+                if rnd.random() < sale_rate * popularity:
+                    sales.append({"Date": day, "Item_Id": item_id, "Quantity": rnd.randint(1, 4)})
+                if rnd.random() < view_rate:
+                    viewed = rnd.randint(1, int(200 * popularity) + 1)
+                    views.append({
+                        "Date": day,
+                        "Item_Id": item_id,
+                        "Items_Viewed": viewed,
+                        "Items_Addedtocart": rnd.randint(0, viewed // 10 + 1),
+                    })
+
+    with engine.begin() as connection:
+        _insert_batches(connection, Item, items)
+        _insert_batches(connection, Sale, sales)
+        _insert_batches(connection, ViewsAtc, views)
+    engine.dispose()
+    return len(items), len(sales), len(views)
+
+
+def add_arguments(parser):
+    parser.add_argument("--url", help="Database URL template with {db_name} (default: SQLite files in --dir)")
+    parser.add_argument("--dir", default=DEFAULT_DATA_DIR, help="Directory for the SQLite files")
+    parser.add_argument("--styles", type=int, default=1000, help="Styles per tenant")
+    parser.add_argument("--sizes", type=int, default=5, help=f"Sizes (items) per style, up to {len(SIZES)}")
+    parser.add_argument("--days", type=int, default=180, help="Days of history")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic tenant databases")
+    add_arguments(parser)
+    parser.add_argument("db_names", nargs="*", default=list(DB_NAMES))
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        os.makedirs(args.dir, exist_ok=True)
+        url = sqlite_url(args.dir)
+
+    for db_name in args.db_names:
+        start = time.perf_counter()
+        n_items, n_sales, n_views = generate_tenant(
+            url.format(db_name=db_name), db_name, args.styles, args.sizes, args.days, seed=args.seed
+        )
+        elapsed = time.perf_counter() - start
+        print(f"{db_name}: {n_items} items, {n_sales} sale, {n_views} viewsatc rows in {elapsed:.1f}s")
@@ -1,28 +1,579 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from dotenv import load_dotenv
+import itertools
 import os
+import threading
+import time
+from contextvars import ContextVar
+from datetime import date
 from urllib.parse import quote_plus
 
+from instrumentation import Counter, METRICS, instrument_engine, tenant_label
+
 
 load_dotenv()
 
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_USER = os.getenv("DB_USER", "")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
-DB_PORT = os.getenv("DB_PORT", "3306")  
+DB_PORT = os.getenv("DB_PORT", "3306")
+
+# Connection pool settings, shared by every tenant engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Driver for the async endpoints (aiomysql or asyncmy)
+DB_ASYNC_DRIVER = os.getenv("DB_ASYNC_DRIVER", "aiomysql")
+
+# Optional URL template overriding the MySQL settings, e.g.
+# sqlite:///bench_data/{db_name}.db for the benchmark databases
+DB_URL = os.getenv("DB_URL", "")
+
+# Read replicas: DB_REPLICAS_<DB_NAME> (or DB_REPLICAS for every tenant) lists
+# host[:port] entries or URL templates with {db_name}
+DB_REPLICAS = os.getenv("DB_REPLICAS", "")
+DB_READ_FROM_REPLICAS = os.getenv("DB_READ_FROM_REPLICAS", "true").lower() in ("1", "true", "yes")
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
 
 ENCODED_PASSWORD = quote_plus(DB_PASSWORD)
 
+read_routing_count = Counter(
+    "analytics_read_sessions_total", "Read sessions by target (replica, primary, or fallback to the primary)",
+    ("db_name", "target")
+)
+METRICS.append(read_routing_count)
+
+_engines = {}
+_sessionmakers = {}
+_async_engines = {}
+_async_sessionmakers = {}
+_registry_lock = threading.Lock()
+
+
+class _TimedPoolMixin:
+    """
+    Records how long callers wait to check out a connection from the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def tenant_setting(name: str, db_name: str, default: str):
+    """
+    Returns the <name>_<DB_NAME> environment variable, e.g. DB_HOST_ZING,
+    falling back to default.
+    """
+    return os.getenv(f"{name}_{db_name.upper()}", default)
+
+
+def _mysql_url(driver: str, host: str, port: str, db_name: str):
+    return f"mysql+{driver}://{DB_USER}:{ENCODED_PASSWORD}@{host}:{port}/{db_name}"
+
+
+def get_url(db_name: str):
+    """
+    Returns the URL of db_name's primary. DB_HOST_<DB_NAME> / DB_PORT_<DB_NAME>
+    place a tenant on its own server.
+    """
+    if DB_URL:
+        return DB_URL.format(db_name=db_name)
+    host = tenant_setting("DB_HOST", db_name, DB_HOST)
+    port = tenant_setting("DB_PORT", db_name, DB_PORT)
+    return _mysql_url("pymysql", host, port, db_name)
+
+
+def get_replica_urls(db_name: str):
+    """
+    Returns the URLs of db_name's read replicas from DB_REPLICAS_<DB_NAME>,
+    or DB_REPLICAS.
+    """
+    urls = []
+    for entry in tenant_setting("DB_REPLICAS", db_name, DB_REPLICAS).split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if "://" in entry:
+            urls.append(entry.format(db_name=db_name))
+        else:
+            host, _, port = entry.partition(":")
+            urls.append(_mysql_url("pymysql", host, port or DB_PORT, db_name))
+    return urls
+
+
+def async_url(url: str):
+    """
+    Returns the asyncio driver variant of a sync URL.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    driver = {"mysql": DB_ASYNC_DRIVER, "sqlite": "aiosqlite"}.get(backend)
+    if driver is None:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return url.set(drivername=f"{backend}+{driver}")
+
+
+def _sqlite_datediff(end, start):
+    if end is None or start is None:
+        return None
+    return (date.fromisoformat(str(end)[:10]) - date.fromisoformat(str(start)[:10])).days
+
+
+def register_sqlite_functions(engine):
+    """
+    Adds the MySQL functions the analytics queries use (DATEDIFF) to every
+    SQLite connection of engine.
+    """
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("datediff", 2, _sqlite_datediff, deterministic=True)
+
+
+def get_async_url(db_name: str):
+    return async_url(get_url(db_name))
+
+
+def _create_engine(url):
+    engine = create_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if engine.dialect.name == "sqlite":
+        register_sqlite_functions(engine)
+    instrument_engine(engine)
+    return engine
+
+
+def _create_async_engine(url):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if engine.dialect.name == "sqlite":
+        register_sqlite_functions(engine.sync_engine)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
 def get_engine(db_name: str):
-    
-    url = f"mysql+pymysql://{DB_USER}:{ENCODED_PASSWORD}@{DB_HOST}:{DB_PORT}/{db_name}"
-    engine = create_engine(url, echo=False, future=True)
+    """
+    Returns the pooled engine for db_name's primary, creating it on first use.
+    """
+    engine = _engines.get(db_name)
+    if engine is not None:
+        return engine
+
+    with _registry_lock:
+        engine = _engines.get(db_name)
+        if engine is None:
+            engine = _create_engine(get_url(db_name))
+            _engines[db_name] = engine
     return engine
 
-def get_session(db_name: str):
+
+def get_sessionmaker(db_name: str):
+    Session = _sessionmakers.get(db_name)
+    if Session is not None:
+        return Session
 
     engine = get_engine(db_name)
-    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    with _registry_lock:
+        Session = _sessionmakers.get(db_name)
+        if Session is None:
+            Session = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+            _sessionmakers[db_name] = Session
+    return Session
+
+
+def get_session(db_name: str):
+
+    Session = get_sessionmaker(db_name)
     session = Session()
-    return session
\ No newline at end of file
+    return session
+
+
+def get_async_engine(db_name: str):
+    """
+    Returns the pooled asyncio engine for db_name, creating it on first use.
+    """
+    engine = _async_engines.get(db_name)
+    if engine is not None:
+        return engine
+
+    with _registry_lock:
+        engine = _async_engines.get(db_name)
+        if engine is None:
+            engine = _create_async_engine(get_async_url(db_name))
+            _async_engines[db_name] = engine
+    return engine
+
+
+def get_async_session(db_name: str):
+    """
+    Returns a new AsyncSession for db_name. Use as `async with`.
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    Session = _async_sessionmakers.get(db_name)
+    if Session is None:
+        engine = get_async_engine(db_name)
+        with _registry_lock:
+            Session = _async_sessionmakers.get(db_name)
+            if Session is None:
+                Session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+                _async_sessionmakers[db_name] = Session
+    return Session()
+
+
+class Replica:
+    """
+    A read replica of one tenant: its engines, created on first use, and
+    the result of its last health check.
+    """
+
+    def __init__(self, db_name: str, index: int, url: str):
+        self.db_name = db_name
+        self.name = f"{db_name}:replica{index}"
+        self.url = url
+        self.engine = None
+        self.async_engine = None
+        self.Session = None
+        self.AsyncSession = None
+        self.healthy = False
+        self.lag_seconds = None
+        self.checked_at = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get_engine(self):
+        with self._lock:
+            if self.engine is None:
+                self.engine = _create_engine(self.url)
+                self._watch_disconnects(self.engine)
+                self.Session = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
+        return self.engine
+
+    def get_async_engine(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        with self._lock:
+            if self.async_engine is None:
+                self.async_engine = _create_async_engine(async_url(self.url))
+                self._watch_disconnects(self.async_engine.sync_engine)
+                self.AsyncSession = async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+        return self.async_engine
+
+    def _watch_disconnects(self, engine):
+        # A lost connection takes the replica out of rotation until the next check
+        @event.listens_for(engine, "handle_error")
+        def _handle_error(context):
+            if context.is_disconnect:
+                self.healthy = False
+                self.error = str(context.original_exception)
+
+    def usable(self):
+        return self.healthy and (self.lag_seconds is None or self.lag_seconds <= DB_REPLICA_MAX_LAG_SECONDS)
+
+    def in_use(self):
+        pools = [engine.pool for engine in (self.engine, self.async_engine and self.async_engine.sync_engine) if engine]
+        return sum(pool.checkedout() for pool in pools)
+
+    def check(self):
+        """
+        Connects to the replica and measures its replication lag.
+        """
+        try:
+            with self.get_engine().connect() as connection:
+                self.lag_seconds = replication_lag(connection)
+            self.healthy = True
+            self.error = None
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e)
+        self.checked_at = time.monotonic()
+
+
+def replication_lag(connection):
+    """
+    Returns the replica's lag behind its source in seconds, or None if it
+    cannot be read (no MySQL, or no REPLICATION CLIENT privilege). Raises if
+    replication is stopped.
+    """
+    if connection.dialect.name != "mysql":
+        return None
+    for statement, column in (("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+                              ("SHOW SLAVE STATUS", "Seconds_Behind_Master")):
+        try:
+            row = connection.exec_driver_sql(statement).mappings().first()
+        except DBAPIError:
+            continue
+        if row is None:
+            return None
+        if row[column] is None:
+            raise RuntimeError("Replication is not running")
+        return float(row[column])
+    return None
+
+
+_replicas = {}
+_round_robin = itertools.count()
+_monitor = None
+_monitor_stop = threading.Event()
+# The target an async request's concurrent sub-queries share, so they read one copy
+_read_target = ContextVar("read_target", default=None)
+
+
+def get_replicas(db_name: str):
+    replicas = _replicas.get(db_name)
+    if replicas is None:
+        with _registry_lock:
+            replicas = _replicas.get(db_name)
+            if replicas is None:
+                replicas = [Replica(db_name, index, url) for index, url in enumerate(get_replica_urls(db_name), 1)]
+                _replicas[db_name] = replicas
+    return replicas
+
+
+def check_replicas():
+    for replicas in list(_replicas.values()):
+        for replica in replicas:
+            replica.check()
+
+
+def _monitor_replicas():
+    while True:
+        check_replicas()
+        if _monitor_stop.wait(DB_REPLICA_CHECK_SECONDS):
+            return
+
+
+def _ensure_monitor():
+    global _monitor
+    if _monitor is not None:
+        return
+    with _registry_lock:
+        if _monitor is None:
+            _monitor_stop.clear()
+            _monitor = threading.Thread(target=_monitor_replicas, name="replica-monitor", daemon=True)
+            _monitor.start()
+
+
+def stop_replica_monitor():
+    global _monitor
+    if _monitor is None:
+        return
+    _monitor_stop.set()
+    _monitor.join(timeout=5)
+    _monitor = None
+
+
+def choose_replica(db_name: str):
+    """
+    Returns the replica db_name's next read should use: the one with the
+    fewest connections in use among the healthy replicas within
+    DB_REPLICA_MAX_LAG_SECONDS, rotating between equals. None means the
+    primary, when there are no replicas or none is usable. Replicas are
+    health-checked every DB_REPLICA_CHECK_SECONDS by a monitor thread
+    started on first use, and are not used before their first check.
+    """
+    replicas = get_replicas(db_name) if DB_READ_FROM_REPLICAS else []
+    if not replicas:
+        read_routing_count.inc((tenant_label(db_name), "primary"))
+        return None
+    _ensure_monitor()
+    usable = [replica for replica in replicas if replica.usable()]
+    if not usable:
+        read_routing_count.inc((tenant_label(db_name), "fallback"))
+        return None
+    start = next(_round_robin) % len(usable)
+    replica = min(usable[start:] + usable[:start], key=lambda replica: replica.in_use())
+    read_routing_count.inc((tenant_label(db_name), "replica"))
+    return replica
+
+
+def get_read_session(db_name: str):
+    """
+    Returns a Session for read-only analytics: on a replica chosen by
+    choose_replica, or the primary. Writes must use get_session.
+    """
+    replica = choose_replica(db_name)
+    if replica is None:
+        return get_session(db_name)
+    replica.get_engine()
+    return replica.Session()
+
+
+def get_async_read_session(db_name: str):
+    """
+    Async get_read_session. All read sessions opened by one async request
+    (its task and the sub-query tasks it gathers) use the same target.
+    """
+    targets = _read_target.get()
+    if targets is None:
+        targets = {}
+        _read_target.set(targets)
+    replica = targets.get(db_name, False)
+    if replica is False or (replica is not None and not replica.usable()):
+        replica = targets[db_name] = choose_replica(db_name)
+    if replica is None:
+        return get_async_session(db_name)
+    replica.get_async_engine()
+    return replica.AsyncSession()
+
+
+def get_replica_status():
+    """
+    Returns the last health check of every replica configured so far.
+    """
+    now = time.monotonic()
+    return {
+        replica.name: {
+            "url": make_url(replica.url).render_as_string(hide_password=True),
+            "healthy": replica.healthy,
+            "usable": replica.usable(),
+            "lag_seconds": replica.lag_seconds,
+            "checked_seconds_ago": round(now - replica.checked_at, 1) if replica.checked_at is not None else None,
+            "connections_in_use": replica.in_use(),
+            "error": replica.error,
+        }
+        for replicas in list(_replicas.values()) for replica in replicas
+    }
+
+
+def get_pool_stats():
+    """
+    Returns connection pool statistics for every engine created so far.
+    Async engines are listed as "<db_name>:async", replicas as
+    "<db_name>:replica<n>".
+    """
+    engines = list(_engines.items())
+    engines += [(f"{db_name}:async", engine.sync_engine) for db_name, engine in list(_async_engines.items())]
+    for replicas in list(_replicas.values()):
+        for replica in replicas:
+            if replica.engine is not None:
+                engines.append((replica.name, replica.engine))
+            if replica.async_engine is not None:
+                engines.append((f"{replica.name}:async", replica.async_engine.sync_engine))
+
+    stats = {}
+    for db_name, engine in engines:
+        pool = engine.pool
+        wait_count = getattr(pool, "wait_count", 0)
+        wait_total = getattr(pool, "wait_total", 0.0)
+        stats[db_name] = {
+            "pool_size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checkouts": wait_count,
+            "wait_total_ms": round(wait_total * 1000, 2),
+            "wait_avg_ms": round(wait_total * 1000 / wait_count, 2) if wait_count else 0,
+            "wait_max_ms": round(getattr(pool, "wait_max", 0.0) * 1000, 2),
+        }
+    return stats
+
+
+def dispose_engines():
+    """
+    Closes every pooled connection. Called on application shutdown.
+    """
+    stop_replica_monitor()
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
+        for replicas in _replicas.values():
+            for replica in replicas:
+                if replica.engine is not None:
+                    replica.engine.dispose()
+                    replica.engine = None
+
+
+async def dispose_async_engines():
+    """
+    Closes every pooled async connection. Called on application shutdown.
+    """
+    engines = list(_async_engines.values())
+    _async_engines.clear()
+    _async_sessionmakers.clear()
+    for replicas in list(_replicas.values()):
+        for replica in replicas:
+            if replica.async_engine is not None:
+                engines.append(replica.async_engine)
+                replica.async_engine = None
+    for engine in engines:
+        await engine.dispose()
+
+
+def upsert_rows(session, table, rows, update_columns, values=None):
+    """
+    Inserts rows into table, updating update_columns on primary key conflicts.
+    values maps columns to SQL expressions set on every row, evaluated by
+    the statement. Uses INSERT ... ON DUPLICATE KEY UPDATE on MySQL.
+    """
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        stmt = stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in update_columns})
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key.columns],
+            set_={col: stmt.excluded[col] for col in update_columns}
+        )
+    else:
+        raise ValueError(f"Upsert is not supported for dialect '{dialect}'")
+    if values:
+        stmt = stmt.values(values)
+    session.execute(stmt, rows)
@@ -0,0 +1,285 @@
+"""
+Flat export of product results, one row per size variant, shared by the
+download endpoints.
+"""
+import csv
+import io
+import os
+from itertools import islice
+
+from kpis import TRAILING_FIELDS
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+CSV_CHUNK_SIZE = int(os.getenv("CSV_CHUNK_SIZE", "65536"))
+ARROW_BATCH_ROWS = int(os.getenv("ARROW_BATCH_ROWS", "10000"))
+ARROW_COMPRESSION = os.getenv("ARROW_COMPRESSION", "zstd")
+
+EXPORT_COLUMNS = [
+    "item_id","item_name","item_type","product_type",
+    "day_since_launch","current_stock","sale_price",
+    "total_quantity_sold","total_views","total_atc",
+    "total_stock_percentage_sold","projected_days_to_sell_out","per_day_qty_average",
+    "size_summary","size","variant_stock","variant_quantity_sold",
+    "average_days_between_sales","days_since_last_sold",
+    # Appended, so the columns of exports without them keep their positions
+    *TRAILING_FIELDS
+]
+SIZEWISE_COLUMNS = EXPORT_COLUMNS[EXPORT_COLUMNS.index("size"):EXPORT_COLUMNS.index("days_since_last_sold") + 1]
+
+
+def iter_export_rows(results):
+    """
+    Flattens product dicts into export rows in EXPORT_COLUMNS order.
+    """
+    for row in results:
+        size_summary_text = f"{row['size_summary']['size']}"
+        for variant in row["size_summary"]["sizewise"]:
+            yield [
+                row["item_id"],
+                row["item_name"],
+                row["item_type"],
+                row["product_type"],
+                row["day_since_launch"],
+                row["current_stock"],
+                row["sale_price"],
+                row["total_quantity_sold"],
+                row["total_views"],
+                row["total_atc"],
+                row["total_stock_percentage_sold"],
+                row["projected_days_to_sell_out"],
+                row["per_day_qty_average"],
+                size_summary_text,
+                variant["size"],
+                variant["variant_stock"],
+                variant["variant_quantity_sold"],
+                variant["average_days_between_sales"],
+                variant["days_since_last_sold"],
+                *[row[field] for field in TRAILING_FIELDS]
+            ]
+
+
+def export_columns(fields):
+    """
+    Returns the export columns for a fields= selection (None means all).
+    The size columns are kept when size_summary is selected.
+    """
+    if fields is None:
+        return EXPORT_COLUMNS
+    return [
+        column for column in EXPORT_COLUMNS
+        if column in fields or column == "item_id"
+        or (column in SIZEWISE_COLUMNS and "size_summary" in fields)
+    ]
+
+
+def iter_sparse_export_rows(results, columns):
+    """
+    iter_export_rows for a subset of EXPORT_COLUMNS. Without the size
+    columns each product is a single row.
+    """
+    sizewise = [column in SIZEWISE_COLUMNS for column in columns]
+    has_sizes = any(sizewise)
+    for product in results:
+        # Placeholders where the size columns go, filled per variant
+        row = [
+            None if is_size
+            else product["size_summary"]["size"] if column == "size_summary"
+            else product.get(column)
+            for column, is_size in zip(columns, sizewise)
+        ]
+        if not has_sizes:
+            yield row
+            continue
+        for variant in product["size_summary"]["sizewise"]:
+            yield [variant[column] if is_size else value for column, is_size, value in zip(columns, sizewise, row)]
+
+
+def _iter_csv(header, rows, chunk_size: int):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+
+    if output.tell():
+        yield output.getvalue()
+
+
+def iter_csv_chunks(results, chunk_size: int = CSV_CHUNK_SIZE, fields=None):
+    """
+    Yields the CSV export of results in chunks of roughly chunk_size characters.
+    fields restricts the columns, as for the JSON endpoints.
+    """
+    if fields is not None:
+        columns = export_columns(fields)
+        return _iter_csv(columns, iter_sparse_export_rows(results, columns), chunk_size)
+    return _iter_csv(EXPORT_COLUMNS, iter_export_rows(results), chunk_size)
+
+
+def iter_tenant_csv_chunks(tenant_results, chunk_size: int = CSV_CHUNK_SIZE):
+    """
+    CSV export of several tenants' results, given as (db_name, results) pairs,
+    with a leading database column.
+    """
+    rows = (
+        [db_name] + export_row
+        for db_name, results in tenant_results
+        for export_row in iter_export_rows(results)
+    )
+    return _iter_csv(["database"] + EXPORT_COLUMNS, rows, chunk_size)
+
+
+async def aiter_csv_chunks(results, chunk_size: int = CSV_CHUNK_SIZE):
+    """
+    iter_csv_chunks for an async iterator of product dicts.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_COLUMNS)
+
+    async for product in results:
+        writer.writerows(iter_export_rows([product]))
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+
+    if output.tell():
+        yield output.getvalue()
+
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+def _to_str(value):
+    return str(value) if value is not None else None
+
+
+# Arrow type and converter per export column
+EXPORT_TYPES = {
+    "item_id": ("int64", _to_int),
+    "item_name": ("string", _to_str),
+    "item_type": ("string", _to_str),
+    "product_type": ("string", _to_str),
+    "day_since_launch": ("int32", _to_int),
+    "current_stock": ("int64", _to_int),
+    "sale_price": ("int64", _to_int),
+    "total_quantity_sold": ("int64", _to_int),
+    "total_views": ("int64", _to_int),
+    "total_atc": ("int64", _to_int),
+    "total_stock_percentage_sold": ("float64", _to_float),
+    "projected_days_to_sell_out": ("float64", _to_float),
+    "per_day_qty_average": ("float64", _to_float),
+    "size_summary": ("string", _to_str),
+    "size": ("string", _to_str),
+    "variant_stock": ("int64", _to_int),
+    "variant_quantity_sold": ("int64", _to_int),
+    "average_days_between_sales": ("float64", _to_float),
+    "days_since_last_sold": ("int64", _to_int),
+    **{field: ("float64", _to_float) if field.startswith("per_day_") else ("int64", _to_int) for field in TRAILING_FIELDS},
+}
+
+
+def get_export_schema():
+    import pyarrow as pa
+    return pa.schema([(name, pa.type_for_alias(EXPORT_TYPES[name][0])) for name in EXPORT_COLUMNS])
+
+
+def iter_record_batches(results, batch_rows: int = ARROW_BATCH_ROWS):
+    """
+    Yields typed pyarrow RecordBatches of at most batch_rows export rows.
+    """
+    import pyarrow as pa
+
+    schema = get_export_schema()
+    converters = [EXPORT_TYPES[name][1] for name in EXPORT_COLUMNS]
+    rows = iter_export_rows(results)
+    while True:
+        batch = list(islice(rows, batch_rows))
+        if not batch:
+            break
+        columns = [
+            pa.array([convert(row[i]) for row in batch], type=schema.field(i).type)
+            for i, convert in enumerate(converters)
+        ]
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands written bytes back to the caller in
+    chunks, so Arrow writers can stream without buffering the whole file.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet_chunks(results, compression: str = ARROW_COMPRESSION, batch_rows: int = ARROW_BATCH_ROWS):
+    """
+    Yields a Parquet file of the export rows, one row group per batch.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), get_export_schema(), compression=compression)
+    try:
+        for batch in iter_record_batches(results, batch_rows):
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def iter_arrow_chunks(results, compression: str = ARROW_COMPRESSION, batch_rows: int = ARROW_BATCH_ROWS):
+    """
+    Yields an Arrow IPC stream of the export rows, one message per batch.
+    """
+    import pyarrow as pa
+
+    sink = _ChunkSink()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), get_export_schema(), options=options)
+    try:
+        for batch in iter_record_batches(results, batch_rows):
+            writer.write_batch(batch)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
@@ -0,0 +1,68 @@
+"""
+Runs an analytics pipeline against every tenant database in parallel.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_read_session
+from cache import cached_fetch
+from models import DB_NAMES
+
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "30"))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", str(2 * len(DB_NAMES))))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+def _run_tenant(fetch, db_name: str, launch_start_days: int, launch_end_days: int, use_cache: bool):
+    with get_read_session(db_name) as session:
+        return cached_fetch(session, fetch, db_name, launch_start_days, launch_end_days, use_cache)
+
+
+async def fetch_all_tenants(fetch, launch_start_days: int, launch_end_days: int,
+                            timeout: float = FANOUT_TIMEOUT, use_cache: bool = True, db_names=DB_NAMES):
+    """
+    Runs fetch for every tenant concurrently on the fan-out worker threads.
+    Returns a list of (db_name, status, results) in db_names order, where
+    status reports "Success", "Timeout" or "Failed" with the elapsed time
+    and any error. Tenants that did not succeed have empty results.
+
+    A timed-out tenant's query is not interrupted; its worker is released
+    when the query finishes.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run(db_name):
+        start = time.perf_counter()
+        # Run in a copy of the request's context so stage timings reach its timer
+        future = loop.run_in_executor(
+            _executor, contextvars.copy_context().run,
+            _run_tenant, fetch, db_name, launch_start_days, launch_end_days, use_cache
+        )
+        try:
+            today, results = await asyncio.wait_for(future, timeout)
+            status = {"status": "Success", "products": len(results)}
+        except asyncio.TimeoutError:
+            results = []
+            status = {"status": "Timeout", "error": f"No result within {timeout}s"}
+        except Exception as e:
+            results = []
+            status = {"status": "Failed", "error": str(e)}
+        status["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return db_name, status, results
+
+    return await asyncio.gather(*(run(db_name) for db_name in db_names))
+
+
+def overall_status(outcomes):
+    succeeded = sum(1 for _, status, _ in outcomes if status["status"] == "Success")
+    if succeeded == len(outcomes):
+        return "Success"
+    return "Partial" if succeeded else "Failed"
+
+
+def shutdown_fanout():
+    _executor.shutdown(wait=False, cancel_futures=True)
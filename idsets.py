@@ -0,0 +1,131 @@
+"""
+Strategies for filtering aggregate queries by a large set of Item_Ids.
+
+Small sets are sent as a single IN (...) list. Larger ones are either
+re-selected server-side from the query that produced them (a semi-join on
+the launch window), split into IN batches whose results are merged here, or
+loaded into a session temporary table that the queries select from. Every
+strategy gives the same result.
+"""
+import itertools
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import Column, Integer, MetaData, Table, insert, select, text
+
+from instrumentation import Counter, METRICS, stage
+
+ID_STRATEGY = os.getenv("ID_STRATEGY", "auto")
+IN_LIST_MAX_IDS = int(os.getenv("IN_LIST_MAX_IDS", "2000"))
+ID_CHUNK_SIZE = int(os.getenv("ID_CHUNK_SIZE", "2000"))
+TEMP_TABLE_MIN_IDS = int(os.getenv("TEMP_TABLE_MIN_IDS", "20000"))
+
+STRATEGIES = ("in", "chunked", "temp_table", "semijoin")
+
+id_strategy_count = Counter("analytics_id_strategy_total", "Item id filters by strategy", ("strategy",))
+METRICS.append(id_strategy_count)
+
+_temp_table_names = itertools.count(1)
+
+
+def choose_strategy(n_ids: int, has_source: bool, strategy: str = None):
+    """
+    Picks how n_ids ids are passed to the aggregate queries. ID_STRATEGY (or
+    strategy) forces one; "semijoin" needs a source query and otherwise
+    falls back to the automatic choice.
+    """
+    strategy = strategy or ID_STRATEGY
+    if strategy in STRATEGIES and (strategy != "semijoin" or has_source):
+        return strategy
+    if n_ids <= IN_LIST_MAX_IDS:
+        return "in"
+    if has_source:
+        return "semijoin"
+    if n_ids < TEMP_TABLE_MIN_IDS:
+        return "chunked"
+    return "temp_table"
+
+
+def _create_id_table(session, item_ids, id_type):
+    name = f"tmp_item_ids_{next(_temp_table_names)}"
+    table = Table(name, MetaData(), Column("Item_Id", id_type, primary_key=True, autoincrement=False), prefixes=["TEMPORARY"])
+    connection = session.connection()
+    table.create(connection)
+    unique_ids = list(dict.fromkeys(item_ids))
+    for start in range(0, len(unique_ids), ID_CHUNK_SIZE):
+        connection.execute(insert(table), [{"Item_Id": item_id} for item_id in unique_ids[start:start + ID_CHUNK_SIZE]])
+    return table
+
+
+def _drop_id_table(session, table):
+    connection = session.connection()
+    if connection.dialect.name == "mysql":
+        # A plain DROP TABLE would commit the open transaction on MySQL
+        connection.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{table.name}`"))
+    else:
+        table.drop(connection)
+
+
+@contextmanager
+def item_id_batches(session, item_ids, source=None, id_type=None, strategy: str = None):
+    """
+    Yields the id filters to run a query with, each usable as
+    column.in_(batch): the id list itself, a list per chunk, a select from a
+    temporary table holding the ids (of id_type, default Integer), or
+    source, a select of Item_Id that returns exactly item_ids. The
+    temporary table is dropped on exit.
+    """
+    item_ids = list(item_ids)
+    strategy = choose_strategy(len(item_ids), source is not None, strategy)
+    id_strategy_count.inc((strategy,))
+
+    if strategy == "semijoin":
+        yield [source]
+    elif strategy == "chunked":
+        yield [item_ids[start:start + ID_CHUNK_SIZE] for start in range(0, len(item_ids), ID_CHUNK_SIZE)] or [[]]
+    elif strategy == "temp_table":
+        with stage("id_table"):
+            table = _create_id_table(session, item_ids, id_type or Integer())
+        try:
+            yield [select(table.c.Item_Id)]
+        finally:
+            _drop_id_table(session, table)
+    else:
+        yield [item_ids]
+
+
+def merge_maps(into: dict, part: dict):
+    """
+    Merges an aggregate map computed on one id batch into into. Per-item
+    entries only occur in one batch; totals keyed by group are summed.
+    """
+    for key, value in part.items():
+        if key not in into:
+            into[key] = value
+        elif isinstance(value, dict):
+            for field, amount in value.items():
+                into[key][field] += amount
+        elif isinstance(value, list):
+            into[key].extend(value)
+        else:
+            into[key] += value
+    return into
+
+
+def query_by_ids(session, fn, db_name: str, item_ids, *args, source=None, id_type=None):
+    """
+    Runs fn(session, db_name, ids, *args) over item_ids with the strategy
+    chosen for their number, and merges the per-batch results. fn returns
+    an aggregate map or a tuple of them.
+    """
+    with item_id_batches(session, item_ids, source, id_type) as batches:
+        result = None
+        for batch in batches:
+            part = fn(session, db_name, batch, *args)
+            if result is None:
+                result = part
+            elif isinstance(part, tuple):
+                result = tuple(merge_maps(merged, maps) for merged, maps in zip(result, part))
+            else:
+                result = merge_maps(result, part)
+        return result
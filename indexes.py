@@ -0,0 +1,92 @@
+"""
+Creates and verifies the indexes the analytics queries rely on.
+
+Usage:
+    python indexes.py --check            # report missing indexes for every tenant
+    python indexes.py zing beelittle     # create missing indexes for the given tenants
+"""
+import argparse
+
+from sqlalchemy import Index, inspect
+
+from db import get_engine
+from models import DB_NAMES, get_db_model
+
+
+def get_index_specs(db_name: str):
+    """
+    Returns the supporting indexes for db_name as (name, table, columns) tuples.
+    """
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+    return [
+        ("ix_items_launch_date", Item.__table__, [Item.launch_date.property.columns[0]]),
+        ("ix_sale_item_id_date", Sale.__table__, [Sale.__table__.c.Item_Id, Sale.__table__.c.Date]),
+        ("ix_viewsatc_item_id_date", ViewsAtc.__table__, [ViewsAtc.__table__.c.Item_Id, ViewsAtc.__table__.c.Date]),
+        ("ix_items_updated_at", Item.__table__, [Item.__table__.c.Updated_At]),
+        ("ix_sale_updated_at", Sale.__table__, [Sale.__table__.c.Updated_At]),
+        ("ix_viewsatc_updated_at", ViewsAtc.__table__, [ViewsAtc.__table__.c.Updated_At]),
+    ]
+
+
+def _is_covered(column_names, existing_indexes):
+    """
+    True if an existing index (or the primary key) starts with column_names.
+    """
+    for index_columns in existing_indexes:
+        if list(index_columns[:len(column_names)]) == column_names:
+            return True
+    return False
+
+
+def check_indexes(db_name: str):
+    """
+    Returns a list of {"index", "table", "columns", "present"} dicts for db_name.
+    """
+    inspector = inspect(get_engine(db_name))
+    report = []
+    for index_name, table, columns in get_index_specs(db_name):
+        column_names = [c.name for c in columns]
+        existing = [ix["column_names"] for ix in inspector.get_indexes(table.name)]
+        existing.append(inspector.get_pk_constraint(table.name).get("constrained_columns") or [])
+        report.append({
+            "index": index_name,
+            "table": table.name,
+            "columns": column_names,
+            "present": _is_covered(column_names, existing),
+        })
+    return report
+
+
+def ensure_indexes(db_name: str):
+    """
+    Creates any missing supporting index for db_name. Returns the names created.
+    """
+    engine = get_engine(db_name)
+    specs = {name: (table, columns) for name, table, columns in get_index_specs(db_name)}
+    created = []
+    for entry in check_indexes(db_name):
+        if entry["present"]:
+            continue
+        _, columns = specs[entry["index"]]
+        Index(entry["index"], *columns).create(bind=engine)
+        created.append(entry["index"])
+    return created
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or verify analytics indexes")
+    parser.add_argument("db_names", nargs="*", default=list(DB_NAMES))
+    parser.add_argument("--check", action="store_true", help="Only report, do not create")
+    args = parser.parse_args()
+
+    for db_name in args.db_names:
+        try:
+            if not args.check:
+                created = ensure_indexes(db_name)
+                for index_name in created:
+                    print(f"{db_name}: created {index_name}")
+            for entry in check_indexes(db_name):
+                state = "ok" if entry["present"] else "MISSING"
+                print(f"{db_name}: {entry['table']}({', '.join(entry['columns'])}) {state}")
+        except Exception as e:
+            print(f"Failed on {db_name}: {e}")
@@ -0,0 +1,273 @@
+"""
+Bulk ingestion of sale and viewsatc rows.
+
+The upload (NDJSON, or CSV with a header row) is parsed as it streams in,
+each row is validated against the tenant's model, and valid rows are
+upserted in batches of INGEST_BATCH_SIZE, one transaction per batch, on the
+primary. Every written row gets the database's current time as Updated_At,
+evaluated by the upsert itself right before the batch commits, so the data
+watermark ETags and the rollup refresh rely on moves forward with each
+batch. The tenant's cached responses are dropped after every batch.
+"""
+import csv
+import json
+import os
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func
+
+from cache import response_cache
+from db import get_session, upsert_rows
+from instrumentation import Counter, METRICS, stage, tenant_label
+from models import get_tenant
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", "1000"))
+INGEST_ERRORS_REPORTED = 20
+
+INGEST_TABLES = ("sale", "viewsatc")
+INGEST_FORMATS = ("ndjson", "csv")
+
+ingest_rows_count = Counter("analytics_ingest_rows_total", "Ingested rows by outcome", ("db_name", "table", "outcome"))
+METRICS.append(ingest_rows_count)
+
+
+class IngestError(Exception):
+    """
+    The upload cannot be ingested (unknown table, database or format, bad
+    header). status_code is the HTTP status to answer with.
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_ingest_model(db_name: str, table: str):
+    if table not in INGEST_TABLES:
+        raise IngestError(f"Unknown table '{table}'; expected one of {', '.join(INGEST_TABLES)}", 404)
+    try:
+        tenant = get_tenant(db_name)
+    except ValueError as e:
+        raise IngestError(str(e))
+    return {"sale": tenant.Sale, "viewsatc": tenant.ViewsAtc}[table]
+
+
+def detect_format(content_type: str):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    return "ndjson"
+
+
+class RowValidator:
+    """
+    Checks upload rows against a model. Fields are the model's attribute
+    names; the primary key is required, Updated_At is set by the ingest.
+    validate returns the row keyed by table column, ready for upsert_rows.
+    """
+
+    def __init__(self, model):
+        self.table = model.__table__
+        self.fields = {}
+        for attr in model.__mapper__.column_attrs:
+            column = attr.columns[0]
+            if attr.key == "Updated_At":
+                self.updated_column = column.key
+                continue
+            self.fields[attr.key] = column
+        self.required = [key for key, column in self.fields.items() if column.primary_key or not column.nullable]
+
+    def check_header(self, header):
+        unknown = [name for name in header if name not in self.fields]
+        if unknown:
+            raise IngestError(f"Unknown columns: {', '.join(unknown)}")
+        missing = [name for name in self.required if name not in header]
+        if missing:
+            raise IngestError(f"Missing required columns: {', '.join(missing)}")
+
+    def _coerce(self, key, column, value):
+        if value is None or value == "":
+            if key in self.required:
+                raise ValueError(f"{key} is required")
+            return None
+        python_type = column.type.python_type
+        if python_type is date:
+            return value if isinstance(value, date) else date.fromisoformat(str(value))
+        if python_type is int:
+            if isinstance(value, bool) or (isinstance(value, Decimal) and value != value.to_integral_value()):
+                raise ValueError(f"{key} must be an integer")
+            return int(value)
+        if python_type is Decimal:
+            try:
+                return Decimal(str(value))
+            except InvalidOperation:
+                raise ValueError(f"{key} must be a number")
+        value = str(value)
+        length = getattr(column.type, "length", None)
+        if length is not None and len(value) > length:
+            raise ValueError(f"{key} is longer than {length} characters")
+        return value
+
+    def validate(self, record):
+        if not isinstance(record, dict):
+            raise ValueError("Row is not an object")
+        unknown = [key for key in record if key not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        row = {}
+        for key, column in self.fields.items():
+            if key in record or key in self.required:
+                try:
+                    row[column.key] = self._coerce(key, column, record.get(key))
+                except (TypeError, ValueError, InvalidOperation) as e:
+                    raise ValueError(str(e) if str(e).startswith(key) else f"{key}: {e}")
+        return row
+
+
+async def iter_lines(chunks):
+    """
+    Yields (line number, text) for each line of an async stream of bytes.
+    """
+    buffer = b""
+    line_no = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode("utf-8-sig" if line_no == 1 else "utf-8").rstrip("\r")
+    if buffer:
+        yield line_no + 1, buffer.decode("utf-8-sig" if line_no == 0 else "utf-8").rstrip("\r")
+
+
+async def iter_records(chunks, fmt: str, validator: RowValidator):
+    """
+    Yields (line number, row, error) for each record of the upload; row is
+    None when the record is invalid.
+    """
+    if fmt == "csv":
+        header = None
+        pending, start = [], None
+        async for line_no, line in iter_lines(chunks):
+            if not pending and not line.strip():
+                continue
+            pending.append(line)
+            start = start or line_no
+            # A quoted field may contain newlines: wait for the closing quote
+            if "\n".join(pending).count('"') % 2:
+                continue
+            fields = next(csv.reader(["\n".join(pending)]))
+            pending, record_line = [], start
+            start = None
+            if header is None:
+                header = [name.strip() for name in fields]
+                validator.check_header(header)
+                continue
+            if len(fields) != len(header):
+                yield record_line, None, f"Expected {len(header)} fields, got {len(fields)}"
+                continue
+            try:
+                yield record_line, validator.validate(dict(zip(header, fields))), None
+            except ValueError as e:
+                yield record_line, None, str(e)
+        if pending:
+            yield start, None, "Unterminated quoted field"
+        return
+
+    async for line_no, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, validator.validate(json.loads(line, parse_float=Decimal)), None
+        except ValueError as e:
+            yield line_no, None, str(e)
+
+
+def write_batch(db_name: str, validator: RowValidator, rows):
+    """
+    Upserts rows in one transaction on db_name's primary, stamping them with
+    the database's current time when each upsert runs. Rows repeating a key are merged, later
+    values winning; an existing row only has the columns given in the upload
+    updated.
+    """
+    key_columns = [column.key for column in validator.table.primary_key.columns]
+    merged = {}
+    for row in rows:
+        merged.setdefault(tuple(row[key] for key in key_columns), {}).update(row)
+    rows = list(merged.values())
+    # Multi-row statements need the same columns in every row
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+
+    with get_session(db_name) as session:
+        for columns, group in groups.items():
+            update_columns = [column for column in columns if column not in key_columns]
+            upsert_rows(session, validator.table, group, update_columns + [validator.updated_column],
+                        values={validator.updated_column: func.current_timestamp()})
+        session.commit()
+    return len(rows)
+
+
+async def ingest_stream(db_name: str, table: str, chunks, fmt: str, run_sync, max_errors: int = INGEST_MAX_ERRORS):
+    """
+    Ingests an upload into db_name's table. chunks is an async iterator of
+    bytes; run_sync(fn, *args) runs a blocking call off the event loop.
+    Returns the ingest report. Its "error" is set if the ingest stopped
+    early, because more than max_errors rows were rejected or a batch failed
+    to write; the batches written before stay committed. Valid rows read
+    before a max_errors stop are still written.
+    """
+    if fmt not in INGEST_FORMATS:
+        raise IngestError(f"Unknown format '{fmt}'; expected one of {', '.join(INGEST_FORMATS)}")
+    validator = RowValidator(get_ingest_model(db_name, table))
+    labels = (tenant_label(db_name), table)
+    report = {"rows_received": 0, "rows_written": 0, "rows_rejected": 0, "batches": 0, "error": None, "errors": []}
+    start = time.perf_counter()
+    write_seconds = 0.0
+
+    async def flush(batch):
+        nonlocal write_seconds
+        batch_start = time.perf_counter()
+        with stage("ingest_write") as timing:
+            written = await run_sync(write_batch, db_name, validator, batch)
+            timing.rows = written
+        # Rows stamped within the second of a cached result's watermark leave it unchanged
+        response_cache.clear(db_name)
+        write_seconds += time.perf_counter() - batch_start
+        report["rows_written"] += written
+        report["batches"] += 1
+        ingest_rows_count.inc(labels + ("written",), written)
+
+    batch = []
+    try:
+        async for line_no, row, error in iter_records(chunks, fmt, validator):
+            report["rows_received"] += 1
+            if error is not None:
+                report["rows_rejected"] += 1
+                ingest_rows_count.inc(labels + ("rejected",))
+                if len(report["errors"]) < INGEST_ERRORS_REPORTED:
+                    report["errors"].append({"line": line_no, "error": error})
+                if report["rows_rejected"] > max_errors:
+                    report["error"] = f"Stopped after more than {max_errors} invalid rows"
+                    break
+                continue
+            batch.append(row)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+    except IngestError:
+        raise
+    except Exception as e:
+        report["error"] = str(e)
+
+    elapsed = time.perf_counter() - start
+    report["elapsed_ms"] = round(elapsed * 1000, 2)
+    report["write_ms"] = round(write_seconds * 1000, 2)
+    report["rows_per_second"] = round(report["rows_written"] / elapsed, 1) if elapsed else None
+    return report
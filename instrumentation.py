@@ -0,0 +1,263 @@
+"""
+Per-request timing of the analytics stages and SQL queries.
+
+Pipeline code marks its stages with `with stage("name")`. SQLAlchemy cursor
+events add each query's time to the current stage. At the end of a request
+the stages are reported in a Server-Timing header and recorded in the
+Prometheus histograms served by /metrics. Queries slower than SLOW_QUERY_MS
+are logged.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from models import DB_NAMES
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+slow_query_logger = logging.getLogger("slow_query")
+
+_current_timer = ContextVar("request_timer", default=None)
+# Kept apart from the timer so threads and tasks sharing a request's timer
+# each track their own stage
+_current_stage = ContextVar("request_stage", default=None)
+
+
+class StageTiming:
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = None
+
+
+class RequestTimer:
+    """
+    Collects the stage and query timings of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def get_stage(self, name: str):
+        timing = self.stages.get(name)
+        if timing is None:
+            timing = self.stages[name] = StageTiming()
+        return timing
+
+    def server_timing(self, total_seconds: float):
+        """
+        Returns the Server-Timing header value.
+        """
+        entries = []
+        for name, timing in self.stages.items():
+            desc = [f"queries={timing.queries}"] if timing.queries else []
+            if timing.rows is not None:
+                desc.append(f"rows={timing.rows}")
+            if timing.queries:
+                desc.append(f"db={timing.db_seconds * 1000:.1f}ms")
+            entry = f"{name};dur={timing.seconds * 1000:.1f}"
+            if desc:
+                entry += f';desc="{" ".join(desc)}"'
+            entries.append(entry)
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage of the current request. Yields its StageTiming;
+    set .rows to report the rows it produced. Outside a request it only
+    yields a throwaway StageTiming.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield StageTiming()
+        return
+    timing = timer.get_stage(name)
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.seconds += time.perf_counter() - start
+        _current_stage.reset(token)
+
+
+@contextmanager
+def request_timer():
+    """
+    Makes a new RequestTimer current for the enclosed request.
+    """
+    timer = RequestTimer()
+    token = _current_timer.set(timer)
+    stage_token = _current_stage.set(None)
+    try:
+        yield timer
+    finally:
+        _current_stage.reset(stage_token)
+        _current_timer.reset(token)
+
+
+class Histogram:
+    """
+    Minimal Prometheus histogram with a fixed label set.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value: float):
+        labels = tuple(labels)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        for labels, (counts, count, total) in sorted(series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+        return lines
+
+
+class Counter:
+    """
+    Minimal Prometheus counter with a fixed label set.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount: float = 1):
+        labels = tuple(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            label_text = ",".join(f'{name}="{label}"' for name, label in zip(self.labelnames, labels))
+            lines.append(f"{self.name}{{{label_text}}} {value}")
+        return lines
+
+
+request_latency = Histogram(
+    "analytics_request_duration_seconds", "Request latency by endpoint and tenant", ("endpoint", "db_name")
+)
+stage_latency = Histogram(
+    "analytics_stage_duration_seconds", "Pipeline stage latency by endpoint, tenant and stage",
+    ("endpoint", "db_name", "stage")
+)
+query_count = Counter("analytics_queries_total", "SQL statements executed", ("endpoint", "db_name"))
+slow_query_count = Counter("analytics_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS", ("db_name",))
+
+METRICS = [request_latency, stage_latency, query_count, slow_query_count]
+
+
+def tenant_label(db_name: str):
+    # Bounded label values: unknown names share one series
+    if db_name is None:
+        return "none"
+    return db_name if db_name in DB_NAMES else "other"
+
+
+def record_request(timer: RequestTimer, endpoint: str, db_name: str, seconds: float):
+    tenant = tenant_label(db_name)
+    request_latency.observe((endpoint, tenant), seconds)
+    queries = 0
+    for name, timing in timer.stages.items():
+        stage_latency.observe((endpoint, tenant, name), timing.seconds)
+        queries += timing.queries
+    if queries:
+        query_count.inc((endpoint, tenant), queries)
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish_query(conn, statement, parameters)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # time so the next statement on the connection is not timed from it
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get("query_start"):
+        _finish_query(conn, exception_context.statement, exception_context.parameters)
+
+
+def _finish_query(conn, statement, parameters):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+
+    timer = _current_timer.get()
+    if timer is not None:
+        current = _current_stage.get()
+        timing = timer.get_stage(current or "sql")
+        timing.db_seconds += elapsed
+        timing.queries += 1
+        if current is None:
+            timing.seconds += elapsed
+
+    if SLOW_QUERY_MS >= 0 and elapsed * 1000 >= SLOW_QUERY_MS:
+        database = conn.engine.url.database
+        slow_query_count.inc((tenant_label(database),))
+        slow_query_logger.warning(
+            "Slow query on %s: %.1f ms\n%s\nparameters: %.500s",
+            database, elapsed * 1000, statement, repr(parameters)
+        )
+
+
+def instrument_engine(engine):
+    """
+    Times every statement executed on engine.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
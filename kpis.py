@@ -0,0 +1,148 @@
+"""
+Vectorized derived product KPIs.
+"""
+import os
+from operator import itemgetter
+
+import numpy as np
+
+# Trailing sales windows, in days, reported next to the lifetime totals
+TRAILING_WINDOWS = tuple(sorted({int(days) for days in os.getenv("TRAILING_WINDOWS", "7,30,90").split(",") if days.strip()}))
+
+
+def trailing_fields(days: int):
+    """
+    Returns the (quantity, views, ATC, per-day quantity) field names of a
+    trailing window.
+    """
+    return f"qty_sold_{days}d", f"views_{days}d", f"atc_{days}d", f"per_day_qty_{days}d"
+
+
+TRAILING_FIELDS = [field for days in TRAILING_WINDOWS for field in trailing_fields(days)]
+
+
+def _float_array(values):
+    # None becomes NaN
+    return np.array(values, dtype=float)
+
+
+def _round2(values):
+    """
+    round(value, 2) of every element, as the builtin rounds a float: the
+    exact binary value goes to the nearest hundredth, ties to even. x * 100
+    is itself rounded, so its rounding error is recovered (Dekker's split)
+    to tell which side of the half-way point the exact product lies.
+    """
+    scaled = values * 100
+    split = values * 134217729.0
+    high = split - (split - values)
+    low = values - high
+    error = (high * 100 - scaled) + low * 100
+    whole = np.floor(scaled)
+    above = (scaled - whole - 0.5) + error
+    up = (above > 0) | ((above == 0) & (np.fmod(whole, 2) != 0))
+    # Keeps the sign of values rounded to zero, like round(-0.001, 2)
+    return np.copysign((whole + up) / 100, values)
+
+
+def _ratio(numerator, denominator):
+    """
+    Returns (valid, rounded): where the denominator is non-zero and neither
+    side is missing, round(numerator / denominator, 2).
+    """
+    valid = (denominator != 0) & ~np.isnan(denominator) & ~np.isnan(numerator)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rounded = _round2(numerator / np.where(valid, denominator, 1))
+    return valid, rounded
+
+
+def _listed(valid, values):
+    # Python floats, and the int 0 of the per-row rules where invalid
+    return np.where(valid, values.astype(object), 0).tolist()
+
+
+def compute_kpis(today, launch_dates, current_stock, qty_sold, last_sale_days_ago):
+    """
+    Computes day_since_launch, total_stock_percentage_sold, per_day_qty_average
+    and projected_days_to_sell_out for all rows at once. Inputs are
+    equal-length sequences; None means missing. Returns a dict of lists.
+
+    days_active is day_since_launch, except for sold-out rows
+    (current_stock == 0) with a last sale, where it runs from launch to the
+    last sale. Ratios with a zero or missing denominator are 0.
+    projected_days_to_sell_out divides by the rounded per_day_qty_average.
+    The ratios are computed on float arrays and rounded like round(), so int
+    inputs give the per-row results exactly. Decimal quantities (MySQL SUMs)
+    are converted to float first: a quotient that is an exact decimal tie,
+    such as 3 / 40 = 0.075, rounds as the float does (0.07) where Decimal
+    arithmetic would round it half to even (0.08).
+    """
+    # Ordinals convert far faster than date objects to datetime64
+    launch = _float_array([None if launch_date is None else launch_date.toordinal() for launch_date in launch_dates])
+    has_launch = ~np.isnan(launch)
+    day_since_launch = today.toordinal() - launch
+
+    stock = _float_array(current_stock)
+    qty = _float_array(qty_sold)
+    last_sale = _float_array(last_sale_days_ago)
+
+    sold_out = (stock == 0) & ~np.isnan(last_sale)
+    days_active = np.where(sold_out, day_since_launch - last_sale, day_since_launch)
+
+    total = qty + stock
+    total_valid = (total != 0) & ~np.isnan(total)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # (qty / total) * 100, rounded after the multiplication as per row
+        pct = _round2(qty / np.where(total_valid, total, 1) * 100)
+    per_day_valid, per_day = _ratio(qty, days_active)
+    per_day = np.where(per_day_valid, per_day, 0)
+    projected_valid, projected = _ratio(stock, per_day)
+
+    return {
+        "day_since_launch": np.where(
+            has_launch, np.nan_to_num(day_since_launch).astype(np.int64).astype(object), None
+        ).tolist(),
+        "total_stock_percentage_sold": _listed(total_valid, pct),
+        "per_day_qty_average": _listed(per_day_valid, per_day),
+        "projected_days_to_sell_out": _listed(projected_valid, projected),
+    }
+
+
+def apply_kpis(today, results, launch_dates, last_sale_days_ago):
+    """
+    Fills the KPI fields of product result dicts in place from their
+    current_stock and total_quantity_sold.
+    """
+    if not results:
+        return results
+    kpis = compute_kpis(
+        today, launch_dates, _column(results, "current_stock"), _column(results, "total_quantity_sold"),
+        last_sale_days_ago
+    )
+    kpis.update(trailing_kpis(kpis["day_since_launch"], results))
+    # Assigning one field at a time is faster than a dict.update per row
+    for field, values in kpis.items():
+        for result, value in zip(results, values):
+            result[field] = value
+    return results
+
+
+def _column(results, field):
+    return _float_array(list(map(itemgetter(field), results)))
+
+
+def trailing_kpis(day_since_launch, results):
+    """
+    Returns per_day_qty_<n>d for each trailing window, as lists: the
+    quantity sold in the window divided by the days of the window the
+    product has been on sale (launch day included), rounded like
+    per_day_qty_average. Rows without trailing totals get 0.
+    """
+    day_since_launch = _float_array(day_since_launch)
+    kpis = {}
+    for days in TRAILING_WINDOWS:
+        qty_field, _, _, per_day_field = trailing_fields(days)
+        # fmin ignores the NaN of a missing launch date, leaving the full window
+        days_active = np.fmin(days, day_since_launch + 1)
+        kpis[per_day_field] = _listed(*_ratio(_column(results, qty_field), np.where(days_active > 0, days_active, 0)))
+    return kpis
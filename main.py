@@ -1,192 +1,121 @@
-from fastapi import FastAPI, Query
-from fastapi.responses import RedirectResponse, StreamingResponse
-from db import get_session
-from datetime import date, timedelta
-from sqlalchemy import func, cast, Integer, case
-from models import get_db_model
-from collections import Counter
-import io
-import csv
+from fastapi import FastAPI, Query, Header, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from datetime import date
+import time
+from db import (
+    get_read_session, get_async_read_session, get_pool_stats, get_replica_status, dispose_engines,
+    dispose_async_engines
+)
+from rollup import refresh_rollup
+from catalog import start_catalog_refresher, stop_catalog_refresher, catalog_stats
+from models import DB_NAMES
+from warmer import start_warmer, stop_warmer, trigger as trigger_warmer, warmer_status
+from ingest import ingest_stream, detect_format, IngestError, INGEST_MAX_ERRORS
+from cache import (
+    cached_fetch, cached_fetch_async, lookup_cached, lookup_cached_async, response_cache, in_flight,
+    get_data_watermark, make_etag, etag_matches
+)
+from export import iter_csv_chunks, aiter_csv_chunks, iter_parquet_chunks, iter_arrow_chunks, iter_tenant_csv_chunks
+from fanout import FANOUT_TIMEOUT, fetch_all_tenants, overall_status, shutdown_fanout
+from analytics import fetch_products, fetch_products_fused, fetch_products_by_name, stream_products, parse_fields
+from pagination import fetch_products_page, fetch_products_by_name_page, decode_products_cursor, decode_by_name_cursor
+from instrumentation import request_timer, record_request, render_metrics, SERVER_TIMING_ENABLED
+from serialize import json_response, negotiate_encoding, compress_chunks, COMPRESSION_ENABLED
+from analytics_async import fetch_products_async, fetch_products_by_name_async, stream_products_async
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_catalog_refresher(DB_NAMES)
+    start_warmer()
+    yield
+    stop_warmer()
+    stop_catalog_refresher()
+    shutdown_fanout()
+    dispose_engines()
+    await dispose_async_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """
+    Times each request's pipeline stages and queries, reports them in a
+    Server-Timing header and records them for /metrics.
+    """
+    with request_timer() as timer:
+        response = await call_next(request)
+        elapsed = time.perf_counter() - timer.start
+
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    record_request(timer, endpoint, request.query_params.get("db_name"), elapsed)
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = timer.server_timing(elapsed)
+    return response
+
+
+def check_cursor(cursor: str, decode):
+    if cursor is not None:
+        try:
+            decode(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def check_fields(fields: str):
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
-app = FastAPI()
+def not_modified(etag: str):
+    headers = {"ETag": etag}
+    if COMPRESSION_ENABLED:
+        headers["Vary"] = "Accept-Encoding"
+    return Response(status_code=304, headers=headers)
 
 
 @app.get("/products/by_name")
 def products_by_name(
     db_name: str = Query(..., description="Database name to connect"),
     launch_start_days: int = Query(..., description="Min days since launch"),
-    launch_end_days: int = Query(..., description="Max days since launch")
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged"),
+    limit: int = Query(None, ge=1, description="Return at most this many products per page"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    fields: str = Query(None, description="Comma-separated fields to return; aggregates only needed by other fields are not queried"),
+    if_none_match: str = Header(None, description="ETag of a previous response; 304 if the data is unchanged"),
+    accept_encoding: str = Header(None, include_in_schema=False)
 ):
     import traceback
+    check_cursor(cursor, decode_by_name_cursor)
+    selected = check_fields(fields)
+    if limit is not None:
+        fetch, params = fetch_products_by_name_page, {"limit": limit, "cursor": cursor, "fields": selected}
+    else:
+        fetch, params = fetch_products_by_name, {"fields": selected}
     try:
-        with get_session(db_name) as session:
-            today = date.today()
-            Item, Sale, ViewsAtc = get_db_model(db_name)
-            group_column = Item.Category if hasattr(Item, "Category") else Item.Product_Type
-
-            # Query all items in date range
-            items_query = (
-                session.query(
-                    Item.Item_Id,
-                    Item.Item_Name,
-                    Item.Item_Type,
-                    group_column,
-                    Item.launch_date,
-                    cast(Item.Current_Stock, Integer).label("current_stock"),
-                    cast(Item.Sale_Price, Integer).label("sale_price"),
-                    Item.Size if hasattr(Item, "Size") else None
-                )
-                .filter(func.datediff(func.current_date(), Item.launch_date)
-                        .between(launch_start_days, launch_end_days))
-                .all()
+        with get_read_session(db_name) as session:
+            watermark = get_data_watermark(session, db_name)
+            etag = make_etag(watermark, date.today(), fetch, db_name, launch_start_days, launch_end_days, **params)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+
+            today, results = cached_fetch(
+                session, fetch, db_name, launch_start_days, launch_end_days, use_cache,
+                watermark=watermark, **params
             )
+            next_cursor = None
+            if limit is not None:
+                results, next_cursor = results
 
-            # Precompute total quantity sold per Item_Id
-            all_item_ids = [item.Item_Id for item in items_query]
-            qty_sold_map = {
-                row.Item_Id: row.total_qty
-                for row in session.query(
-                    Sale.Item_Id,
-                    func.coalesce(func.sum(Sale.Quantity), 0).label("total_qty")
-                ).filter(Sale.Item_Id.in_(all_item_ids)).group_by(Sale.Item_Id).all()
-            }
-
-            # Total views & ATC per Item_Name + category
-            views_atc_map = {}
-            views_rows = (
-                session.query(
-                    Item.Item_Name,
-                    group_column.label("category"),
-                    func.coalesce(func.sum(ViewsAtc.Items_Viewed), 0).label("total_views"),
-                    func.coalesce(func.sum(ViewsAtc.Items_Addedtocart), 0).label("total_atc")
-                )
-                .join(ViewsAtc, ViewsAtc.Item_Id == Item.Item_Id)
-                .filter(Item.Item_Id.in_(all_item_ids))
-                .group_by(Item.Item_Name, group_column)
-                .all()
-            )
-            for row in views_rows:
-                views_atc_map[(row.Item_Name, row.category)] = {
-                    "total_views": row.total_views,
-                    "total_atc": row.total_atc
-                }
-
-            # Size-level data per Item_Id
-            size_data_map = {}
-            size_rows = (
-                session.query(
-                    Item.Item_Id,
-                    Item.Size if hasattr(Item, "Size") else None,
-                    cast(Item.Current_Stock, Integer).label("current_stock"),
-                    func.coalesce(func.sum(Sale.Quantity), 0).label("qty_sold"),
-                    func.coalesce(
-                        case(
-                            (func.count(Sale.Date) > 1,
-                             (func.datediff(func.max(Sale.Date), func.min(Sale.Date)) /
-                              (func.count(Sale.Date) - 1))
-                             ),
-                            else_=0
-                        ), 0
-                    ).label("avg_days_between_sales"),
-                    func.coalesce(func.datediff(func.current_date(), func.max(Sale.Date)), 0).label("days_since_last_sold")
-                )
-                .outerjoin(Sale, Sale.Item_Id == Item.Item_Id)
-                .filter(Item.Item_Id.in_(all_item_ids))
-                .group_by(Item.Item_Id, Item.Size if hasattr(Item, "Size") else Item.Item_Id, Item.Current_Stock)
-                .all()
-            )
-            for row in size_rows:
-                item_id = row[0]
-                if item_id not in size_data_map:
-                    size_data_map[item_id] = []
-                size_data_map[item_id].append(row[1:])
-
-            # Group by item_name + product_type
-            grouped_map = {}
-            for item in items_query:
-                item_name = item.Item_Name
-                product_type = getattr(item, group_column.key) if hasattr(item, group_column.key) else None
-                key = (item_name, product_type)
-                if key not in grouped_map:
-                    grouped_map[key] = {
-                        "item_type": item.Item_Type,
-                        "launch_date": item.launch_date,
-                        "variants": []
-                    }
-                grouped_map[key]["variants"].append({
-                    "item_id": item.Item_Id,
-                    "size": item.Size if hasattr(item, "Size") else None,
-                    "current_stock": item.current_stock,
-                    "sale_price": item.sale_price,
-                    "qty_sold": qty_sold_map.get(item.Item_Id, 0),
-                    "size_data": size_data_map.get(item.Item_Id, [])
-                })
-
-            # Build results
-            results = []
-            for key, group in grouped_map.items():
-                item_name, product_type = key
-                item_type = group["item_type"]
-                launch_date = group["launch_date"]
-                variants = group["variants"]
-
-                total_current_stock = sum(v["current_stock"] for v in variants)
-                sale_price_counter = Counter([v["sale_price"] for v in variants])
-                sale_price = sale_price_counter.most_common(1)[0][0]
-                total_quantity_sold = sum(v["qty_sold"] for v in variants)
-                views_data = views_atc_map.get((item_name, product_type), {"total_views": 0, "total_atc": 0})
-                total_views = views_data["total_views"]
-                total_atc = views_data["total_atc"]
-
-                # Size summary
-                all_size_data = []
-                for v in variants:
-                    all_size_data.extend(v["size_data"])
-                total_variants = len(all_size_data)
-                variants_in_stock = sum(1 for sd in all_size_data if sd[1] > 0)
-                sizewise_list = [
-                    {
-                        "size": sd[0],
-                        "item_id": v["item_id"],
-                        "variant_stock": sd[1],
-                        "variant_quantity_sold": sd[2],
-                        "average_days_between_sales": round(sd[3] or 0, 2),
-                        "days_since_last_sold": sd[4]
-                    }
-                    for v in variants for sd in v["size_data"]
-                ]
-
-                day_since_launch = (today - launch_date).days if launch_date else None
-                last_sale_days_ago = min([sv["days_since_last_sold"] for sv in sizewise_list if sv["days_since_last_sold"] is not None], default=None)
-                if last_sale_days_ago is not None and total_current_stock == 0:
-                    last_sale_date = today - timedelta(days=last_sale_days_ago)
-                    days_active = (last_sale_date - launch_date).days if launch_date and last_sale_date else day_since_launch
-                else:
-                    days_active = day_since_launch
-                total_stock_percentage_sold = round((total_quantity_sold / (total_quantity_sold + total_current_stock)) * 100, 2) if (total_quantity_sold + total_current_stock) else 0
-                per_day_qty_average = round((total_quantity_sold / days_active), 2) if days_active else 0
-                projected_days_to_sell_out = round((total_current_stock / per_day_qty_average), 2) if per_day_qty_average else 0
-
-                results.append({
-                    "item_name": item_name,
-                    "item_type": item_type,
-                    "product_type": product_type,
-                    "day_since_launch": day_since_launch,
-                    "current_stock": total_current_stock,
-                    "sale_price": sale_price,
-                    "total_quantity_sold": total_quantity_sold,
-                    "total_views": total_views,
-                    "total_atc": total_atc,
-                    "total_stock_percentage_sold": total_stock_percentage_sold,
-                    "projected_days_to_sell_out": projected_days_to_sell_out,
-                    "per_day_qty_average": per_day_qty_average,
-                    "size_summary": {
-                        "size": f"'{variants_in_stock}/{total_variants}",
-                        "sizewise": sizewise_list
-                    }
-                })
-
-            return {
+            payload = {
                 "status": "Success",
                 "database": db_name,
                 "launch_start_days": launch_start_days,
@@ -194,6 +123,9 @@ def products_by_name(
                 "today": str(today),
                 "products": results
             }
+            if limit is not None:
+                payload["next_cursor"] = next_cursor
+            return json_response(payload, accept_encoding, {"ETag": etag})
     except Exception as e:
         return {
             "status": "Connection failed",
@@ -202,193 +134,194 @@ def products_by_name(
             "traceback": traceback.format_exc()
         }
 
+
+@app.get("/products/all_tenants")
+async def products_all_tenants(
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    by_name: bool = Query(False, description="Aggregate by product name like /products/by_name"),
+    timeout: float = Query(FANOUT_TIMEOUT, description="Seconds to wait for each database"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged")
+):
+    fetch = fetch_products_by_name if by_name else fetch_products
+    outcomes = await fetch_all_tenants(fetch, launch_start_days, launch_end_days, timeout, use_cache)
+
+    return {
+        "status": overall_status(outcomes),
+        "launch_start_days": launch_start_days,
+        "launch_end_days": launch_end_days,
+        "today": str(date.today()),
+        "databases": {db_name: status for db_name, status, _ in outcomes},
+        "products": [
+            {"database": db_name, **product}
+            for db_name, _, results in outcomes
+            for product in results
+        ]
+    }
+
+
+@app.get("/products/all_tenants/csv")
+async def products_all_tenants_csv(
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    timeout: float = Query(FANOUT_TIMEOUT, description="Seconds to wait for each database"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged")
+):
+    outcomes = await fetch_all_tenants(fetch_products, launch_start_days, launch_end_days, timeout, use_cache)
+    failed = [f"{db_name}={status['status']}" for db_name, status, _ in outcomes if status["status"] != "Success"]
+
+    headers = {"Content-Disposition": f"attachment; filename=products_all_tenants_{date.today()}.csv"}
+    if failed:
+        headers["X-Failed-Databases"] = ", ".join(failed)
+    return StreamingResponse(
+        iter_tenant_csv_chunks((db_name, results) for db_name, _, results in outcomes),
+        media_type="text/csv",
+        headers=headers
+    )
+
+
 @app.get("/", include_in_schema=False)
 def root():
     return RedirectResponse(url="/docs")
 
 
-def fetch_products(session, db_name: str, launch_start_days: int, launch_end_days: int):
-    today = date.today()
+@app.post("/rollup/refresh")
+def rollup_refresh(
+    db_name: str = Query(..., description="Database name to connect")
+):
+    import traceback
+    try:
+        refreshed = refresh_rollup(db_name)
+    except Exception as e:
+        return {
+            "status": "Refresh failed",
+            "database": db_name,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
 
-    Item, Sale, ViewsAtc = get_db_model(db_name)
+    return {
+        "status": "Success",
+        "database": db_name,
+        "refreshed_items": refreshed
+    }
 
-    group_column = Item.Category if hasattr(Item, "Category") else Item.Product_Type
 
-    grouped_items = (
-        session.query(
-            Item.Item_Id,
-            Item.Item_Name,
-            Item.Item_Type,
-            group_column,
-            Item.launch_date,
-            cast(Item.Current_Stock, Integer).label("current_stock"),
-            cast(Item.Sale_Price, Integer).label("sale_price"),
-        )
-        .filter(func.datediff(func.current_date(), Item.launch_date)
-                .between(launch_start_days, launch_end_days))
-        .all()
-    )
+@app.post("/ingest/{table}")
+async def ingest(
+    request: Request,
+    table: str,
+    db_name: str = Query(..., description="Database name to connect"),
+    format: str = Query(None, description="ndjson or csv (default: from Content-Type, else ndjson)"),
+    max_errors: int = Query(INGEST_MAX_ERRORS, ge=0, description="Stop after this many invalid rows")
+):
+    """
+    Upserts the uploaded sale / viewsatc rows (NDJSON, or CSV with a header)
+    in batches and reports the throughput.
+    """
+    import traceback
+    fmt = format or detect_format(request.headers.get("content-type"))
+    try:
+        report = await ingest_stream(db_name, table, request.stream(), fmt, run_in_threadpool, max_errors)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        return {
+            "status": "Connection failed",
+            "database": db_name,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
 
-    item_ids = [item.Item_Id for item in grouped_items]
-
-    qty_sold_map = {
-        row.Item_Id: row.total_qty
-        for row in session.query(
-            Sale.Item_Id,
-            func.coalesce(func.sum(Sale.Quantity), 0).label("total_qty")
-        )
-        .filter(Sale.Item_Id.in_(item_ids))
-        .group_by(Sale.Item_Id)
-        .all()
+    if report["rows_written"]:
+        trigger_warmer()
+    return {
+        "status": "Success" if report["error"] is None else "Ingest stopped",
+        "database": db_name,
+        "table": table,
+        **report
     }
 
-  
-    views_atc_map = {}
-    views_rows = (
-        session.query(
-            Item.Item_Name,
-            group_column.label("category"),
-            func.coalesce(func.sum(ViewsAtc.Items_Viewed), 0).label("total_views"),
-            func.coalesce(func.sum(ViewsAtc.Items_Addedtocart), 0).label("total_atc")
-        )
-        .join(ViewsAtc, ViewsAtc.Item_Id == Item.Item_Id)
-        .filter(Item.Item_Id.in_(item_ids))
-        .group_by(Item.Item_Name, group_column)
-        .all()
-    )
-    for row in views_rows:
-        views_atc_map[(row.Item_Name, row.category)] = {
-            "total_views": row.total_views,
-            "total_atc": row.total_atc
-        }
 
- 
-    size_data_map = {}
-    size_rows = (
-        session.query(
-            Item.Item_Id,
-            Item.Size if hasattr(Item, "Size") else None,
-            cast(Item.Current_Stock, Integer),
-            func.coalesce(func.sum(Sale.Quantity), 0).label("qty_sold"),
-            # avg days between sales
-            func.coalesce(
-                case(
-                    (func.count(Sale.Date) > 1,
-                     (func.datediff(func.max(Sale.Date), func.min(Sale.Date)) /
-                      (func.count(Sale.Date) - 1))
-                    ),
-                    else_=0
-                ), 0
-            ).label("avg_days_between_sales"),
-            func.coalesce(func.datediff(func.current_date(), func.max(Sale.Date)), 0).label("days_since_last_sold")
-        )
-        .outerjoin(Sale, Sale.Item_Id == Item.Item_Id)
-        .filter(Item.Item_Id.in_(item_ids))
-        .group_by(Item.Item_Id, Item.Size if hasattr(Item, "Size") else Item.Item_Id, Item.Current_Stock)
-        .all()
-    )
-    for row in size_rows:
-        item_id = row[0]
-        if item_id not in size_data_map:
-            size_data_map[item_id] = []
-        size_data_map[item_id].append(row[1:])
-
-   
-    variants_map = {}
-    for item in grouped_items:
-        item_name = item.Item_Name
-        product_type = getattr(item, group_column.key) if hasattr(item, group_column.key) else None
-        key = (item_name, product_type)
-        if key not in variants_map:
-            variants_map[key] = []
-        variants_map[key].append(item.Item_Id)
-
-   
-    results = []
-    for item in grouped_items:
-        item_id = item.Item_Id
-        item_name = item.Item_Name
-        item_type = item.Item_Type
-        product_type = getattr(item, group_column.key) if hasattr(item, group_column.key) else None
-        launch_date = item.launch_date
-        total_current_stock = item.current_stock
-        sale_price = item.sale_price
-
-        # Total sold
-        total_quantity_sold = qty_sold_map.get(item_id, 0)
-
-        # Total views & ATC
-        views_data = views_atc_map.get((item_name, product_type), {"total_views":0,"total_atc":0})
-        total_views = views_data["total_views"]
-        total_atc = views_data["total_atc"]
-
-        # Size-level
-        all_variant_ids = variants_map.get((item_name, product_type), [])
-        all_size_data = []
-        for vid in all_variant_ids:
-            all_size_data.extend(size_data_map.get(vid, []))
-        total_variants = len(all_size_data)
-        variants_in_stock = sum(1 for sd in all_size_data if sd[1] > 0)
-
-        # For this item_id, show only its own sizewise_list
-        size_data = size_data_map.get(item_id, [])
-        sizewise_list = [
-            {
-                "size": sd[0],
-                "variant_stock": sd[1],
-                "variant_quantity_sold": sd[2],
-                "average_days_between_sales": round(sd[3] or 0, 2),
-                "days_since_last_sold": sd[4]
-            }
-            for sd in size_data
-        ]
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "status": "Success",
+        "cache": response_cache.stats(),
+        "coalescing": in_flight.stats(),
+        "catalog": catalog_stats()
+    }
+
+
+@app.get("/cache/warmer")
+def cache_warmer():
+    return {
+        "status": "Success",
+        "warmer": warmer_status()
+    }
+
+
+@app.post("/cache/warm")
+def cache_warm(
+    force: bool = Query(False, description="Recompute the warmed results even if the data is unchanged")
+):
+    trigger_warmer(force)
+    return {
+        "status": "Success",
+        "warmer": warmer_status()
+    }
 
-        day_since_launch = (today - launch_date).days if launch_date else None
-       
-        last_sale_days_ago = min([v["days_since_last_sold"] for v in sizewise_list if v["days_since_last_sold"] is not None], default=None)
-        if last_sale_days_ago is not None and total_current_stock == 0:
-            last_sale_date = today - timedelta(days=last_sale_days_ago)
-            days_active = (last_sale_date - launch_date).days if launch_date and last_sale_date else day_since_launch
-        else:
-            days_active = day_since_launch
-        
-        total_stock_percentage_sold = round((total_quantity_sold / (total_quantity_sold + total_current_stock)) * 100, 2) if (total_quantity_sold + total_current_stock) else 0
-        per_day_qty_average = round((total_quantity_sold / days_active), 2) if days_active else 0
-        projected_days_to_sell_out = round((total_current_stock / per_day_qty_average), 2) if per_day_qty_average else 0
-
-        results.append({
-            "item_id": item_id,
-            "item_name": item_name,
-            "item_type": item_type,
-            "product_type": product_type,
-            "day_since_launch": day_since_launch,
-            "current_stock": total_current_stock,
-            "sale_price": sale_price,
-            "total_quantity_sold": total_quantity_sold,
-            "total_views": total_views,
-            "total_atc": total_atc,
-            "total_stock_percentage_sold": total_stock_percentage_sold,
-            "projected_days_to_sell_out": projected_days_to_sell_out,
-            "per_day_qty_average": per_day_qty_average,
-            "size_summary": {
-                "size": f"'{variants_in_stock}/{total_variants}",
-                "sizewise": sizewise_list
-            }
-        })
 
-    return today, results
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/pool/stats")
+def pool_stats():
+    return {
+        "status": "Success",
+        "pools": get_pool_stats(),
+        "replicas": get_replica_status()
+    }
 
 
 @app.get("/products")
 def products(
     db_name: str = Query(..., description="Database name to connect"),
     launch_start_days: int = Query(..., description="Min days since launch"),
-    launch_end_days: int = Query(..., description="Max days since launch")
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    fused: bool = Query(False, description="Compute all aggregates in a single query"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged"),
+    limit: int = Query(None, ge=1, description="Return at most this many products per page"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    fields: str = Query(None, description="Comma-separated fields to return; aggregates only needed by other fields are not queried"),
+    if_none_match: str = Header(None, description="ETag of a previous response; 304 if the data is unchanged"),
+    accept_encoding: str = Header(None, include_in_schema=False)
 ):
     import traceback
+    check_cursor(cursor, decode_products_cursor)
+    selected = check_fields(fields)
+    if limit is not None:
+        fetch, params = fetch_products_page, {"limit": limit, "cursor": cursor, "fields": selected}
+    elif selected is not None:
+        fetch, params = fetch_products, {"fields": selected}
+    else:
+        fetch, params = (fetch_products_fused if fused else fetch_products), {}
     try:
-        with get_session(db_name) as session:
-            today, results = fetch_products(session, db_name, launch_start_days, launch_end_days)
+        with get_read_session(db_name) as session:
+            watermark = get_data_watermark(session, db_name)
+            etag = make_etag(watermark, date.today(), fetch, db_name, launch_start_days, launch_end_days, **params)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+
+            today, results = cached_fetch(
+                session, fetch, db_name, launch_start_days, launch_end_days, use_cache,
+                watermark=watermark, **params
+            )
+            next_cursor = None
+            if limit is not None:
+                results, next_cursor = results
     except Exception as e:
         return {
             "status": "Connection failed",
@@ -397,7 +330,7 @@ def products(
             "traceback": traceback.format_exc()
         }
 
-    return {
+    payload = {
         "status":"Success",
         "database": db_name,
         "launch_start_days": launch_start_days,
@@ -405,18 +338,136 @@ def products(
         "today": str(today),
         "products": results
     }
+    if limit is not None:
+        payload["next_cursor"] = next_cursor
+    return json_response(payload, accept_encoding, {"ETag": etag})
+
+
+def stream_export(db_name: str, launch_start_days: int, launch_end_days: int, use_cache: bool,
+                  iter_chunks, media_type: str, extension: str, fields=None, if_none_match: str = None,
+                  compress: bool = False, accept_encoding: str = None):
+    """
+    Streams a download of the products export, encoded by iter_chunks.
+    Reads from the response cache when possible, otherwise streams rows
+    straight from the database. With fields, the export is built by
+    fetch_products so the aggregates it does not need are skipped.
+    Returns 304 if if_none_match holds the export's current ETag. With
+    compress=True the stream is compressed as negotiated from accept_encoding.
+    """
+    import traceback
+    session = None
+    try:
+        session = get_read_session(db_name)
+        watermark = get_data_watermark(session, db_name)
+        etag = make_etag(watermark, date.today(), fetch_products, db_name, launch_start_days, launch_end_days,
+                         format=extension, fields=fields)
+        if etag_matches(if_none_match, etag):
+            session.close()
+            return not_modified(etag)
+
+        if fields is not None:
+            today, results = cached_fetch(
+                session, fetch_products, db_name, launch_start_days, launch_end_days, use_cache,
+                watermark=watermark, fields=fields
+            )
+            session.close()
+        else:
+            cached = lookup_cached(
+                session, fetch_products, db_name, launch_start_days, launch_end_days, watermark=watermark
+            ) if use_cache else None
+            if cached is not None:
+                session.close()
+                today, results = cached
+            else:
+                today, results = stream_products(session, db_name, launch_start_days, launch_end_days)
+        chunks = iter_chunks(results)
+        first_chunk = next(chunks)
+    except Exception as e:
+        if session is not None:
+            session.close()
+        return {
+            "status": "Connection failed",
+            "database": db_name,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
+
+    def stream():
+        try:
+            yield first_chunk
+            yield from chunks
+        finally:
+            session.close()
+
+    headers = {"Content-Disposition": f"attachment; filename=products_{today}.{extension}", "ETag": etag}
+    body = stream()
+    if compress and COMPRESSION_ENABLED:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is not None:
+            body = compress_chunks(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 
 @app.get("/products/csv")
 def products_csv(
     db_name: str = Query(..., description="Database name to connect"),
     launch_start_days: int = Query(..., description="Min days since launch"),
-    launch_end_days: int = Query(..., description="Max days since launch")
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged"),
+    fields: str = Query(None, description="Comma-separated fields to return; aggregates only needed by other fields are not queried"),
+    if_none_match: str = Header(None, description="ETag of a previous response; 304 if the data is unchanged"),
+    accept_encoding: str = Header(None, include_in_schema=False)
+):
+    selected = check_fields(fields)
+    return stream_export(db_name, launch_start_days, launch_end_days, use_cache,
+                         lambda results: iter_csv_chunks(results, fields=selected), "text/csv", "csv",
+                         fields=selected, if_none_match=if_none_match,
+                         compress=True, accept_encoding=accept_encoding)
+
+
+@app.get("/products/parquet")
+def products_parquet(
+    db_name: str = Query(..., description="Database name to connect"),
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged"),
+    if_none_match: str = Header(None, description="ETag of a previous response; 304 if the data is unchanged")
+):
+    return stream_export(db_name, launch_start_days, launch_end_days, use_cache,
+                         iter_parquet_chunks, "application/vnd.apache.parquet", "parquet", if_none_match=if_none_match)
+
+
+@app.get("/products/arrow")
+def products_arrow(
+    db_name: str = Query(..., description="Database name to connect"),
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged"),
+    if_none_match: str = Header(None, description="ETag of a previous response; 304 if the data is unchanged")
+):
+    return stream_export(db_name, launch_start_days, launch_end_days, use_cache,
+                         iter_arrow_chunks, "application/vnd.apache.arrow.stream", "arrows", if_none_match=if_none_match)
+
+
+# Async endpoints: same responses, served on the asyncio engine (DB_ASYNC_DRIVER)
+# without occupying the threadpool.
+
+@app.get("/async/products/by_name")
+async def products_by_name_async(
+    db_name: str = Query(..., description="Database name to connect"),
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged")
 ):
     import traceback
     try:
-        with get_session(db_name) as session:
-            today, results = fetch_products(session, db_name, launch_start_days, launch_end_days)
+        async with get_async_read_session(db_name) as session:
+            today, results = await cached_fetch_async(
+                session, fetch_products_by_name, fetch_products_by_name_async,
+                db_name, launch_start_days, launch_end_days, use_cache
+            )
     except Exception as e:
         return {
             "status": "Connection failed",
@@ -425,47 +476,92 @@ def products_csv(
             "traceback": traceback.format_exc()
         }
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Header
-    writer.writerow([
-        "item_id","item_name","item_type","product_type",
-        "day_since_launch","current_stock","sale_price",
-        "total_quantity_sold","total_views","total_atc",
-        "total_stock_percentage_sold","projected_days_to_sell_out","per_day_qty_average",
-        "size_summary","size","variant_stock","variant_quantity_sold",
-        "average_days_between_sales","days_since_last_sold"
-    ])
-
-    for row in results:
-        size_summary_text = f"{row['size_summary']['size']}"
-        for variant in row["size_summary"]["sizewise"]:
-            writer.writerow([
-                row["item_id"],
-                row["item_name"],
-                row["item_type"],
-                row["product_type"],
-                row["day_since_launch"],
-                row["current_stock"],
-                row["sale_price"],
-                row["total_quantity_sold"],
-                row["total_views"],
-                row["total_atc"],
-                row["total_stock_percentage_sold"],
-                row["projected_days_to_sell_out"],
-                row["per_day_qty_average"],
-                size_summary_text,
-                variant["size"],
-                variant["variant_stock"],
-                variant["variant_quantity_sold"],
-                variant["average_days_between_sales"],
-                variant["days_since_last_sold"]
-            ])
-
-    output.seek(0)
+    return {
+        "status": "Success",
+        "database": db_name,
+        "launch_start_days": launch_start_days,
+        "launch_end_days": launch_end_days,
+        "today": str(today),
+        "products": results
+    }
+
+
+@app.get("/async/products")
+async def products_async(
+    db_name: str = Query(..., description="Database name to connect"),
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged")
+):
+    import traceback
+    try:
+        async with get_async_read_session(db_name) as session:
+            today, results = await cached_fetch_async(
+                session, fetch_products, fetch_products_async,
+                db_name, launch_start_days, launch_end_days, use_cache
+            )
+    except Exception as e:
+        return {
+            "status": "Connection failed",
+            "database": db_name,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
+
+    return {
+        "status": "Success",
+        "database": db_name,
+        "launch_start_days": launch_start_days,
+        "launch_end_days": launch_end_days,
+        "today": str(today),
+        "products": results
+    }
+
+
+@app.get("/async/products/csv")
+async def products_csv_async(
+    db_name: str = Query(..., description="Database name to connect"),
+    launch_start_days: int = Query(..., description="Min days since launch"),
+    launch_end_days: int = Query(..., description="Max days since launch"),
+    use_cache: bool = Query(True, description="Serve from the response cache while the data is unchanged")
+):
+    import traceback
+    session = None
+    try:
+        session = get_async_read_session(db_name)
+        cached = await lookup_cached_async(session, fetch_products, db_name, launch_start_days, launch_end_days) if use_cache else None
+        if cached is not None:
+            today, products = cached
+
+            async def iter_cached():
+                for product in products:
+                    yield product
+
+            results = iter_cached()
+        else:
+            today, results = await stream_products_async(session, db_name, launch_start_days, launch_end_days)
+        chunks = aiter_csv_chunks(results)
+        first_chunk = await chunks.__anext__()
+    except Exception as e:
+        if session is not None:
+            await session.close()
+        return {
+            "status": "Connection failed",
+            "database": db_name,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
+
+    async def stream():
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await session.close()
+
     return StreamingResponse(
-        output,
+        stream(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=products_{today}.csv"}
-    )
\ No newline at end of file
+    )
@@ -1,18 +1,71 @@
-from . import model_adoreaboo
-from . import model_beelittle
-from . import model_zing
-from . import model_prathiksham
+import importlib
+import os
+import threading
+
+from sqlalchemy import LargeBinary, cast
+
+# Tenant database name -> module declaring its Item, Sale and ViewsAtc models.
+# More brands can be added with TENANT_MODELS="brand=package.module,...".
+TENANT_MODULES = {
+    "adoreaboo": "models.model_adoreaboo",
+    "beelittle": "models.model_beelittle",
+    "zing": "models.model_zing",
+    "prathiksham": "models.model_prathiksham",
+}
+for _entry in os.getenv("TENANT_MODELS", "").split(","):
+    if "=" in _entry:
+        _db_name, _module = _entry.split("=", 1)
+        TENANT_MODULES[_db_name.strip()] = _module.strip()
+
+DB_NAMES = tuple(TENANT_MODULES)
+
+_tenants = {}
+_tenants_lock = threading.Lock()
+
+
+class TenantSchema:
+    """
+    A tenant's models and the schema facts the analytics queries branch on.
+    """
+
+    def __init__(self, db_name: str, module):
+        self.db_name = db_name
+        self.Item = module.Item
+        self.Sale = module.Sale
+        self.ViewsAtc = module.ViewsAtc
+        self.models = (self.Item, self.Sale, self.ViewsAtc)
+
+        self.has_category = hasattr(self.Item, "Category")
+        self.has_size = hasattr(self.Item, "Size")
+        # Products are grouped by Category, or Product_Type where there is none
+        self.group_column = self.Item.Category if self.has_category else self.Item.Product_Type
+        self.size_column = self.Item.Size if self.has_size else None
+        # (Item_Name, group column) compared as bytes, so SQL groups products
+        # exactly like the Python grouping whatever the database collation
+        self.group_keys = (cast(self.Item.Item_Name, LargeBinary), cast(self.group_column, LargeBinary))
+
+
+def get_tenant(db_name: str):
+    """
+    Returns the TenantSchema for db_name, importing its model module on
+    first use.
+    """
+    tenant = _tenants.get(db_name)
+    if tenant is not None:
+        return tenant
+    if db_name not in TENANT_MODULES:
+        raise ValueError(f"No models found for database '{db_name}'")
+
+    with _tenants_lock:
+        tenant = _tenants.get(db_name)
+        if tenant is None:
+            tenant = TenantSchema(db_name, importlib.import_module(TENANT_MODULES[db_name]))
+            _tenants[db_name] = tenant
+    return tenant
+
 
 def get_db_model(db_name: str):
     """
     Returns the Item, Sale, ViewsAtc classes for the given db_name.
     """
-    db_map = {
-        "adoreaboo": (model_adoreaboo.Item, model_adoreaboo.Sale, model_adoreaboo.ViewsAtc),
-        "beelittle": (model_beelittle.Item, model_beelittle.Sale, model_beelittle.ViewsAtc),
-        "zing": (model_zing.Item, model_zing.Sale, model_zing.ViewsAtc),
-        "prathiksham": (model_prathiksham.Item, model_prathiksham.Sale, model_prathiksham.ViewsAtc),
-    }
-    if db_name not in db_map:
-        raise ValueError(f"No models found for database '{db_name}'")
-    return db_map[db_name]
\ No newline at end of file
+    return get_tenant(db_name).models
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, BigInteger, Integer, String, Date, TIMESTAMP, DECIMAL, func
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+# Per-item running totals over sale and viewsatc, kept in every tenant database.
+# Sums use DECIMAL like MySQL's SUM() over the raw tables.
+class ItemRollup(Base):
+    __tablename__ = "item_rollup"
+
+    Item_Id = Column(Integer, primary_key=True, autoincrement=False)
+    Qty_Sold = Column(DECIMAL(32, 0), nullable=True)
+    Sale_Count = Column(Integer, nullable=True)
+    First_Sale = Column(Date, nullable=True)
+    Last_Sale = Column(Date, nullable=True)
+    Views = Column(DECIMAL(32, 0), nullable=True)
+    Atc = Column(DECIMAL(32, 0), nullable=True)
+    View_Count = Column(Integer, nullable=True)
+    Updated_At = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp())
+
+
+# Highest source Updated_At folded into item_rollup, and the source's row
+# count at that refresh, per source table
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    Source = Column(String(32), primary_key=True)
+    Watermark = Column(TIMESTAMP, nullable=True)
+    Row_Count = Column(BigInteger, nullable=True)
+    Refreshed_At = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp())
@@ -0,0 +1,159 @@
+"""
+Keyset pagination for /products and /products/by_name.
+
+/products pages are ordered by Item_Id and /products/by_name pages by
+(item_name, product_type), compared as bytes like the SQL grouping
+(TenantSchema.group_keys) so pages split groups exactly as the results do,
+whatever the column collation. next_cursor is an opaque token holding the
+last key of the page. Only the items of a page's (item_name, product_type)
+groups are aggregated, since group-level views/ATC and size counts need
+every variant of the group.
+"""
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import func, and_, or_
+
+from models import get_tenant
+from analytics import (
+    launch_window,
+    query_window_items,
+    load_item_aggregates,
+    load_trailing_totals,
+    build_product_results,
+    build_grouped_results,
+    required_queries,
+    select_fields,
+)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Returns the key stored in cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def decode_products_cursor(cursor: str):
+    """
+    Returns the Item_Id after which a /products page starts.
+    """
+    key = decode_cursor(cursor)
+    after_id = key.get("id") if isinstance(key, dict) else None
+    if not isinstance(after_id, int) or isinstance(after_id, bool):
+        raise ValueError("Invalid cursor")
+    return after_id
+
+
+def decode_by_name_cursor(cursor: str):
+    """
+    Returns the (item_name, product_type) after which a /products/by_name
+    page starts.
+    """
+    key = decode_cursor(cursor)
+    after_key = key.get("key") if isinstance(key, dict) else None
+    if (not isinstance(after_key, list) or len(after_key) != 2
+            or not all(part is None or isinstance(part, str) for part in after_key)):
+        raise ValueError("Invalid cursor")
+    # NULL names / product types are keyed as empty strings
+    return tuple(part or "" for part in after_key)
+
+
+def _group_key(name, product_type):
+    # NULL names / product types are keyed as empty strings. Strings compare
+    # by code point, the order of their UTF-8 bytes.
+    return name or "", product_type or ""
+
+
+def _group_items(session, db_name: str, today: date, launch_start_days: int, launch_end_days: int,
+                 keys, with_size: bool = False):
+    """
+    Returns every window item whose (item_name, product_type) is in keys.
+    """
+    group_column = get_tenant(db_name).group_column
+
+    wanted = {_group_key(name, product_type) for name, product_type in keys}
+    names = {name or None for name, _ in keys}
+    if None in names:
+        names.add("")
+    items = query_window_items(session, db_name, today, launch_start_days, launch_end_days,
+                               with_size=with_size, item_names=list(names))
+    return [item for item in items if _group_key(item.Item_Name, getattr(item, group_column.key)) in wanted]
+
+
+def fetch_products_page(session, db_name: str, launch_start_days: int, launch_end_days: int,
+                        limit: int, cursor: str = None, fields=None):
+    """
+    One page of fetch_products, ordered by Item_Id.
+    Returns (today, (results, next_cursor)).
+    """
+    today = date.today()
+    group_column = get_tenant(db_name).group_column
+
+    after_id = decode_products_cursor(cursor) if cursor else None
+    page_items = query_window_items(session, db_name, today, launch_start_days, launch_end_days,
+                                    after_id=after_id, limit=limit + 1)
+    has_more = len(page_items) > limit
+    page_items = page_items[:limit]
+
+    keys = {(item.Item_Name, getattr(item, group_column.key)) for item in page_items}
+    group_items = _group_items(session, db_name, today, launch_start_days, launch_end_days, keys)
+
+    item_ids = [item.Item_Id for item in group_items]
+    queries = required_queries(fields)
+    qty_sold_map, views_atc_map, size_data_map = load_item_aggregates(session, db_name, item_ids, queries)
+    trailing_map = load_trailing_totals(session, db_name, item_ids, today, queries)
+
+    results = build_product_results(today, group_items, group_column, qty_sold_map, views_atc_map, size_data_map,
+                                    trailing_map, page_items=page_items)
+    next_cursor = encode_cursor({"id": page_items[-1].Item_Id}) if has_more else None
+    return today, (select_fields(results, fields), next_cursor)
+
+
+def fetch_products_by_name_page(session, db_name: str, launch_start_days: int, launch_end_days: int,
+                                limit: int, cursor: str = None, fields=None):
+    """
+    One page of fetch_products_by_name, ordered by (item_name, product_type).
+    Returns (today, (results, next_cursor)).
+    """
+    today = date.today()
+    tenant = get_tenant(db_name)
+    Item, group_column = tenant.Item, tenant.group_column
+    launch_from, launch_to = launch_window(today, launch_start_days, launch_end_days)
+
+    # The UTF-8 bytes of the names / product types, NULL as empty
+    name_key, type_key = (func.coalesce(key, b"") for key in tenant.group_keys)
+    query = (
+        session.query(name_key.label("name_key"), type_key.label("type_key"))
+        .filter(Item.launch_date.between(launch_from, launch_to))
+    )
+    if cursor:
+        after_name, after_type = (part.encode() for part in decode_by_name_cursor(cursor))
+        query = query.filter(or_(name_key > after_name, and_(name_key == after_name, type_key > after_type)))
+    page_keys = query.group_by(name_key, type_key).order_by(name_key, type_key).limit(limit + 1).all()
+    has_more = len(page_keys) > limit
+    keys = [(bytes(name).decode(), bytes(product_type).decode()) for name, product_type in page_keys[:limit]]
+
+    items_query = _group_items(session, db_name, today, launch_start_days, launch_end_days, keys, with_size=True)
+
+    all_item_ids = [item.Item_Id for item in items_query]
+    queries = required_queries(fields)
+    qty_sold_map, views_atc_map, size_data_map = load_item_aggregates(session, db_name, all_item_ids, queries)
+    trailing_map = load_trailing_totals(session, db_name, all_item_ids, today, queries)
+
+    results = build_grouped_results(today, items_query, group_column, qty_sold_map, views_atc_map, size_data_map,
+                                    trailing_map)
+    # A NULL and an empty name / product type share a key; the NULL comes first
+    results.sort(key=lambda r: (*_group_key(r["item_name"], r["product_type"]),
+                                r["item_name"] is not None, r["product_type"] is not None))
+    next_cursor = encode_cursor({"key": list(keys[-1])}) if has_more else None
+    return today, (select_fields(results, fields), next_cursor)
@@ -0,0 +1,359 @@
+"""
+Per-item rollup of sale and viewsatc, refreshed incrementally from Updated_At.
+
+Each refresh re-reads the rows updated from ROLLUP_LOOKBACK_SECONDS before
+the last watermark on, since a transaction can commit rows stamped before a
+refresh read the watermark. Recomputing an item is idempotent, so the
+overlap only costs time. Deleted rows, or rows committed later than the
+lookback, leave the source's row count different from the rows folded into
+item_rollup, which triggers a full rebuild of that source.
+
+Usage:
+    python rollup.py                 # refresh every tenant
+    python rollup.py zing beelittle  # refresh the given tenants
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from sqlalchemy import func, cast, Integer, case, select, inspect, text, update
+
+from db import get_engine, get_session, upsert_rows
+from models import DB_NAMES, get_db_model, get_tenant
+from models.model_rollup import Base as RollupBase, ItemRollup, RollupState
+
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLUP_TABLE_CHECK_INTERVAL = int(os.getenv("ROLLUP_TABLE_CHECK_INTERVAL", "60"))
+ROLLUP_LOOKBACK_SECONDS = int(os.getenv("ROLLUP_LOOKBACK_SECONDS", "300"))
+
+SALE_COLUMNS = ["Qty_Sold", "Sale_Count", "First_Sale", "Last_Sale"]
+VIEWS_COLUMNS = ["Views", "Atc", "View_Count"]
+# The item_rollup column counting each source's rows
+COUNT_COLUMNS = {"sale": ItemRollup.Sale_Count, "viewsatc": ItemRollup.View_Count}
+
+_table_checks = {}
+# db_name -> ((sale, viewsatc) watermark, fresh, checked at) of the last check
+_freshness = {}
+_data_watermark = ContextVar("rollup_data_watermark", default=None)
+
+
+def _source_totals(session, Model, since, aggregates):
+    """
+    Recomputes aggregates for every Item_Id with a row updated at or after
+    since (all items when since is None).
+    """
+    query = select(Model.Item_Id, *aggregates)
+    if since is not None:
+        touched = select(Model.Item_Id).where(Model.Updated_At >= since)
+        query = query.where(Model.Item_Id.in_(touched))
+    return session.execute(query.group_by(Model.Item_Id)).all()
+
+
+def _fold_totals(session, Model, since, aggregates, columns):
+    """
+    Upserts the recomputed totals into item_rollup. Returns (items
+    refreshed, whether some Item_Ids were skipped as not integers).
+    """
+    rows = []
+    skipped = False
+    for row in _source_totals(session, Model, since, aggregates):
+        try:
+            item_id = int(row[0])
+        except (TypeError, ValueError):
+            skipped = True
+            continue
+        rows.append(dict(zip(["Item_Id"] + columns, [item_id] + list(row[1:]))))
+    upsert_rows(session, ItemRollup.__table__, rows, columns)
+    return len(rows), skipped
+
+
+def _folded_rows(session, source):
+    return session.scalar(select(func.coalesce(func.sum(COUNT_COLUMNS[source]), 0)))
+
+
+def _refresh_source(session, source, Model, aggregates, columns):
+    state = session.get(RollupState, source)
+    latest, row_count = session.execute(select(func.max(Model.Updated_At), func.count()).select_from(Model)).one()
+    incremental = state is not None and state.Watermark is not None and state.Row_Count is not None
+    if incremental and row_count == state.Row_Count and (latest is None or latest <= state.Watermark):
+        return 0
+
+    full = not incremental
+    if incremental:
+        # Source rows left out of item_rollup at the last refresh (unusable Item_Ids)
+        unfolded = state.Row_Count - _folded_rows(session, source)
+        since = state.Watermark - timedelta(seconds=ROLLUP_LOOKBACK_SECONDS)
+        refreshed, skipped = _fold_totals(session, Model, since, aggregates, columns)
+        full = skipped or row_count - _folded_rows(session, source) != unfolded
+    if full:
+        session.execute(update(ItemRollup).values(dict.fromkeys(columns)))
+        refreshed, _ = _fold_totals(session, Model, None, aggregates, columns)
+
+    upsert_rows(session, RollupState.__table__, [{"Source": source, "Watermark": latest, "Row_Count": row_count}],
+                ["Watermark", "Row_Count"])
+    session.commit()
+    return refreshed
+
+
+def create_rollup_tables(engine):
+    """
+    Creates the rollup tables, adding the columns of later versions to
+    existing ones.
+    """
+    RollupBase.metadata.create_all(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns(RollupState.__tablename__)}
+    if "Row_Count" not in columns:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {RollupState.__tablename__} ADD COLUMN Row_Count BIGINT NULL"))
+
+
+def refresh_rollup(db_name: str):
+    """
+    Brings item_rollup up to date for db_name. Only items with sale or
+    viewsatc rows updated since the last refresh (less the lookback) are
+    recomputed, unless a source's row count shows rows were deleted or
+    missed. Returns the number of items refreshed per source.
+    """
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+    create_rollup_tables(get_engine(db_name))
+    _table_checks[db_name] = (True, time.monotonic())
+    _freshness.pop(db_name, None)
+
+    with get_session(db_name) as session:
+        sale_count = _refresh_source(session, "sale", Sale, [
+            func.sum(Sale.Quantity),
+            func.count(Sale.Date),
+            func.min(Sale.Date),
+            func.max(Sale.Date),
+        ], SALE_COLUMNS)
+        views_count = _refresh_source(session, "viewsatc", ViewsAtc, [
+            func.sum(ViewsAtc.Items_Viewed),
+            func.sum(ViewsAtc.Items_Addedtocart),
+            func.count(ViewsAtc.Date),
+        ], VIEWS_COLUMNS)
+
+    _freshness.pop(db_name, None)
+    return {"sale": sale_count, "viewsatc": views_count}
+
+
+def _rollup_tables_exist(session, db_name: str):
+    exists, checked_at = _table_checks.get(db_name, (False, None))
+    if exists or (checked_at is not None and time.monotonic() - checked_at < ROLLUP_TABLE_CHECK_INTERVAL):
+        return exists
+    # Tables of an older version count as missing until refresh_rollup upgrades them
+    db_inspector = inspect(session.get_bind())
+    exists = db_inspector.has_table(RollupState.__tablename__) and "Row_Count" in {
+        column["name"] for column in db_inspector.get_columns(RollupState.__tablename__)
+    }
+    _table_checks[db_name] = (exists, time.monotonic())
+    return exists
+
+
+@contextmanager
+def data_watermark(watermark):
+    """
+    Makes watermark, the (items, sale, viewsatc) MAX(Updated_At) the
+    enclosed computation was keyed on, the one rollup_is_fresh checks the
+    rollup against. Its result is then cached per watermark.
+    """
+    token = _data_watermark.set(watermark)
+    try:
+        yield
+    finally:
+        _data_watermark.reset(token)
+
+
+def _source_watermarks(session, db_name: str):
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+    return tuple(session.execute(
+        select(
+            select(func.max(Sale.Updated_At)).scalar_subquery(),
+            select(func.max(ViewsAtc.Updated_At)).scalar_subquery(),
+        )
+    ).one())
+
+
+def _source_counts(db_name: str):
+    Item, Sale, ViewsAtc = get_db_model(db_name)
+    return {
+        "sale": select(func.count()).select_from(Sale).scalar_subquery(),
+        "viewsatc": select(func.count()).select_from(ViewsAtc).scalar_subquery(),
+    }
+
+
+def rollup_is_fresh(session, db_name: str):
+    """
+    True if item_rollup has folded in every sale and viewsatc update: those
+    of the data_watermark in effect, else the latest, and the sources still
+    have the row counts of the last refresh (no rows deleted since). A
+    rollup found fresh for a watermark stays fresh for it; a stale one is
+    checked again after ROLLUP_TABLE_CHECK_INTERVAL or once refresh_rollup
+    has run.
+    """
+    if not ROLLUP_ENABLED or not _rollup_tables_exist(session, db_name):
+        return False
+
+    watermark = _data_watermark.get()
+    sources = None if watermark is None else tuple(watermark[1:])
+    if sources is not None:
+        cached = _freshness.get(db_name)
+        if cached is not None and cached[0] == sources and (
+                cached[1] or time.monotonic() - cached[2] < ROLLUP_TABLE_CHECK_INTERVAL):
+            return cached[1]
+
+    # COUNT(*) of both sources: a scan of each table's smallest index
+    counts = _source_counts(db_name)
+    rows = session.execute(
+        select(RollupState.Source, RollupState.Watermark, RollupState.Row_Count, *counts.values())
+    ).all()
+    states = {row[0]: (row[1], row[2], dict(zip(counts, row[3:]))[row[0]]) for row in rows}
+    latest_sale, latest_views = sources or _source_watermarks(session, db_name)
+    fresh = True
+    for source, latest in (("sale", latest_sale), ("viewsatc", latest_views)):
+        if source not in states:
+            fresh = False
+            continue
+        folded, row_count, current_count = states[source]
+        if latest is not None and (folded is None or folded < latest):
+            fresh = False
+        elif row_count != current_count:
+            fresh = False
+    if sources is not None:
+        _freshness[db_name] = (sources, fresh, time.monotonic())
+    return fresh
+
+
+def refresh_stale_rollup(db_name: str):
+    """
+    Refreshes db_name's rollup if its tables exist (a first refresh_rollup
+    creates them) and it is behind sale or viewsatc. Returns the
+    refresh_rollup counts, or None if nothing was refreshed.
+    """
+    if not ROLLUP_ENABLED:
+        return None
+    with get_session(db_name) as session:
+        if not _rollup_tables_exist(session, db_name):
+            return None
+        with data_watermark((None, *_source_watermarks(session, db_name))):
+            if rollup_is_fresh(session, db_name):
+                return None
+    return refresh_rollup(db_name)
+
+
+def query_rollup_aggregates(session, db_name: str, item_ids, queries=None):
+    """
+    Rollup-backed equivalent of analytics.query_item_aggregates. Only the maps
+    named in queries ("qty_sold", "views_atc", "size_data") are queried, the
+    others are returned empty; None queries all three.
+    """
+    tenant = get_tenant(db_name)
+    Item, Sale, ViewsAtc = tenant.models
+
+    group_column = tenant.group_column
+
+    qty_sold_map = {}
+    if queries is None or "qty_sold" in queries:
+        qty_sold_map = {
+            row.Item_Id: row.total_qty
+            for row in session.query(
+                ItemRollup.Item_Id,
+                func.coalesce(ItemRollup.Qty_Sold, 0).label("total_qty")
+            )
+            .filter(ItemRollup.Item_Id.in_(item_ids), ItemRollup.Sale_Count > 0)
+            .all()
+        }
+
+    views_atc_map = {}
+    if queries is None or "views_atc" in queries:
+        views_rows = (
+            session.query(
+                Item.Item_Name,
+                group_column.label("category"),
+                func.coalesce(func.sum(ItemRollup.Views), 0).label("total_views"),
+                func.coalesce(func.sum(ItemRollup.Atc), 0).label("total_atc")
+            )
+            .join(ItemRollup, ItemRollup.Item_Id == Item.Item_Id)
+            .filter(Item.Item_Id.in_(item_ids), ItemRollup.View_Count > 0)
+            .group_by(Item.Item_Name, group_column, *tenant.group_keys)
+            .all()
+        )
+        for row in views_rows:
+            views_atc_map[(row.Item_Name, row.category)] = {
+                "total_views": row.total_views,
+                "total_atc": row.total_atc
+            }
+
+    size_data_map = {}
+    if queries is None or "size_data" in queries:
+        size_rows = (
+            session.query(
+                Item.Item_Id,
+                tenant.size_column,
+                cast(Item.Current_Stock, Integer),
+                func.coalesce(ItemRollup.Qty_Sold, 0).label("qty_sold"),
+                func.coalesce(
+                    case(
+                        (ItemRollup.Sale_Count > 1,
+                         (func.datediff(ItemRollup.Last_Sale, ItemRollup.First_Sale) /
+                          (ItemRollup.Sale_Count - 1))
+                        ),
+                        else_=0
+                    ), 0
+                ).label("avg_days_between_sales"),
+                func.coalesce(func.datediff(func.current_date(), ItemRollup.Last_Sale), 0).label("days_since_last_sold")
+            )
+            .outerjoin(ItemRollup, ItemRollup.Item_Id == Item.Item_Id)
+            .filter(Item.Item_Id.in_(item_ids))
+            .all()
+        )
+        for row in size_rows:
+            size_data_map.setdefault(row[0], []).append(row[1:])
+
+    return qty_sold_map, views_atc_map, size_data_map
+
+
+def rollup_totals_ctes(item_ids):
+    """
+    Returns (sale_totals, views_totals) CTEs over item_rollup for the items
+    selected by item_ids, with the columns of the raw sale / viewsatc totals
+    in analytics.grouped_products_query.
+    """
+    sale_totals = (
+        select(
+            ItemRollup.Item_Id,
+            ItemRollup.Qty_Sold.label("qty_sold"),
+            ItemRollup.Sale_Count.label("sale_count"),
+            ItemRollup.First_Sale.label("first_sale"),
+            ItemRollup.Last_Sale.label("last_sale"),
+        )
+        .where(ItemRollup.Item_Id.in_(item_ids), ItemRollup.Sale_Count > 0)
+        .cte("sale_totals")
+    )
+    views_totals = (
+        select(
+            ItemRollup.Item_Id,
+            ItemRollup.Views.label("views"),
+            ItemRollup.Atc.label("atc"),
+        )
+        .where(ItemRollup.Item_Id.in_(item_ids), ItemRollup.View_Count > 0)
+        .cte("views_totals")
+    )
+    return sale_totals, views_totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the per-item rollup tables")
+    parser.add_argument("db_names", nargs="*", default=list(DB_NAMES))
+    args = parser.parse_args()
+
+    for db_name in args.db_names:
+        try:
+            start = time.perf_counter()
+            counts = refresh_rollup(db_name)
+            elapsed = time.perf_counter() - start
+            print(f"{db_name}: refreshed {counts['sale']} sale / {counts['viewsatc']} viewsatc items in {elapsed:.2f}s")
+        except Exception as e:
+            print(f"Failed on {db_name}: {e}")
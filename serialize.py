@@ -0,0 +1,129 @@
+"""
+JSON encoding and negotiated compression for the large product responses.
+
+With FAST_JSON=true the result structures are serialized directly with
+orjson, skipping FastAPI's jsonable_encoder pass. Responses are compressed
+with brotli or gzip when the client accepts it.
+"""
+import json
+import os
+import zlib
+from decimal import Decimal
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from instrumentation import stage
+
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+def _default(value):
+    # Same conversions as jsonable_encoder
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_default(payload):
+    """
+    Encodes payload the way FastAPI does for a returned dict.
+    """
+    return json.dumps(
+        jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps_fast(payload):
+    """
+    Encodes payload with orjson. Decimal values are converted as by
+    jsonable_encoder; dates and datetimes are ISO formatted.
+    """
+    import orjson
+
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps(payload, fast: bool = None):
+    return dumps_fast(payload) if (FAST_JSON if fast is None else fast) else dumps_default(payload)
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    Picks "br" or "gzip" from an Accept-Encoding header, or None.
+    brotli is only offered if the brotli package is installed.
+    """
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = ["br", "gzip"] if _brotli() is not None else ["gzip"]
+    for encoding in candidates:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str):
+    if encoding == "br":
+        return _brotli().compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    return body
+
+
+def compress_chunks(chunks, encoding: str):
+    """
+    Compresses a stream of str or bytes chunks incrementally.
+    """
+    if encoding == "br":
+        compressor = _brotli().Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def json_response(payload, accept_encoding: str = None, headers: dict = None):
+    """
+    Returns payload as a JSON Response, encoded per FAST_JSON and compressed
+    if the client accepts it and the body is at least COMPRESSION_MIN_BYTES.
+    """
+    with stage("serialize"):
+        body = dumps(payload)
+    headers = dict(headers or {})
+    if COMPRESSION_ENABLED:
+        headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is not None and len(body) >= COMPRESSION_MIN_BYTES:
+        with stage("compress"):
+            body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
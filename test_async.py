@@ -0,0 +1,14 @@
+import pytest
+
+from models import DB_NAMES
+
+
+@pytest.mark.parametrize("db_name", DB_NAMES)
+@pytest.mark.parametrize("path", ["/products", "/products/by_name"])
+def test_async_endpoints_match_sync(client, db_name, path):
+    params = {"db_name": db_name, "launch_start_days": 0, "launch_end_days": 365, "use_cache": False}
+    expected = client.get(path, params=params).json()
+    actual = client.get(f"/async{path}", params=params).json()
+
+    assert "products" in actual, actual
+    assert actual["products"] == expected["products"]
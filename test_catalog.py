@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, select, update
+
+import catalog
+from analytics import query_window_items
+from catalog import CatalogSnapshot, get_catalog
+from db import get_session
+from models import get_tenant
+
+
+def test_window_matches_items_query(monkeypatch, databases):
+    today = date.today()
+    with get_session("zing") as session:
+        snapshot = CatalogSnapshot("zing")
+        snapshot.load(session)
+        for launch_start_days, launch_end_days in [(0, 365), (10, 30), (0, 0), (500, 600)]:
+            monkeypatch.setattr(catalog, "CATALOG_ENABLED", False)
+            expected = query_window_items(session, "zing", today, launch_start_days, launch_end_days, with_size=True)
+            monkeypatch.setattr(catalog, "CATALOG_ENABLED", True)
+            launch_to = date.fromordinal(today.toordinal() - launch_start_days)
+            launch_from = date.fromordinal(today.toordinal() - launch_end_days)
+            assert [tuple(row) for row in snapshot.window(launch_from, launch_to)] == [tuple(row) for row in expected]
+
+
+def test_items_without_updated_at_force_a_full_reload(databases):
+    Item = get_tenant("prathiksham").Item
+    table = Item.__table__
+    item_id_column = table.c[Item.Item_Id.key]
+    with get_session("prathiksham") as session:
+        snapshot = CatalogSnapshot("prathiksham")
+        snapshot.load(session)
+        session.execute(
+            update(table).where(item_id_column == 3)
+            .values({Item.Current_Stock.key: 777, Item.Updated_At.key: None})
+        )
+        session.commit()
+        try:
+            snapshot.refresh(session)
+            assert snapshot._rows_by_id([3])[3].current_stock == 777
+        finally:
+            session.execute(update(table).where(item_id_column == 3).values({Item.Updated_At.key: func.current_timestamp()}))
+            session.commit()
+
+
+def test_refresh_picks_up_updates_committed_behind_the_watermark(databases):
+    Item = get_tenant("prathiksham").Item
+    table = Item.__table__
+    item_id_column = table.c[Item.Item_Id.key]
+    with get_session("prathiksham") as session:
+        snapshot = CatalogSnapshot("prathiksham")
+        snapshot.load(session)
+        stock = snapshot._rows_by_id([4])[4].current_stock
+        # Stamped before the snapshot's watermark, as by a transaction that
+        # committed after the load read the table
+        session.execute(
+            update(table).where(item_id_column == 4)
+            .values({Item.Current_Stock.key: 778, Item.Updated_At.key: snapshot.watermark - timedelta(seconds=30)})
+        )
+        session.commit()
+        try:
+            snapshot.refresh(session)
+            assert snapshot._rows_by_id([4])[4].current_stock == 778
+        finally:
+            session.execute(
+                update(table).where(item_id_column == 4)
+                .values({Item.Current_Stock.key: stock, Item.Updated_At.key: func.current_timestamp()})
+            )
+            session.commit()
+
+
+def test_concurrent_stale_callers_share_one_refresh(databases):
+    snapshot = CatalogSnapshot("beelittle")
+    loads = []
+    load = snapshot.load
+
+    def slow_load(session):
+        loads.append(1)
+        time.sleep(0.1)
+        load(session)
+
+    snapshot.load = slow_load
+
+    def refresh():
+        with get_session("beelittle") as session:
+            snapshot.refresh_if(session, lambda: snapshot.checked_at is None)
+
+    threads = [threading.Thread(target=refresh) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert len(snapshot) > 0
+
+
+def test_first_load_does_not_block_other_tenants(monkeypatch, databases):
+    monkeypatch.setattr(catalog, "_snapshots", {"zing": CatalogSnapshot("zing")})
+    with catalog._snapshots["zing"].update_lock:
+        done = threading.Event()
+
+        def load_other():
+            with get_session("adoreaboo") as session:
+                get_catalog(session, "adoreaboo")
+            done.set()
+
+        threading.Thread(target=load_other).start()
+        assert done.wait(5)
+
+
+def test_concurrent_async_refreshes_do_not_block_the_loop(databases):
+    from analytics import fetch_products
+    from analytics_async import fetch_products_async
+    from cache import cached_fetch_async
+    from db import dispose_async_engines, get_async_read_session
+
+    Item = get_tenant("zing").Item
+    table = Item.__table__
+    with get_session("zing") as session:
+        get_catalog(session, "zing")
+        newest = session.execute(select(func.max(Item.Updated_At))).scalar()
+        session.execute(
+            update(table).where(table.c[Item.Item_Id.key] == 5)
+            .values({Item.Current_Stock.key: 555, Item.Updated_At.key: newest + timedelta(seconds=1)})
+        )
+        session.commit()
+
+    async def fetch(launch_end_days):
+        async with get_async_read_session("zing") as session:
+            return await cached_fetch_async(session, fetch_products, fetch_products_async, "zing", 0, launch_end_days,
+                                            use_cache=False)
+
+    async def main():
+        try:
+            return await asyncio.gather(*(fetch(days) for days in range(400, 410)))
+        finally:
+            await dispose_async_engines()
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(asyncio.run(main())), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "the event loop is blocked"
+    assert len(results[0]) == 10
+    assert catalog._snapshots["zing"]._rows_by_id([5])[5].current_stock == 555
+
+
+def test_event_loop_reads_items_while_a_refresh_holds_the_lock(monkeypatch, databases):
+    snapshot = CatalogSnapshot("zing")
+    monkeypatch.setattr(catalog, "_snapshots", {"zing": snapshot})
+
+    async def on_loop():
+        with get_session("zing") as session:
+            return get_catalog(session, "zing")
+
+    with snapshot.update_lock:
+        assert asyncio.run(on_loop()) is None
+    assert asyncio.run(on_loop()) is snapshot
@@ -0,0 +1,46 @@
+import gzip
+
+import pytest
+
+from serialize import compress, compress_chunks, negotiate_encoding
+
+PARAMS = {"db_name": "prathiksham", "launch_start_days": 0, "launch_end_days": 365}
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("deflate, gzip;q=0.5") == "gzip"
+    assert negotiate_encoding("*") in ("br", "gzip")
+
+
+def test_compress_round_trips():
+    body = b'{"products":[]}' * 200
+    assert gzip.decompress(compress(body, "gzip")) == body
+    assert gzip.decompress(b"".join(compress_chunks([body[:100].decode(), body[100:]], "gzip"))) == body
+
+
+@pytest.mark.parametrize("path", ["/products", "/products/csv"])
+def test_encodings_share_a_weak_etag(client, path):
+    plain = client.get(path, params=PARAMS, headers={"Accept-Encoding": "identity"})
+    gzipped = client.get(path, params=PARAMS, headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert plain.headers["Vary"] == gzipped.headers["Vary"] == "Accept-Encoding"
+    assert gzipped.content == plain.content
+
+    etag = gzipped.headers["ETag"]
+    assert etag.startswith('W/"') and plain.headers["ETag"] == etag
+
+    revalidated = client.get(path, params=PARAMS, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["Vary"] == "Accept-Encoding"
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = client.get("/products", params=dict(PARAMS, launch_start_days=5000, launch_end_days=5001),
+                          headers={"Accept-Encoding": "gzip"})
+    assert response.json()["products"] == []
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from cache import etag_matches
+from db import get_session
+from models import get_tenant
+
+PARAMS = {"db_name": "beelittle", "launch_start_days": 0, "launch_end_days": 365}
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+
+
+@pytest.mark.parametrize("path", ["/products", "/products/by_name", "/products/csv", "/products/parquet"])
+def test_unchanged_data_is_not_modified(client, path):
+    response = client.get(path, params=PARAMS)
+    etag = response.headers["ETag"]
+
+    cached = client.get(path, params=PARAMS, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert cached.content == b""
+
+    other = client.get(path, params=dict(PARAMS, launch_end_days=100), headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["ETag"] != etag
+
+
+def test_data_change_invalidates_etag(client):
+    etag = client.get("/products", params=PARAMS).headers["ETag"]
+
+    Sale = get_tenant(PARAMS["db_name"]).Sale
+    with get_session(PARAMS["db_name"]) as session:
+        row = session.query(Sale).first()
+        session.execute(
+            update(Sale.__table__)
+            .where(Sale.__table__.c[Sale.Item_Id.key] == row.Item_Id, Sale.__table__.c[Sale.Date.key] == row.Date)
+            .values({Sale.Updated_At.key: datetime.now() + timedelta(days=1)})
+        )
+        session.commit()
+
+    response = client.get("/products", params=PARAMS, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
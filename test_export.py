@@ -0,0 +1,100 @@
+import csv
+import io
+
+import pytest
+
+import analytics
+import analytics_async
+from analytics import fetch_products
+from db import get_session
+from export import EXPORT_COLUMNS, EXPORT_TYPES, iter_csv_chunks
+from kpis import TRAILING_FIELDS
+
+
+def fetch_products_csv(db_name, params):
+    with get_session(db_name) as session:
+        _, results = fetch_products(session, db_name, params["launch_start_days"], params["launch_end_days"])
+    return "".join(iter_csv_chunks(results))
+
+
+def csv_rows(text):
+    header, *rows = text.splitlines()
+    return header, sorted(rows)
+
+
+@pytest.mark.parametrize("prefix", ["", "/async"])
+@pytest.mark.parametrize("batch_size", [1000, 2])
+def test_streamed_csv_matches_fetch_products(monkeypatch, client, name_variants, prefix, batch_size):
+    # Batches are cut between groups; a group split or repeated would change its totals
+    monkeypatch.setattr(analytics, "STREAM_BATCH_SIZE", batch_size)
+    monkeypatch.setattr(analytics_async, "STREAM_BATCH_SIZE", batch_size)
+    params = {"db_name": name_variants, "launch_start_days": 0, "launch_end_days": 365}
+
+    streamed = client.get(f"{prefix}/products/csv", params=dict(params, use_cache=False))
+    assert streamed.status_code == 200
+    assert csv_rows(streamed.text) == csv_rows(fetch_products_csv(name_variants, params))
+
+
+def test_trailing_columns_come_last(client):
+    assert EXPORT_COLUMNS[-len(TRAILING_FIELDS):] == TRAILING_FIELDS
+    fields = ["size_summary", "qty_sold_7d", "current_stock"]
+    response = client.get("/products/csv", params={
+        "db_name": "zing", "launch_start_days": 0, "launch_end_days": 365, "fields": ",".join(fields)
+    })
+    header, *rows = csv.reader(io.StringIO(response.text))
+    assert header == [column for column in EXPORT_COLUMNS if column in header]
+    assert header.index("qty_sold_7d") == len(header) - 1
+    with get_session("zing") as session:
+        _, results = fetch_products(session, "zing", 0, 365)
+    expected = {
+        (str(product["item_id"]), str(variant["size"])): (str(product["current_stock"]), str(product["qty_sold_7d"]))
+        for product in results for variant in product["size_summary"]["sizewise"]
+    }
+    values = {(row[0], row[header.index("size")]): (row[header.index("current_stock")], row[-1]) for row in rows}
+    assert values == expected
+
+
+def read_arrow_export(path, content):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path == "/products/parquet":
+        return pq.read_table(pa.BufferReader(content))
+    return pa.ipc.open_stream(content).read_all()
+
+
+def typed_csv_value(column, value):
+    # The CSV export writes None as an empty field and Decimals with their scale
+    if value == "":
+        return None
+    arrow_type = EXPORT_TYPES[column][0]
+    if arrow_type.startswith("int"):
+        return int(value)
+    if arrow_type == "float64":
+        return float(value)
+    return value
+
+
+@pytest.mark.parametrize("path", ["/products/parquet", "/products/arrow"])
+def test_arrow_exports_read_back_like_the_csv(client, path):
+    import pyarrow as pa
+
+    params = {"db_name": "zing", "launch_start_days": 0, "launch_end_days": 365}
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    table = read_arrow_export(path, response.content)
+
+    assert table.column_names == EXPORT_COLUMNS
+    assert table.schema.field("total_quantity_sold").type == pa.int64()
+    assert table.schema.field("day_since_launch").type == pa.int32()
+    assert table.schema.field("per_day_qty_average").type == pa.float64()
+    assert table.schema.field("item_name").type == pa.string()
+    for column in EXPORT_COLUMNS:
+        assert table.schema.field(column).type == pa.type_for_alias(EXPORT_TYPES[column][0])
+
+    header, *csv_rows = csv.reader(io.StringIO(client.get("/products/csv", params=params).text))
+    assert header == EXPORT_COLUMNS
+    expected = [[typed_csv_value(column, value) for column, value in zip(header, row)] for row in csv_rows]
+    rows = [list(row.values()) for row in table.to_pylist()]
+    assert len(rows) > 0
+    assert sorted(rows, key=repr) == sorted(expected, key=repr)
@@ -0,0 +1,34 @@
+import pytest
+
+from analytics import ALL_QUERIES, parse_fields, required_queries
+
+PARAMS = {"db_name": "zing", "launch_start_days": 0, "launch_end_days": 365}
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields(" total_views,item_id,,total_views ") == ("item_id", "total_views")
+    assert parse_fields("") == ()
+    with pytest.raises(ValueError, match="Unknown fields: bogus, nope"):
+        parse_fields("total_views,nope,bogus")
+
+
+def test_required_queries():
+    assert required_queries(None) == ALL_QUERIES
+    assert required_queries(("item_name", "current_stock")) == frozenset()
+    assert required_queries(("total_atc", "per_day_qty_average")) == {"views_atc", "qty_sold", "size_data"}
+
+
+@pytest.mark.parametrize("path", ["/products", "/products/by_name"])
+def test_selected_fields_match_full_result(client, path):
+    full = client.get(path, params=PARAMS).json()["products"]
+    selected = client.get(path, params=dict(PARAMS, fields="total_views,per_day_qty_average")).json()["products"]
+
+    keep = {"item_id", "item_name", "product_type", "total_views", "per_day_qty_average"}
+    assert selected == [{key: value for key, value in row.items() if key in keep} for row in full]
+
+
+def test_unknown_field_is_rejected(client):
+    response = client.get("/products", params=dict(PARAMS, fields="total_views,bogus"))
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown fields: bogus"}
@@ -0,0 +1,17 @@
+import pytest
+
+from analytics import fetch_products, fetch_products_fused
+from db import get_session
+from models import DB_NAMES
+
+
+@pytest.mark.parametrize("db_name", DB_NAMES)
+@pytest.mark.parametrize("launch_start_days,launch_end_days", [(0, 365), (10, 30)])
+def test_fused_matches_default_path(databases, db_name, launch_start_days, launch_end_days):
+    with get_session(db_name) as session:
+        _, expected = fetch_products(session, db_name, launch_start_days, launch_end_days)
+        _, actual = fetch_products_fused(session, db_name, launch_start_days, launch_end_days)
+
+    assert expected
+    assert {row["item_id"]: row for row in actual} == {row["item_id"]: row for row in expected}
+    assert len(actual) == len(expected)
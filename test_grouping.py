@@ -0,0 +1,18 @@
+from datetime import date
+
+from sqlalchemy.dialects import mysql
+
+from analytics import fused_products_query, grouped_products_query
+
+
+def test_by_name_groups_ignore_the_collation():
+    stmt, _ = grouped_products_query("zing", date(2024, 6, 1), 0, 365)
+    sql = str(stmt.compile(dialect=mysql.dialect()))
+    assert "PARTITION BY CAST(items.`Item_Name` AS BINARY), CAST(items.`Category` AS BINARY)" in sql
+    assert "PARTITION BY items.`Item_Name`" not in sql
+
+
+def test_streamed_rows_are_ordered_by_exact_group():
+    stmt, _ = fused_products_query("zing", date(2024, 6, 1), 0, 365, ordered=True)
+    sql = str(stmt.compile(dialect=mysql.dialect()))
+    assert "ORDER BY CAST(window_items.`Item_Name` AS BINARY), CAST(window_items.`Category` AS BINARY)" in sql
@@ -0,0 +1,43 @@
+from datetime import date
+
+import pytest
+
+import idsets
+from analytics import ALL_QUERIES, query_item_aggregates, query_trailing_totals, window_item_ids
+from db import get_session
+from idsets import choose_strategy, query_by_ids
+
+
+def test_choose_strategy(monkeypatch):
+    monkeypatch.setattr(idsets, "ID_STRATEGY", "auto")
+    monkeypatch.setattr(idsets, "IN_LIST_MAX_IDS", 10)
+    monkeypatch.setattr(idsets, "TEMP_TABLE_MIN_IDS", 100)
+    assert choose_strategy(10, has_source=True) == "in"
+    assert choose_strategy(11, has_source=True) == "semijoin"
+    assert choose_strategy(11, has_source=False) == "chunked"
+    assert choose_strategy(100, has_source=False) == "temp_table"
+    assert choose_strategy(5, has_source=False, strategy="temp_table") == "temp_table"
+    assert choose_strategy(5, has_source=False, strategy="semijoin") == "in"
+
+
+@pytest.mark.parametrize("db_name", ["zing", "adoreaboo"])
+@pytest.mark.parametrize("strategy", ["chunked", "temp_table", "semijoin"])
+def test_strategies_match_in_list(monkeypatch, databases, db_name, strategy):
+    today = date.today()
+    source = window_item_ids(db_name, today, 0, 365)
+    with get_session(db_name) as session:
+        item_ids = [item_id for (item_id,) in session.execute(source)]
+        assert len(item_ids) > 7
+
+        monkeypatch.setattr(idsets, "ID_STRATEGY", "in")
+        expected = query_by_ids(session, query_item_aggregates, db_name, item_ids, ALL_QUERIES)
+        expected_trailing = query_by_ids(session, query_trailing_totals, db_name, item_ids, today)
+
+        monkeypatch.setattr(idsets, "ID_STRATEGY", strategy)
+        monkeypatch.setattr(idsets, "ID_CHUNK_SIZE", 7)
+        actual = query_by_ids(session, query_item_aggregates, db_name, item_ids, ALL_QUERIES, source=source)
+        actual_trailing = query_by_ids(session, query_trailing_totals, db_name, item_ids, today, source=source)
+
+    assert all(expected)
+    assert actual == expected
+    assert actual_trailing == expected_trailing
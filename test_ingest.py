@@ -0,0 +1,122 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select, update
+
+import ingest
+from cache import response_cache
+from db import get_session
+from ingest import RowValidator
+from models import get_tenant
+
+DAY = date(2001, 1, 1)
+
+
+def sale(db_name, item_id):
+    with get_session(db_name) as session:
+        return session.get(get_tenant(db_name).Sale, (DAY, item_id))
+
+
+def ndjson(*records):
+    return "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records)
+
+
+def test_validator_rejects_bad_rows():
+    validator = RowValidator(get_tenant("zing").Sale)
+    assert validator.validate({"Date": "2001-01-01", "Item_Id": "4", "Total_Value": "2.50"}) == {
+        "Date": DAY, "Item_Id": 4, "Total_Value": Decimal("2.50")
+    }
+    for record, error in [
+        ({"Item_Id": 1}, "Date is required"),
+        ({"Date": "2001-01-01", "Item_Id": 1, "Bogus": 1}, "Unknown fields: Bogus"),
+        ({"Date": "2001-01-01", "Item_Id": Decimal("1.5")}, "Item_Id must be an integer"),
+        ({"Date": "2001-01-01", "Item_Id": 1, "Item_Code": "x" * 256}, "Item_Code is longer than 255 characters"),
+        ([1, 2], "Row is not an object"),
+    ]:
+        with pytest.raises(ValueError, match=error):
+            validator.validate(record)
+
+
+def test_ingest_reports_rejected_rows(client):
+    body = ndjson(
+        {"Date": str(DAY), "Item_Id": 1, "Quantity": 5, "Total_Value": 10.5},
+        "not json",
+        {"Date": "2001-13-01", "Item_Id": 2},
+        "",
+        {"Date": str(DAY), "Item_Id": 2, "Quantity": 1.5},
+        {"Date": str(DAY), "Item_Id": 2, "Quantity": 3},
+    )
+    report = client.post("/ingest/sale", params={"db_name": "zing"}, content=body).json()
+
+    assert report["status"] == "Success"
+    assert (report["rows_received"], report["rows_written"], report["rows_rejected"]) == (5, 2, 3)
+    assert [error["line"] for error in report["errors"]] == [2, 3, 5]
+    assert sale("zing", 1).Quantity == 5 and sale("zing", 2).Quantity == 3
+
+
+def test_repeated_keys_are_merged(client):
+    body = ndjson(
+        {"Date": str(DAY), "Item_Id": 3, "Quantity": 1, "Total_Value": 7},
+        {"Date": str(DAY), "Item_Id": 3, "Quantity": 2},
+    )
+    report = client.post("/ingest/sale", params={"db_name": "zing"}, content=body).json()
+    assert report["rows_written"] == 1
+    row = sale("zing", 3)
+    assert (row.Quantity, row.Total_Value) == (2, 7)
+
+    csv_body = f"Date,Item_Id,Quantity\n{DAY},3,4\n"
+    report = client.post("/ingest/sale", params={"db_name": "zing"}, content=csv_body,
+                         headers={"Content-Type": "text/csv"}).json()
+    assert report["rows_written"] == 1
+    row = sale("zing", 3)
+    assert (row.Quantity, row.Total_Value) == (4, 7)
+
+
+def test_rows_before_a_max_errors_stop_are_written(monkeypatch, client):
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 2)
+    body = ndjson(*(
+        {"Date": str(DAY), "Item_Id": item_id, "Quantity": 1} for item_id in (4, 5, 6)
+    ), "bad", "bad", {"Date": str(DAY), "Item_Id": 7, "Quantity": 1})
+    report = client.post("/ingest/sale", params={"db_name": "zing", "max_errors": 1}, content=body).json()
+
+    assert report["status"] == "Ingest stopped"
+    assert report["rows_written"] == 3 and report["batches"] == 2
+    assert sale("zing", 6) is not None and sale("zing", 7) is None
+
+
+@pytest.mark.parametrize("path,params,content,status", [
+    ("/ingest/items", {"db_name": "zing"}, "{}", 404),
+    ("/ingest/sale", {"db_name": "nope"}, "{}", 400),
+    ("/ingest/sale", {"db_name": "zing", "format": "xml"}, "{}", 400),
+    ("/ingest/sale", {"db_name": "zing", "format": "csv"}, "Date,Nope\n1,2\n", 400),
+    ("/ingest/sale", {"db_name": "zing", "format": "csv"}, "Quantity\n1\n", 400),
+])
+def test_unusable_uploads_are_refused(client, path, params, content, status):
+    response = client.post(path, params=params, content=content)
+    assert response.status_code == status
+    assert "detail" in response.json()
+
+
+def test_each_batch_is_stamped_when_it_is_written(monkeypatch, client):
+    Sale = get_tenant("zing").Sale
+    with get_session("zing") as session:
+        session.execute(update(Sale).where(Sale.Date == DAY, Sale.Item_Id.in_([1, 2]))
+                        .values(Updated_At=datetime(2000, 1, 1)))
+        session.commit()
+        started = session.scalar(select(func.current_timestamp()))
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 1)
+    body = ndjson({"Date": str(DAY), "Item_Id": 1, "Quantity": 6}, {"Date": str(DAY), "Item_Id": 2, "Quantity": 7})
+    report = client.post("/ingest/sale", params={"db_name": "zing"}, content=body).json()
+    assert (report["rows_written"], report["batches"]) == (2, 2)
+    # Updated rows are stamped too, not only inserted ones
+    assert sale("zing", 1).Updated_At >= started and sale("zing", 2).Updated_At >= started
+
+
+def test_ingest_drops_the_tenants_cached_responses(client):
+    key = ("products", "zing", 0, 365)
+    response_cache.put(key, "watermark", DAY, "cached")
+    body = ndjson({"Date": str(DAY), "Item_Id": 4, "Quantity": 1})
+    assert client.post("/ingest/sale", params={"db_name": "zing"}, content=body).json()["rows_written"] == 1
+    assert response_cache.get(key, "watermark", DAY) is None
@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from db import get_engine
+from instrumentation import request_timer, stage
+
+
+def test_failed_query_is_not_left_on_the_timing_stack(databases):
+    with get_engine("zing").connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM no_such_table"))
+        assert connection.connection.info.get("query_start") == []
+
+        with request_timer() as timer:
+            with stage("lookup"):
+                connection.execute(text("SELECT 1"))
+        assert timer.stages["lookup"].queries == 1
+        assert connection.connection.info["query_start"] == []
+
+
+def test_fanout_queries_reach_the_request_timer(client):
+    response = client.get("/products/all_tenants",
+                          params={"launch_start_days": 0, "launch_end_days": 365, "use_cache": False})
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert "watermark;" in timing
+    assert "queries=" in timing
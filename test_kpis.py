@@ -0,0 +1,89 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from kpis import TRAILING_FIELDS, _round2, compute_kpis, trailing_fields, trailing_kpis
+
+
+def baseline_kpis(today, launch_date, total_current_stock, total_quantity_sold, last_sale_days_ago):
+    # The per-product rules of the original /products loop
+    day_since_launch = (today - launch_date).days if launch_date else None
+    if last_sale_days_ago is not None and total_current_stock == 0:
+        last_sale_date = today - timedelta(days=last_sale_days_ago)
+        days_active = (last_sale_date - launch_date).days if launch_date and last_sale_date else day_since_launch
+    else:
+        days_active = day_since_launch
+    total_stock_percentage_sold = round((total_quantity_sold / (total_quantity_sold + total_current_stock)) * 100, 2) if (total_quantity_sold + total_current_stock) else 0
+    per_day_qty_average = round((total_quantity_sold / days_active), 2) if days_active else 0
+    projected_days_to_sell_out = round((total_current_stock / per_day_qty_average), 2) if per_day_qty_average else 0
+    return {
+        "day_since_launch": day_since_launch,
+        "total_stock_percentage_sold": total_stock_percentage_sold,
+        "per_day_qty_average": per_day_qty_average,
+        "projected_days_to_sell_out": projected_days_to_sell_out,
+    }
+
+
+def assert_matches_baseline(today, rows):
+    kpis = compute_kpis(today, *zip(*rows))
+    for i, row in enumerate(rows):
+        launch, stock, qty, last_sale = row
+        # Decimal quantities are computed as floats
+        expected = baseline_kpis(today, launch, stock, float(qty) if isinstance(qty, Decimal) else qty, last_sale)
+        actual = {field: values[i] for field, values in kpis.items()}
+        assert actual == expected, row
+        assert [type(value) for value in actual.values()] == [type(value) for value in expected.values()], row
+
+
+def test_half_cent_ratios_round_like_baseline():
+    today = date(2024, 6, 1)
+    # 3 / 40 days = 0.075: round() gives 0.07, a half-up or half-even round
+    # of x * 100 gives 0.08, and projected_days_to_sell_out divides by the
+    # rounded average
+    rows = [
+        (today - timedelta(days=40), 25, 3, None),
+        (today - timedelta(days=40), 25, Decimal(3), None),
+        (today - timedelta(days=8), 0, 1, 0),
+        (today - timedelta(days=8), 0, 0, None),
+        (None, 0, 0, None),
+    ]
+    assert_matches_baseline(today, rows)
+    assert compute_kpis(today, *zip(*rows[:2]))["projected_days_to_sell_out"] == [357.14, 357.14]
+
+
+def test_round2_matches_round():
+    rng = random.Random(3)
+    values = [0.075, 0.125, 0.375, 2.675, 1.005, 0.005, -0.001, -0.125, 0.0, 1e-20, 123456.785]
+    for _ in range(20000):
+        numerator, denominator = rng.randint(0, 100000), rng.randint(1, 5000)
+        values += [numerator / denominator, numerator / denominator * 100, (2 * numerator + 1) / 200,
+                   -numerator / denominator, rng.random() * 1000]
+    assert _round2(np.array(values)).tolist() == [round(value, 2) for value in values]
+
+
+def test_random_rows_match_baseline():
+    rng = random.Random(7)
+    today = date(2024, 6, 1)
+    rows = []
+    for _ in range(5000):
+        launch = None if rng.random() < 0.05 else today - timedelta(days=rng.randint(0, 400))
+        stock = rng.choice([0, 0, rng.randint(0, 500)])
+        qty = rng.randint(0, 500)
+        if rng.random() < 0.5:
+            qty = Decimal(qty)
+        last_sale = None if rng.random() < 0.2 else rng.randint(0, 30)
+        if launch is not None and last_sale is not None:
+            last_sale = min(last_sale, (today - launch).days)
+        rows.append((launch, stock, qty, last_sale))
+    assert_matches_baseline(today, rows)
+
+
+def test_trailing_average_rounds_per_row():
+    qty_field, _, _, per_day_field = trailing_fields(7)
+    results = [{field: None for field in TRAILING_FIELDS} for _ in range(4)]
+    for result, qty in zip(results, [3, Decimal(1), 10, None]):
+        result[qty_field] = qty
+    per_day = trailing_kpis([39, 2, None, 5], results)[per_day_field]
+    assert per_day == [round(3 / 7, 2), round(1 / 3, 2), round(10 / 7, 2), 0]
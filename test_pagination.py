@@ -0,0 +1,62 @@
+import pytest
+
+from pagination import encode_cursor
+
+PARAMS = {"db_name": "zing", "launch_start_days": 0, "launch_end_days": 365}
+
+
+@pytest.mark.parametrize("path,key", [
+    ("/products", lambda row: row["item_id"]),
+    ("/products/by_name", lambda row: (row["item_name"] or "", row["product_type"] or "")),
+])
+@pytest.mark.parametrize("limit", [1, 7])
+def test_pages_cover_the_full_result(client, path, key, limit):
+    expected = client.get(path, params=PARAMS).json()["products"]
+
+    pages, cursor = [], None
+    while True:
+        params = dict(PARAMS, limit=limit, **({"cursor": cursor} if cursor else {}))
+        payload = client.get(path, params=params).json()
+        assert len(payload["products"]) <= limit
+        pages.extend(payload["products"])
+        cursor = payload["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [key(row) for row in pages] == sorted(key(row) for row in pages)
+    assert sorted(pages, key=key) == sorted(expected, key=key)
+
+
+@pytest.mark.parametrize("path,cursor", [
+    ("/products", "not a cursor!"),
+    ("/products", encode_cursor({"key": ["a", "b"]})),
+    ("/products", encode_cursor({"id": "12"})),
+    ("/products", encode_cursor([1])),
+    ("/products/by_name", encode_cursor({"id": 12})),
+    ("/products/by_name", encode_cursor({"key": ["a"]})),
+    ("/products/by_name", encode_cursor({"key": ["a", 1]})),
+    ("/products/by_name", encode_cursor("a")),
+])
+def test_malformed_cursor_is_rejected(client, path, cursor):
+    response = client.get(path, params=dict(PARAMS, limit=5, cursor=cursor))
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+@pytest.mark.parametrize("limit", [1, 4])
+def test_by_name_pages_keep_name_variants_apart(client, name_variants, limit):
+    params = {"db_name": name_variants, "launch_start_days": 0, "launch_end_days": 3, "use_cache": False}
+    expected = client.get("/products/by_name", params=params).json()["products"]
+
+    pages, cursor = [], None
+    while True:
+        payload = client.get("/products/by_name", params=dict(params, limit=limit, **({"cursor": cursor} if cursor else {}))).json()
+        pages.extend(payload["products"])
+        cursor = payload["next_cursor"]
+        if cursor is None:
+            break
+
+    def key(row):
+        return row["item_name"] or "", row["product_type"] or "", row["item_name"] is not None
+    assert len(pages) == len(expected) == len({key(row) for row in pages})
+    assert sorted(pages, key=key) == sorted(expected, key=key)
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import db
+from db import DB_REPLICA_MAX_LAG_SECONDS, choose_replica, get_async_read_session, get_engine, get_read_session
+
+DB_NAME = "zing"
+
+
+@pytest.fixture
+def replicas(monkeypatch, databases):
+    """
+    Two healthy, up-to-date replicas of DB_NAME on copies of its SQLite URL.
+    The monitor is not started, so tests set health and lag themselves.
+    """
+    monkeypatch.setattr(db, "_ensure_monitor", lambda: None)
+    replicas = [db.Replica(DB_NAME, index, db.get_url(DB_NAME)) for index in (1, 2)]
+    for replica in replicas:
+        replica.healthy = True
+        replica.lag_seconds = 0.0
+    monkeypatch.setitem(db._replicas, DB_NAME, replicas)
+    yield replicas
+    for replica in replicas:
+        if replica.engine is not None:
+            replica.engine.dispose()
+
+
+def test_lagging_replicas_fall_back_to_the_primary(replicas):
+    for replica in replicas:
+        replica.lag_seconds = DB_REPLICA_MAX_LAG_SECONDS + 1
+    assert choose_replica(DB_NAME) is None
+    with get_read_session(DB_NAME) as session:
+        assert session.get_bind() is get_engine(DB_NAME)
+
+
+def test_unhealthy_replicas_are_skipped(replicas):
+    replicas[0].healthy = False
+    assert [choose_replica(DB_NAME) for _ in range(4)] == [replicas[1]] * 4
+    with get_read_session(DB_NAME) as session:
+        assert session.get_bind() is replicas[1].engine
+
+
+def test_equal_replicas_take_turns(replicas):
+    chosen = [choose_replica(DB_NAME) for _ in range(6)]
+    assert set(chosen) == set(replicas)
+    assert all(first is not second for first, second in zip(chosen, chosen[1:]))
+
+
+def test_async_sub_queries_read_one_replica(replicas):
+    async def bind():
+        async with get_async_read_session(DB_NAME) as session:
+            return session.bind
+
+    async def request():
+        try:
+            first = await bind()
+            return [first, *await asyncio.gather(*(bind() for _ in range(6)))]
+        finally:
+            for replica in replicas:
+                if replica.async_engine is not None:
+                    await replica.async_engine.dispose()
+
+    binds = asyncio.run(request())
+    assert len(set(binds)) == 1
+    assert binds[0] in [replica.async_engine for replica in replicas]
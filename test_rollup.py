@@ -0,0 +1,128 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, select, update
+
+import warmer
+from analytics import fetch_products
+from cache import get_data_watermark
+from db import get_engine, get_session
+from models import get_db_model
+from models.model_rollup import ItemRollup, RollupState
+from rollup import data_watermark, refresh_rollup, rollup_is_fresh
+
+DB_NAME = "adoreaboo"
+
+
+def count_queries(fn):
+    statements = []
+
+    def before(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = get_engine(DB_NAME)
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        return fn(), len(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+
+def test_freshness_is_cached_per_watermark(databases):
+    refresh_rollup(DB_NAME)
+    with get_session(DB_NAME) as session:
+        watermark = get_data_watermark(session, DB_NAME)
+        with data_watermark(watermark):
+            assert count_queries(lambda: rollup_is_fresh(session, DB_NAME)) == (True, 1)
+            assert count_queries(lambda: rollup_is_fresh(session, DB_NAME)) == (True, 0)
+        newer = (watermark[0], watermark[1], datetime(2999, 1, 1))
+        with data_watermark(newer):
+            assert count_queries(lambda: rollup_is_fresh(session, DB_NAME)) == (False, 1)
+            assert count_queries(lambda: rollup_is_fresh(session, DB_NAME)) == (False, 0)
+
+
+def test_warmer_refreshes_the_rollup_after_ingest(monkeypatch, client):
+    refresh_rollup(DB_NAME)
+    # Updated_At has one-second resolution
+    time.sleep(1.1)
+    body = '{"Date": "2002-02-02", "Item_Id": 1, "Quantity": 40}'
+    assert client.post("/ingest/sale", params={"db_name": DB_NAME}, content=body).json()["rows_written"] == 1
+    with get_session(DB_NAME) as session:
+        assert not rollup_is_fresh(session, DB_NAME)
+
+    monkeypatch.setattr(warmer, "WARM_FETCHES", ())
+    warmer.warm_tenant(DB_NAME, [(0, 365)], force=True)
+
+    with get_session(DB_NAME) as session:
+        assert rollup_is_fresh(session, DB_NAME)
+        _, products = fetch_products(session, DB_NAME, 0, 365)
+    monkeypatch.setattr("rollup.ROLLUP_ENABLED", False)
+    with get_session(DB_NAME) as session:
+        _, raw_products = fetch_products(session, DB_NAME, 0, 365)
+    totals = ("item_id", "total_quantity_sold", "total_views", "total_atc")
+    assert [[row[field] for field in totals] for row in products] == \
+        [[row[field] for field in totals] for row in raw_products]
+    assert products[0]["total_quantity_sold"] >= 40
+
+
+def rollup_matches_sale(session):
+    Item, Sale, ViewsAtc = get_db_model(DB_NAME)
+    raw = dict(session.execute(select(Sale.Item_Id, func.sum(Sale.Quantity)).group_by(Sale.Item_Id)).all())
+    rolled = dict(session.execute(
+        select(ItemRollup.Item_Id, ItemRollup.Qty_Sold).where(ItemRollup.Sale_Count > 0)
+    ).all())
+    return rolled == raw
+
+
+def test_deleted_rows_make_the_rollup_stale(databases):
+    Item, Sale, ViewsAtc = get_db_model(DB_NAME)
+    table = Sale.__table__
+    refresh_rollup(DB_NAME)
+    with get_session(DB_NAME) as session:
+        row = session.execute(select(table).limit(1)).mappings().one()
+        session.execute(delete(table).where(
+            table.c[Sale.Item_Id.key] == row[Sale.Item_Id.key], table.c[Sale.Date.key] == row[Sale.Date.key]
+        ))
+        session.commit()
+        try:
+            assert not rollup_is_fresh(session, DB_NAME)
+            refresh_rollup(DB_NAME)
+            assert rollup_is_fresh(session, DB_NAME)
+            assert rollup_matches_sale(session)
+        finally:
+            session.execute(insert(table).values(dict(row)))
+            session.commit()
+            refresh_rollup(DB_NAME)
+
+
+def test_refresh_rereads_rows_committed_behind_the_watermark(databases):
+    Item, Sale, ViewsAtc = get_db_model(DB_NAME)
+    table = Sale.__table__
+    item_id, sale_date, quantity = (table.c[Sale.Item_Id.key], table.c[Sale.Date.key], table.c[Sale.Quantity.key])
+    refresh_rollup(DB_NAME)
+    with get_session(DB_NAME) as session:
+        watermark = session.get(RollupState, "sale").Watermark
+        first = session.execute(select(item_id, sale_date, quantity).limit(1)).one()
+        other = session.execute(select(item_id, sale_date).where(item_id != first[0]).limit(1)).one()
+        rows = [first, other]
+        try:
+            # Stamped before the rollup watermark, as by a transaction that
+            # committed after the last refresh read it
+            session.execute(update(table).where(item_id == rows[0][0]).values(
+                {Sale.Updated_At.key: watermark - timedelta(seconds=30)}
+            ))
+            session.execute(update(table).where(item_id == rows[0][0], sale_date == rows[0][1]).values(
+                {Sale.Quantity.key: rows[0][2] + 5, Sale.Updated_At.key: watermark - timedelta(seconds=30)}
+            ))
+            session.execute(update(table).where(item_id == rows[1][0], sale_date == rows[1][1]).values(
+                {Sale.Updated_At.key: watermark + timedelta(seconds=1)}
+            ))
+            session.commit()
+            refresh_rollup(DB_NAME)
+            assert rollup_matches_sale(session)
+        finally:
+            session.execute(update(table).where(item_id == rows[0][0], sale_date == rows[0][1]).values(
+                {Sale.Quantity.key: rows[0][2]}
+            ))
+            session.commit()
+            refresh_rollup(DB_NAME)
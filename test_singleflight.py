@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import SingleFlight, cached_fetch, cached_fetch_async, in_flight
+from db import get_session
+
+
+def test_followers_join_the_leader():
+    flights = SingleFlight()
+    future, leader = flights.begin("key")
+    joined, follower = flights.begin("key")
+    fresh, fresh_leader = flights.begin("key", join=False)
+    assert leader and not follower and fresh_leader
+    assert joined is future and fresh is not future
+
+    flights.finish("key", future, error=ValueError("boom"))
+    with pytest.raises(ValueError, match="boom"):
+        joined.result()
+    assert flights.stats()["in_flight"] == 0
+    assert flights.begin("key")[1]
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_waiters_get_the_leaders_error(databases):
+    calls = []
+    started, release = threading.Event(), threading.Event()
+
+    def failing_fetch(session, db_name, launch_start_days, launch_end_days):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise RuntimeError("query failed")
+
+    errors = []
+
+    def request():
+        with get_session("zing") as session:
+            try:
+                cached_fetch(session, failing_fetch, "zing", 0, 30)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+    coalesced = in_flight.coalesced
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=request) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    wait_for(lambda: in_flight.coalesced == coalesced + 3)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert errors == ["query failed"] * 4
+    assert in_flight.stats()["in_flight"] == 0
+
+
+class SyncBackedSession:
+    """
+    The AsyncSession methods cached_fetch_async uses, run on a sync Session.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def run_sync(self, fn, *args):
+        return fn(self.session, *args)
+
+    async def rollback(self):
+        self.session.rollback()
+
+
+def fetch_products_stub(session, db_name, launch_start_days, launch_end_days):
+    raise AssertionError("the async fetch is used")
+
+
+def test_cancelled_leader_hands_over_to_a_waiter(databases):
+    calls = []
+
+    async def fetch_async(db_name, launch_start_days, launch_end_days):
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(60)
+        return "today", ["result"]
+
+    async def main():
+        with get_session("zing") as leader_session, get_session("zing") as waiter_session:
+            leader = asyncio.create_task(cached_fetch_async(
+                SyncBackedSession(leader_session), fetch_products_stub, fetch_async, "zing", 0, 31))
+            while not calls:
+                await asyncio.sleep(0.01)
+            coalesced = in_flight.coalesced
+            waiter = asyncio.create_task(cached_fetch_async(
+                SyncBackedSession(waiter_session), fetch_products_stub, fetch_async, "zing", 0, 31))
+            while in_flight.coalesced == coalesced:
+                await asyncio.sleep(0.01)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return await asyncio.wait_for(waiter, 5)
+
+    assert asyncio.run(main()) == ("today", ["result"])
+    assert len(calls) == 2
@@ -0,0 +1,196 @@
+"""
+Precomputes the cached results of the dashboards' launch windows.
+
+A scheduler thread started with the app checks every tenant's data watermark
+each WARM_INTERVAL_SECONDS (and right after midnight). When the watermark or
+the date changed since a tenant was last warmed, /products and
+/products/by_name are computed for each of its WARM_WINDOWS through the
+response cache, so the first viewer after a data load gets a cached result.
+A tenant's rollup is refreshed before it is warmed if it is behind. At most WARM_CONCURRENCY tenants are warmed at a time.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from analytics import fetch_products, fetch_products_by_name
+from cache import cached_fetch, get_data_watermark
+from db import get_read_session
+from instrumentation import Counter, METRICS, request_timer, record_request
+from models import DB_NAMES
+from rollup import refresh_stale_rollup
+
+WARM_ENABLED = os.getenv("WARM_ENABLED", "true").lower() in ("1", "true", "yes")
+WARM_WINDOWS = os.getenv("WARM_WINDOWS", "0-30,31-90,91-180")
+WARM_DB_NAMES = tuple(name.strip() for name in os.getenv("WARM_DB_NAMES", ",".join(DB_NAMES)).split(",") if name.strip())
+WARM_INTERVAL_SECONDS = float(os.getenv("WARM_INTERVAL_SECONDS", "60"))
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "1"))
+
+WARM_FETCHES = (fetch_products, fetch_products_by_name)
+
+warm_count = Counter("analytics_cache_warm_total", "Results precomputed by the cache warmer", ("db_name", "fetch", "status"))
+METRICS.append(warm_count)
+
+logger = logging.getLogger(__name__)
+
+_progress = {}
+_progress_lock = threading.Lock()
+_warmed = {}
+_run_info = {"runs": 0, "running": False, "last_run_started_at": None, "last_run_finished_at": None}
+_scheduler = None
+_executor = None
+_stop = threading.Event()
+_wake = threading.Event()
+_force = threading.Event()
+
+
+def parse_windows(spec: str, db_names=WARM_DB_NAMES):
+    """
+    Parses WARM_WINDOWS, comma-separated "start-end" launch windows in days,
+    each optionally prefixed with "db_name:" to warm it for one tenant only.
+    Returns {db_name: [(launch_start_days, launch_end_days), ...]}.
+    """
+    windows = {db_name: [] for db_name in db_names}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        db_name, _, window = entry.rpartition(":")
+        start, end = (int(days) for days in window.split("-"))
+        for name in ([db_name] if db_name else db_names):
+            if name in windows and (start, end) not in windows[name]:
+                windows[name].append((start, end))
+    return {db_name: targets for db_name, targets in windows.items() if targets}
+
+
+def _set_progress(db_name: str, **values):
+    with _progress_lock:
+        _progress.setdefault(db_name, {}).update(values)
+
+
+def warm_tenant(db_name: str, windows, force: bool = False):
+    """
+    Computes every fetch in WARM_FETCHES for db_name's windows unless the
+    tenant was already warmed at its current watermark today. Results that
+    live traffic already cached are kept unless force is set. The tenant's
+    rollup is brought up to date first, so the results use it.
+    """
+    try:
+        if refresh_stale_rollup(db_name) is not None:
+            _set_progress(db_name, rollup_refreshed_at=datetime.now().isoformat(timespec="seconds"))
+    except Exception:
+        logger.exception("Rollup refresh failed on %s", db_name)
+
+    with get_read_session(db_name) as session:
+        watermark = get_data_watermark(session, db_name)
+        today = date.today()
+        if not force and _warmed.get(db_name) == (watermark, today):
+            _set_progress(db_name, status="warm", checked_at=datetime.now().isoformat(timespec="seconds"))
+            return
+
+        _set_progress(db_name, status="warming", warmed=0, total=len(windows) * len(WARM_FETCHES), error=None)
+        start = time.perf_counter()
+        for launch_start_days, launch_end_days in windows:
+            for fetch in WARM_FETCHES:
+                with request_timer() as timer:
+                    try:
+                        cached_fetch(session, fetch, db_name, launch_start_days, launch_end_days, not force,
+                                     watermark=watermark)
+                    except Exception as e:
+                        warm_count.inc((db_name, fetch.__name__, "failed"))
+                        _set_progress(db_name, status="failed", error=f"{fetch.__name__} {launch_start_days}-{launch_end_days}: {e}")
+                        raise
+                    record_request(timer, "warmer", db_name, time.perf_counter() - timer.start)
+                warm_count.inc((db_name, fetch.__name__, "warmed"))
+                with _progress_lock:
+                    _progress[db_name]["warmed"] += 1
+
+        _warmed[db_name] = (watermark, today)
+        now = datetime.now().isoformat(timespec="seconds")
+        _set_progress(db_name, status="warm", watermark=watermark, warmed_at=now, checked_at=now,
+                      elapsed_ms=round((time.perf_counter() - start) * 1000, 2))
+
+
+def run_once(force: bool = False):
+    """
+    Warms every configured tenant on the warmer's worker threads and waits
+    for them to finish. A failing tenant does not stop the others.
+    """
+    targets = parse_windows(WARM_WINDOWS)
+    _run_info.update(running=True, last_run_started_at=datetime.now().isoformat(timespec="seconds"))
+    executor = _executor or ThreadPoolExecutor(max_workers=WARM_CONCURRENCY, thread_name_prefix="warmer")
+    try:
+        futures = [executor.submit(warm_tenant, db_name, windows, force) for db_name, windows in targets.items()]
+        for db_name, future in zip(targets, futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception("Cache warmer failed on %s", db_name)
+                _set_progress(db_name, status="failed", error=str(e))
+    finally:
+        if executor is not _executor:
+            executor.shutdown()
+        _run_info["runs"] += 1
+        _run_info.update(running=False, last_run_finished_at=datetime.now().isoformat(timespec="seconds"))
+
+
+def _seconds_to_midnight():
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    return (tomorrow - datetime.now()).total_seconds()
+
+
+def _schedule():
+    while not _stop.is_set():
+        force = _force.is_set()
+        _force.clear()
+        try:
+            run_once(force)
+        except Exception:
+            logger.exception("Cache warmer run failed")
+        # Wake up right after midnight as well, since every cached result expires then
+        _wake.wait(min(WARM_INTERVAL_SECONDS, _seconds_to_midnight() + 1))
+        _wake.clear()
+
+
+def trigger(force: bool = False):
+    """
+    Starts a warmer run now; with force=True tenants are recomputed even if
+    their watermark is unchanged.
+    """
+    if force:
+        _force.set()
+    _wake.set()
+
+
+def start_warmer():
+    global _scheduler, _executor
+    if not WARM_ENABLED or _scheduler is not None:
+        return
+    _stop.clear()
+    _executor = ThreadPoolExecutor(max_workers=WARM_CONCURRENCY, thread_name_prefix="warmer")
+    _scheduler = threading.Thread(target=_schedule, name="cache-warmer", daemon=True)
+    _scheduler.start()
+
+
+def stop_warmer():
+    global _scheduler, _executor
+    if _scheduler is None:
+        return
+    _stop.set()
+    _wake.set()
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _scheduler.join(timeout=5)
+    _scheduler = _executor = None
+
+
+def warmer_status():
+    with _progress_lock:
+        tenants = {db_name: dict(progress) for db_name, progress in _progress.items()}
+    return {
+        "enabled": WARM_ENABLED,
+        "windows": {db_name: [f"{start}-{end}" for start, end in windows] for db_name, windows in parse_windows(WARM_WINDOWS).items()},
+        **_run_info,
+        "tenants": tenants,
+    }